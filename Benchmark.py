@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Author: Helton Dória Costa <helton.doria@gmail.com>
+# Copyright (C) 2016-2016
+# URL: <http://github.com/heltondoria/information_retrival>
+# For license information, see LICENSE.TXT
+"""
+Module responsible for measuring the index and search engines over synthetic corpora
+"""
+import argparse
+import collections
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from Crawler import SimpleTxtCrawler
+from Dal import BinaryFileDal, CSVFileDal, SqliteDal
+from IndexEngine import IndexEngine, load_index
+from Normalizer import SnowballStemmerNormalizer
+from SearchEngine import SearchEngine
+from Tokenizer import EnglishRegexpTokenizer, SinglePassAnalyzer
+
+CONSONANTS = 'bcdfghjklmnprstvz'
+VOWELS = 'aeiou'
+QUERY_SIZES = (1, 3, 10)
+
+
+def synthetic_word(rank):
+    """
+    Build a pronounceable word for a rank of the vocabulary, with at least two syllables, so it
+    is not taken for a stopword.
+    :param rank: the rank of the word, from 0
+    :return: the word
+    """
+    syllables = list()
+    rank += len(CONSONANTS) * len(VOWELS)
+    while rank:
+        rank, syllable = divmod(rank, len(CONSONANTS) * len(VOWELS))
+        syllables.append(CONSONANTS[syllable // len(VOWELS)] + VOWELS[syllable % len(VOWELS)])
+    return ''.join(syllables)
+
+
+class ZipfSampler:
+    """
+    A sampler of the words of a synthetic vocabulary, in which the frequency of the word of rank r
+    is proportional to 1 / r^exponent, like the words of natural languages.
+    """
+
+    def __init__(self, vocabulary, exponent=1.0, seed=None):
+        """
+        :param vocabulary: number of distinct words
+        :param exponent: the exponent of the Zipf law
+        :param seed: seed of the random generator
+        """
+        self.words = [synthetic_word(rank) for rank in range(vocabulary)]
+        self.cumulative = list(itertools.accumulate(1 / rank ** exponent
+                                                    for rank in range(1, vocabulary + 1)))
+        self.random = random.Random(seed)
+
+    def sample(self, count):
+        """
+        :param count: number of words to be drawn
+        :return: a list with the words drawn
+        """
+        return self.random.choices(self.words, cum_weights=self.cumulative, k=count)
+
+
+def generate_corpus(path, documents, length, sampler):
+    """
+    Write a synthetic corpus of txt files.
+    :param path: directory where the files are written
+    :param documents: number of documents
+    :param length: average number of words of a document. The lengths are drawn uniformly
+    between half and one and a half of it.
+    :param sampler: the ZipfSampler that draws the words
+    """
+    os.makedirs(path, exist_ok=True)
+    for number in range(documents):
+        words = sampler.sample(sampler.random.randint(length // 2 or 1, length * 3 // 2 or 1))
+        with open(os.path.join(path, 'document{:07d}.txt'.format(number)), 'w') as file:
+            file.write(' '.join(words))
+
+
+def directory_size(path):
+    """
+    :return: the number of bytes of the files under path
+    """
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+def percentiles(samples):
+    """
+    Summarize latencies.
+    :param samples: list of latencies, in seconds
+    :return: a dict with the mean, the 50th, 90th and 99th percentiles and the maximum, in
+    milliseconds
+    """
+    samples = sorted(samples)
+    if not samples:
+        return dict()
+
+    def percentile(fraction):
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))] * 1000
+
+    return {'mean': sum(samples) / len(samples) * 1000, 'p50': percentile(0.50),
+            'p90': percentile(0.90), 'p99': percentile(0.99), 'max': samples[-1] * 1000}
+
+
+def create_dal(kind, path):
+    """
+    :param kind: 'csv', 'binary', 'varbyte' or 'sqlite'
+    :param path: directory of the index
+    :return: the Dao of the index
+    """
+    if kind == 'csv':
+        return CSVFileDal(path)
+    if kind == 'sqlite':
+        return SqliteDal(path)
+    return BinaryFileDal(path, compression='varbyte' if kind == 'varbyte' else None)
+
+
+def run(documents=1000, length=200, vocabulary=20000, exponent=1.0, queries=200, k=10,
+        dal='csv', seed=42, path=None):
+    """
+    Generate a corpus, index it and search it, measuring every step.
+    :param documents: number of documents of the corpus
+    :param length: average number of words of a document
+    :param vocabulary: number of distinct words of the corpus
+    :param exponent: exponent of the Zipf law followed by the words
+    :param queries: number of queries of each size
+    :param k: number of documents returned by the top-k searches
+    :param dal: format of the index: 'csv', 'binary', 'varbyte' or 'sqlite'
+    :param seed: seed of the random generator
+    :param path: directory where the corpus and the index are written. If not provided, a
+    temporary directory is used and removed at the end.
+    :return: a dict with the parameters and the measurements
+    """
+    base = path or tempfile.mkdtemp(prefix='benchmark-')
+    corpus, index = os.path.join(base, 'corpus'), os.path.join(base, 'index')
+    sampler = ZipfSampler(vocabulary, exponent, seed)
+    try:
+        generate_corpus(corpus, documents, length, sampler)
+        result = {'parameters': {'documents': documents, 'length': length,
+                                 'vocabulary': vocabulary, 'exponent': exponent,
+                                 'queries': queries, 'k': k, 'dal': dal, 'seed': seed,
+                                 'python': sys.version.split()[0]}}
+        indexer = IndexEngine(dal=create_dal(dal, index))
+        indexer.reset()
+        crawler = SimpleTxtCrawler()
+        start = time.perf_counter()
+        entries = crawler.parse(crawler.load(corpus))
+        indexer.add_documents(entries)
+        elapsed = time.perf_counter() - start
+        tokens = sum(len(entry[1]) for entry in entries.values())
+        result['ingest'] = {'seconds': elapsed, 'documents': len(entries), 'tokens': tokens,
+                            'docs_per_second': len(entries) / elapsed,
+                            'tokens_per_second': tokens / elapsed,
+                            'terms': len(indexer.inverted_index)}
+        result['index'] = {'bytes': directory_size(index), 'corpus_bytes': directory_size(corpus)}
+        start = time.perf_counter()
+        load_index(create_dal(dal, index))
+        result['load'] = {'seconds': time.perf_counter() - start}
+        searcher = SearchEngine(dal=create_dal(dal, index), resident=True)
+        searcher.search(' '.join(sampler.sample(1)))
+        result['search'] = dict()
+        for size in QUERY_SIZES:
+            sentences = [' '.join(sampler.sample(size)) for _ in range(queries)]
+            for name, top in (('all', None), ('top_k', k)):
+                latencies = list()
+                for sentence in sentences:
+                    start = time.perf_counter()
+                    searcher.search(sentence, top)
+                    latencies.append(time.perf_counter() - start)
+                result['search']['{}_terms_{}'.format(size, name)] = percentiles(latencies)
+        return result
+    finally:
+        if not path:
+            shutil.rmtree(base, ignore_errors=True)
+
+
+def compare_analyzers(documents=1000, length=200, vocabulary=20000, exponent=1.0, seed=42,
+                      path=None):
+    """
+    Generate a corpus and turn it into stems with the EnglishRegexpTokenizer followed by the
+    SnowballStemmerNormalizer, and with the SinglePassAnalyzer, over texts and over files mapped
+    in memory. Each chain runs once to warm up its stem cache before it is measured.
+    :param documents: number of documents of the corpus
+    :param length: average number of words of a document
+    :param vocabulary: number of distinct words of the corpus
+    :param exponent: exponent of the Zipf law followed by the words
+    :param seed: seed of the random generator
+    :param path: directory where the corpus is written. If not provided, a temporary directory
+    is used and removed at the end.
+    :return: a dict with the parameters and the throughput of each chain
+    """
+    base = path or tempfile.mkdtemp(prefix='benchmark-')
+    corpus = os.path.join(base, 'corpus')
+    try:
+        generate_corpus(corpus, documents, length, ZipfSampler(vocabulary, exponent, seed))
+        names = sorted(os.path.join(corpus, name) for name in os.listdir(corpus))
+        texts = list()
+        for name in names:
+            with open(name) as file:
+                texts.append(file.read())
+        tokenizer, normalizer = EnglishRegexpTokenizer(), SnowballStemmerNormalizer()
+        analyzer = SinglePassAnalyzer()
+        chains = (('tokenizer_normalizer', lambda: (stem for text in texts for stem in
+                                                    normalizer.normalize_list(
+                                                        tokenizer.tokenize(text)))),
+                  ('single_pass', lambda: (stem for text in texts
+                                           for stem in analyzer.analyze(text))),
+                  ('single_pass_mmap', lambda: (stem for name in names
+                                                for stem in analyzer.analyze_file(name))))
+        result = {'parameters': {'documents': documents, 'length': length,
+                                 'vocabulary': vocabulary, 'exponent': exponent, 'seed': seed,
+                                 'python': sys.version.split()[0]},
+                  'analyzers': dict()}
+        for name, chain in chains:
+            collections.deque(chain(), maxlen=0)
+            start = time.perf_counter()
+            tokens = sum(1 for _ in chain())
+            elapsed = time.perf_counter() - start
+            result['analyzers'][name] = {'seconds': elapsed, 'tokens': tokens,
+                                         'tokens_per_second': tokens / elapsed}
+        baseline = result['analyzers']['tokenizer_normalizer']['tokens_per_second']
+        for measures in result['analyzers'].values():
+            measures['speedup'] = measures['tokens_per_second'] / baseline
+        return result
+    finally:
+        if not path:
+            shutil.rmtree(base, ignore_errors=True)
+
+
+def main():
+    """
+    Run the benchmark with the arguments of the command line and print the results as JSON
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--documents', type=int, default=1000)
+    parser.add_argument('--length', type=int, default=200, help='average words per document')
+    parser.add_argument('--vocabulary', type=int, default=20000, help='distinct words')
+    parser.add_argument('--exponent', type=float, default=1.0, help='exponent of the Zipf law')
+    parser.add_argument('--queries', type=int, default=200, help='queries of each size')
+    parser.add_argument('--k', type=int, default=10, help='documents of the top-k searches')
+    parser.add_argument('--dal', choices=('csv', 'binary', 'varbyte', 'sqlite'), default='csv')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--path', help='keep the corpus and the index in this directory')
+    parser.add_argument('--output', help='file where the results are written')
+    parser.add_argument('--analyzers', action='store_true',
+                        help='compare the throughput of the analyzers instead of the engines')
+    args = parser.parse_args()
+    if args.analyzers:
+        result = compare_analyzers(args.documents, args.length, args.vocabulary, args.exponent,
+                                   args.seed, args.path)
+    else:
+        result = run(args.documents, args.length, args.vocabulary, args.exponent, args.queries,
+                     args.k, args.dal, args.seed, args.path)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(result, file, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
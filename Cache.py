@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# Author: Helton Dória Costa <helton.doria@gmail.com>
+# Copyright (C) 2016-2016
+# URL: <http://github.com/heltondoria/information_retrival>
+# For license information, see LICENSE.TXT
+"""
+Module that contains caches shared by the normalizers and the engines
+"""
+import collections
+import sys
+import threading
+import time
+
+
+def sizeof(value):
+    """
+    Estimate the number of bytes taken by a value, following the items of lists, tuples, sets
+    and dicts.
+    :param value: the value to be measured
+    :return: the estimated size in bytes
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sizeof(key) + sizeof(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(sizeof(item) for item in value)
+    return size
+
+
+class LRUCache:
+    """
+    A thread safe cache that evicts the least recently used entries once it holds maxsize of
+    them or max_bytes of data, and expires entries older than ttl seconds, counting its hits and
+    misses.
+    """
+
+    def __init__(self, maxsize=None, max_bytes=None, ttl=None):
+        """
+        Creates a new instance of the LRUCache.
+        :param maxsize: maximum number of entries. If None, the number of entries is unbounded and
+        if 0, the cache is disabled.
+        :param max_bytes: maximum number of bytes taken by the entries, as estimated by sizeof. If
+        None, the size of the entries is not tracked.
+        :param ttl: number of seconds an entry lives. If None, entries never expire.
+        """
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.sizes = dict()
+        self.expires = dict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """
+        Look up an entry, marking it as the most recently used.
+        :return: the cached value or default, if the key is not in the cache or has expired
+        """
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if self.ttl is not None and self.expires[key] < time.monotonic():
+                self.__remove(key)
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Store an entry, evicting the least recently used ones if the cache is full.
+        """
+        if self.maxsize == 0:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.__remove(key)
+            self.entries[key] = value
+            if self.max_bytes is not None:
+                self.sizes[key] = sizeof(key) + sizeof(value)
+                self.bytes += self.sizes[key]
+            if self.ttl is not None:
+                self.expires[key] = time.monotonic() + self.ttl
+            while (self.maxsize is not None and len(self.entries) > self.maxsize) or \
+                    (self.max_bytes is not None and self.bytes > self.max_bytes and self.entries):
+                self.__remove(next(iter(self.entries)))
+
+    def __remove(self, key):
+        """
+        Remove an entry and its bookkeeping. Must be called holding the lock.
+        """
+        del self.entries[key]
+        self.bytes -= self.sizes.pop(key, 0)
+        self.expires.pop(key, None)
+
+    def items(self):
+        """
+        :return: a list with the cached entries, from the least to the most recently used
+        """
+        with self.lock:
+            return list(self.entries.items())
+
+    def clear(self):
+        """
+        Remove all entries, keeping the counters.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.expires.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getstate__(self):
+        # Locks can't be pickled, i.e. to give a normalizer to the workers of a
+        # ParallelIngestPipeline started with spawn
+        with self.lock:
+            state = dict(self.__dict__)
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def info(self):
+        """
+        :return: a dict with the hits, misses, hit rate, current size, maximum size and bytes
+        taken by the cache
+        """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self.entries), 'maxsize': self.maxsize, 'bytes': self.bytes,
+                'max_bytes': self.max_bytes}
@@ -7,12 +7,22 @@
 Module that contains classes responsible to obtain and parse documents to be indexed
 """
 import collections
+import hashlib
 import os
 import uuid
 from abc import ABCMeta, abstractmethod
 
+from Metrics import METRICS
 from Tokenizer import EnglishRegexpTokenizer
 
+CRAWL_MANIFEST = 'crawl_manifest.csv'
+
+# The documents found by a recrawl: added and modified are dicts in the format returned by the
+# parse method of a Crawler, deleted is a dict with the key of each deleted document bound to its
+# full path name and manifest is the crawl manifest to be saved once the changes are indexed
+CrawlChanges = collections.namedtuple('CrawlChanges', ['added', 'modified', 'deleted',
+                                                       'manifest'])
+
 
 def list_files(directory):
     """
@@ -24,6 +34,47 @@ def list_files(directory):
             yield os.path.join(path, file)
 
 
+def scan_files(directory, extension='.txt'):
+    """
+    Navigate in a directory with os.scandir, which gives the stat of each file without another
+    system call on most platforms
+    :param directory: the directory to be inspected
+    :param extension: the extension of the files to be listed
+    :return: Yields a tuple with the full path name of each file and its stat
+    """
+    directories = [directory]
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    directories.append(entry.path)
+                elif entry.name.endswith(extension) and entry.is_file():
+                    yield entry.path, entry.stat()
+
+
+def load_crawl_manifest(dal):
+    """
+    Load the crawl manifest kept next to the index.
+    :param dal: the Dao where the index is persisted
+    :return: a dict with the full path name of each file crawled bound to a tuple with its size,
+    its modification time in nanoseconds and the hash of its contents, or an empty dict
+    """
+    try:
+        return dict(dal.load(CRAWL_MANIFEST))
+    except FileNotFoundError:
+        return dict()
+
+
+def save_crawl_manifest(dal, manifest):
+    """
+    Persist the crawl manifest next to the index. It must be called after the changes found by
+    the recrawl were indexed, so a crash in between makes the next recrawl find them again.
+    :param dal: the Dao where the index is persisted
+    :param manifest: the manifest of a CrawlChanges
+    """
+    dal.save(manifest, CRAWL_MANIFEST)
+
+
 class Crawler(metaclass=ABCMeta):
     """
     Abstract class responsible to define a common interface for crawlers.
@@ -49,14 +100,29 @@ class Crawler(metaclass=ABCMeta):
         """
         pass
 
+    def stream(self, path):
+        """
+        Load and tokenize the documents in the given path or uri one at a time. Crawlers that
+        can't stream their documents fall back to load and parse.
+        :param path: Path from which the files should be loaded
+        :return: Yields a tuple with the uuid of a document and a tuple with its full path name
+        and the list of its tokens
+        """
+        yield from self.parse(self.load(path)).items()
+
 
 class SimpleTxtCrawler(Crawler):
     """
     A simple web crawler that implements the interface of the abstract class Crawler
     """
 
-    def __init__(self):
-        self.tokenizer = EnglishRegexpTokenizer()
+    def __init__(self, analyzer=None):
+        """
+        :param analyzer: a Tokenizer.SinglePassAnalyzer that tokenizes the documents, folding
+        their case. It must also be given to the IndexEngine and to the SearchEngine of the
+        index. If not provided, uses an EnglishRegexpTokenizer.
+        """
+        self.tokenizer = analyzer if analyzer is not None else EnglishRegexpTokenizer()
 
     def load(self, path):
         """
@@ -65,17 +131,91 @@ class SimpleTxtCrawler(Crawler):
         :return: A dict containing a uuid as key and tuple with the full path name of
           the file and its contents.
         """
-        txt_files = sorted([file for file in list_files(path) if file.endswith('.txt')])
+        return self.load_files(self.files(path))
 
+    @staticmethod
+    def files(path):
+        """
+        List the txt documents in the path
+        :param path: Path from which the files should be loaded
+        :return: A sorted list with the full path name of the files
+        """
+        return sorted([file for file in list_files(path) if file.endswith('.txt')])
+
+    def load_files(self, txt_files):
+        """
+        Load a list of txt documents
+        :param txt_files: list with the full path name of the files, as returned by files
+        :return: A dict containing a uuid as key and tuple with the full path name of
+          the file and its contents.
+        """
         documents = collections.defaultdict(set)
         if len(txt_files) > 0:
-            for file_name in sorted(txt_files):
-                file = open(file_name)
-                uid = str(uuid.uuid5(uuid.NAMESPACE_DNS, file_name))
-                documents[uid] = (file_name, file.read())
-                file.close()
+            with METRICS.timer('crawler.load'):
+                for file_name in sorted(txt_files):
+                    file = open(file_name)
+                    uid = str(uuid.uuid5(uuid.NAMESPACE_DNS, file_name))
+                    documents[uid] = (file_name, file.read())
+                    file.close()
+            METRICS.count('crawler.documents', len(documents))
         return documents
 
+    def stream(self, path):
+        """
+        Load and tokenize the txt documents in the path one at a time, so only one of them is
+        held in memory
+        :param path: Path from which the files should be loaded
+        :return: Yields a tuple with the uuid of a document and a tuple with its full path name
+        and the list of its tokens
+        """
+        for file_name in self.files(path):
+            with METRICS.timer('crawler.load'):
+                with open(file_name) as file:
+                    content = file.read()
+            uid = str(uuid.uuid5(uuid.NAMESPACE_DNS, file_name))
+            with METRICS.timer('crawler.tokenize'):
+                tokens = self.tokenizer.tokenize(content)
+            METRICS.count('crawler.documents')
+            METRICS.count('crawler.tokens', len(tokens))
+            yield uid, (file_name, tokens)
+
+    def recrawl(self, path, manifest):
+        """
+        Find the txt documents added, modified or deleted in the path since the crawl recorded in
+        the manifest. Files whose size and modification time didn't change are skipped without
+        being read, and files touched without changing their contents are not reported.
+        :param path: Path from which the files should be loaded
+        :param manifest: the crawl manifest of the previous crawl, as returned by
+        load_crawl_manifest. It is not changed.
+        :return: a CrawlChanges with the documents tokenized and the new manifest, which keeps the
+        entries of files outside the path
+        """
+        root = os.path.join(os.path.normpath(path), '')
+        current = {file_name: entry for file_name, entry in manifest.items()
+                   if not os.path.normpath(file_name).startswith(root)}
+        added, modified = collections.defaultdict(set), collections.defaultdict(set)
+        for file_name, stat in sorted(scan_files(path)):
+            previous = manifest.get(file_name)
+            if previous and previous[:2] == (stat.st_size, stat.st_mtime_ns):
+                current[file_name] = previous
+                continue
+            with METRICS.timer('crawler.load'):
+                with open(file_name) as file:
+                    content = file.read()
+            digest = hashlib.sha1(content.encode('utf-8')).hexdigest()
+            current[file_name] = (stat.st_size, stat.st_mtime_ns, digest)
+            if previous and previous[2] == digest:
+                continue
+            uid = str(uuid.uuid5(uuid.NAMESPACE_DNS, file_name))
+            with METRICS.timer('crawler.tokenize'):
+                tokens = self.tokenizer.tokenize(content)
+            METRICS.count('crawler.documents')
+            METRICS.count('crawler.tokens', len(tokens))
+            (modified if previous else added)[uid] = (file_name, tokens)
+        deleted = {str(uuid.uuid5(uuid.NAMESPACE_DNS, file_name)): file_name
+                   for file_name in sorted(manifest) if file_name not in current}
+        return CrawlChanges(added, modified, deleted, current)
+
     def parse(self, documents):
         """
         Read document as dict and tokenize its content
@@ -84,7 +224,11 @@ class SimpleTxtCrawler(Crawler):
         a list of its tokens.
         """
         tokenized_documents = collections.defaultdict(set)
-        for document in documents.items():
-            tokenized_documents[document[0]] = (document[1][0], self.tokenizer
-                                                .tokenize(document[1][1]))
+        with METRICS.timer('crawler.tokenize'):
+            for document in documents.items():
+                tokenized_documents[document[0]] = (document[1][0], self.tokenizer
+                                                    .tokenize(document[1][1]))
+        if METRICS.enabled:
+            METRICS.count('crawler.tokens', sum(len(document[1])
+                                                for document in tokenized_documents.values()))
         return tokenized_documents
@@ -6,12 +6,91 @@
 """
 Module that contains classes responsible for data persistence in the index engine.
 """
+import contextlib
 import csv
 import errno
+import itertools
+import mmap
 import os
+import queue
+import sqlite3
+import struct
+import threading
 from abc import ABC, abstractmethod
 
 import collections
+from collections.abc import Mapping
+
+from Metrics import METRICS
+from Postings import BlockPostings, encode_blocks
+
+# Every binary index starts with the file magic, the magic of its kind and the version of the
+# format, which is bumped whenever the layout of the files changes
+FILE_MAGIC = b'IRIX'
+FORMAT_VERSION = 2
+POSTINGS_MAGIC = b'IRPL'
+COMPRESSED_MAGIC = b'IRPC'
+STRINGS_MAGIC = b'IRST'
+HEADER = struct.Struct('<4s4sIIQQ')
+HAS_WEIGHTS = 1
+TEMP_SUFFIX = '.tmp'
+COMMIT_RECORD = 'commit.csv'
+WAL_LOG = 'wal.csv'
+SQLITE_DATABASE = 'index.sqlite'
+_MISSING = object()
+# Commits of concurrent threads, i.e. a background merge, would overwrite each other's commit
+# record, so they are applied one at a time
+_COMMIT_LOCK = threading.Lock()
+# Numbers the temporary files written by this process, so concurrent saves of the same file
+# never share one
+_TEMP_COUNTER = itertools.count(1)
+
+
+def _temp_name(fullpath):
+    """
+    Build a name for a temporary file to be written in place of a file of the index, unique to
+    this process and to this save, i.e. index.csv -> index.csv.4242-17.tmp
+    :param fullpath: the path of the file of the index
+    :return: the path of the temporary file
+    """
+    return '{}.{}-{}{}'.format(fullpath, os.getpid(), next(_TEMP_COUNTER), TEMP_SUFFIX)
+
+
+def _is_orphan(name):
+    """
+    :param name: the name of a temporary file
+    :return: True if the process that wrote the temporary file is gone, so no transaction can
+    still commit it
+    """
+    try:
+        pid = int(name[:-len(TEMP_SUFFIX)].rsplit('.', 1)[1].split('-')[0])
+    except (IndexError, ValueError):
+        return True
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass
+    return False
+
+
+def _fsync_directory(path):
+    """
+    Flush a directory, so the files renamed or removed in it survive a crash.
+    """
+    try:
+        descriptor = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(descriptor)
 
 
 class Dao(ABC):
@@ -19,6 +98,10 @@ class Dao(ABC):
     Abstract class to define the common interface for a Dao class.
     """
 
+    # True when save reads indexdata only once, through indexdata.items(), so it can be fed by a
+    # generator without holding the whole index in memory.
+    streaming = False
+
     @abstractmethod
     def load(self, indexname=None):
         """
@@ -45,14 +128,42 @@ class Dao(ABC):
         :param container_name: Name of the container that holds the data to be removed
         """
 
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Group the saves and deletes made in the block in a single commit, applied all together
+        when the block ends. Daos that can't do it apply each one as it comes.
+        """
+        yield
+
+    @contextlib.contextmanager
+    def snapshot(self):
+        """
+        Read the indexes in the block as they were when it started, while the writer commits.
+        Daos whose loaded indexes never change under their readers don't need to do anything.
+        """
+        yield
+
+    def recover(self):
+        """
+        Finish or roll back a commit interrupted by a crash. It must be called by the writer of
+        the index before it loads the index, never while another process writes to it.
+        """
+        pass
+
 
 class CSVFileDal(Dao):
     """
     A concrete implementation of Dao abstract class that persist data in a simple csv file.
     """
 
+    streaming = True
+
     def __init__(self, path):
         self.path = path
+        # The files staged by the transaction running in each thread, as tuples (target, temp),
+        # where temp is None when the target must be removed
+        self.staged = dict()
 
     def load(self, indexname=None):
         """
@@ -60,14 +171,24 @@ class CSVFileDal(Dao):
         :param indexname: name of the csv file to be loaded
         :return: dict with data loaded from the file
         """
+        index = collections.defaultdict(set)
+        with METRICS.timer('dal.load'):
+            for key, value in self.scan(indexname):
+                index[key] = value
+        return index
+
+    def scan(self, indexname=None):
+        """
+        Read a simple csv file one line at a time
+        :param indexname: name of the csv file to be read
+        :return: Yields a tuple with the key and the value of each line, in the order they were
+        saved
+        """
         with self.safe_open(indexname, mode='r') as file:
             csv.register_dialect("unix_dialect")
             reader = csv.reader(file, delimiter=',')
-            index = collections.defaultdict(set)
             for line in reader:
-                index[line[0]] = eval(line[1])
-
-            return index
+                yield line[0], eval(line[1])
 
     def save(self, indexdata, indexname=None):
         """
@@ -75,19 +196,23 @@ class CSVFileDal(Dao):
         :param indexname: name of the csv file were the index will be saved
         :param indexdata: data to be persisted (in dict format)
         """
-        with self.safe_open(filename=indexname, mode='w') as file:
+        with METRICS.timer('dal.save'), self.atomic_open(indexname, mode='w') as file:
             csv.register_dialect("unix_dialect")
             writer = csv.writer(file)
             for key, value in indexdata.items():
                 writer.writerow([key, value])
-            file.close()
 
     def delete_all(self, indexname):
         """
         Delete the storage object.
 
-        :param indexname: Name of the index file to be removed
+        :param indexname: Name of the index file to be removed, relative to the path of this Dao
         """
+        indexname = os.path.join(self.path, indexname)
+        staged = self.staged.get(threading.get_ident())
+        if staged is not None:
+            staged.append((indexname, None))
+            return
         try:
             if os.path.exists(indexname):
                 os.remove(indexname)
@@ -96,6 +221,99 @@ class CSVFileDal(Dao):
         except OSError:
             raise
 
+    @contextlib.contextmanager
+    def atomic_open(self, filename, mode='w'):
+        """
+        Open a temporary file to be written in place of a file of the index. When the block ends,
+        the temporary file is flushed to the disk and renamed over the file, so a crash never
+        leaves a truncated file behind, and readers that mapped the old file keep reading it.
+        Each save writes its own temporary file, so transactions of other threads saving the same
+        file never overwrite it. Inside a transaction, the rename waits for the commit.
+        :param filename: name of the file, relative to the path of this Dao
+        :param mode: mode to write the file, i.e., 'w' or 'wb'
+        :return: the temporary file, opened
+        """
+        fullpath = os.path.join(self.path, filename)
+        temp = _temp_name(fullpath)
+        self.safe_mkdir()
+        try:
+            with open(temp, mode) as file:
+                yield file
+                file.flush()
+                os.fsync(file.fileno())
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        staged = self.staged.get(threading.get_ident())
+        if staged is None:
+            os.replace(temp, fullpath)
+            _fsync_directory(self.path)
+        else:
+            staged.append((fullpath, temp))
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Group the saves and deletes made in the block in a single commit. The files are written to
+        temporary files, then a commit record listing them is persisted and only then they are
+        renamed over the files of the index. If the process crashes before the commit record
+        exists, recover drops the temporary files, otherwise it finishes the renames. Nested
+        transactions join the outer one. If the block raises, nothing is applied.
+        """
+        thread = threading.get_ident()
+        if thread in self.staged:
+            yield
+            return
+        staged = self.staged[thread] = list()
+        try:
+            yield
+        except BaseException:
+            for _, temp in staged:
+                if temp and os.path.exists(temp):
+                    os.remove(temp)
+            raise
+        finally:
+            del self.staged[thread]
+        if staged:
+            with _COMMIT_LOCK:
+                with self.atomic_open(COMMIT_RECORD, mode='w') as file:
+                    csv.writer(file).writerows([target, repr(temp)] for target, temp in staged)
+                self.__apply(staged)
+                os.remove(os.path.join(self.path, COMMIT_RECORD))
+
+    def recover(self):
+        """
+        Finish the commit interrupted by a crash, if its commit record was persisted, and drop the
+        temporary files named by it and the ones left by processes that crashed before their
+        commit record existed. The temporary files of transactions still running, in this process
+        or in another one, are kept.
+        """
+        if not os.path.isdir(self.path):
+            return
+        record = os.path.join(self.path, COMMIT_RECORD)
+        with _COMMIT_LOCK:
+            if os.path.exists(record):
+                self.__apply(list(self.scan(COMMIT_RECORD)))
+                os.remove(record)
+        for name in os.listdir(self.path):
+            if name.endswith(TEMP_SUFFIX) and _is_orphan(name):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(self.path, name))
+
+    def __apply(self, staged):
+        """
+        Rename the temporary files over the files of the index and remove the deleted ones. It is
+        idempotent, so an interrupted commit can be applied again.
+        """
+        for target, temp in staged:
+            if temp is None:
+                if os.path.exists(target):
+                    os.remove(target)
+            elif os.path.exists(temp):
+                os.replace(temp, target)
+        _fsync_directory(self.path)
+
     def safe_mkdir(self):
         """
         method responsible for create directories in a safe way.
@@ -121,3 +339,867 @@ class CSVFileDal(Dao):
             raise FileNotFoundError("A filename was expected")
         self.safe_mkdir()
         return open(fullpath, mode)
+
+
+class WriteAheadLog:
+    """
+    An append-only log of the batches of documents given to an index engine, kept next to the
+    index. Each batch is flushed to the disk with its sequence number before it is indexed, so the
+    batches whose commit didn't make it to the manifest can be replayed after a crash, instead of
+    crawling and indexing everything again.
+    """
+
+    def __init__(self, path, name=WAL_LOG):
+        """
+        :param path: directory of the index
+        :param name: name of the log file
+        """
+        self.path = path
+        self.filename = os.path.join(path, name)
+
+    def append(self, sequence, document_entries):
+        """
+        Log a batch of documents and flush it to the disk.
+        :param sequence: the sequence number of the batch, greater than the ones already logged
+        :param document_entries: a dict created by the parse method of a Crawler
+        """
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.filename, 'a', newline='') as file:
+            csv.writer(file).writerow([sequence, repr(dict(document_entries))])
+            file.flush()
+            os.fsync(file.fileno())
+
+    def replay(self, after=0):
+        """
+        Read the batches logged after a sequence number. A batch torn by a crash, which was never
+        indexed, ends the log.
+        :param after: the sequence number of the last batch committed to the index
+        :return: Yields a tuple with the sequence number and the documents of each batch
+        """
+        try:
+            file = open(self.filename, newline='')
+        except FileNotFoundError:
+            return
+        with file:
+            try:
+                for line in csv.reader(file):
+                    sequence, document_entries = int(line[0]), eval(line[1])
+                    if sequence > after:
+                        yield sequence, document_entries
+            except (csv.Error, IndexError, SyntaxError, ValueError):
+                return
+
+    def truncate(self):
+        """
+        Drop the batches logged, once they are committed to the index.
+        """
+        if os.path.exists(self.filename):
+            with open(self.filename, 'w'):
+                pass
+
+
+def _align(size):
+    """
+    Round size up to the next multiple of 8, so every array in a binary index is aligned.
+    """
+    return (size + 7) & ~7
+
+
+def _index_kind(indexdata):
+    """
+    Find out how an index can be encoded in the binary format.
+    :param indexdata: data to be persisted (in dict format)
+    :return: POSTINGS_MAGIC for an inverted index, STRINGS_MAGIC for a forward index or None if
+    the data must be persisted as csv.
+    """
+    kind = None
+    for value in indexdata.values():
+        if not isinstance(value, (set, frozenset)):
+            return None
+        for entry in value:
+            if isinstance(entry, tuple):
+                entry_kind = POSTINGS_MAGIC
+            elif isinstance(entry, str):
+                entry_kind = STRINGS_MAGIC
+            else:
+                return None
+            if kind and kind != entry_kind:
+                return None
+            kind = entry_kind
+            break
+    return kind
+
+
+def _string_table(strings):
+    """
+    Encode a list of strings as an offset table followed by a blob with the strings in utf-8.
+    :return: a tuple with the offset table and the blob
+    """
+    blob = bytearray()
+    offsets = [0]
+    for string in strings:
+        blob += string.encode('utf-8')
+        offsets.append(len(blob))
+    return struct.pack('<{}Q'.format(len(offsets)), *offsets), bytes(blob)
+
+
+class _BinaryWriter:
+    """
+    Accumulates the sections of a binary index, keeping each of them aligned.
+    """
+
+    def __init__(self, magic, flags, count, total):
+        self.header = (FILE_MAGIC, magic, FORMAT_VERSION, flags, count, total)
+        self.sections = []
+        self.size = HEADER.size
+
+    def add(self, data):
+        """
+        Add a section to the file.
+        """
+        self.sections.append(data)
+        self.size = _align(self.size + len(data))
+
+    def write(self, file):
+        """
+        Write the header and all sections to a file opened in binary mode.
+        """
+        file.write(HEADER.pack(*self.header))
+        for data in self.sections:
+            file.write(data)
+            file.write(bytes(_align(len(data)) - len(data)))
+
+
+class _StringTable:
+    """
+    A read only view over a table of strings encoded by _string_table.
+    """
+
+    def __init__(self, buffer, offset, count):
+        self.offsets = buffer[offset:offset + (count + 1) * 8].cast('Q')
+        self.blob_offset = _align(offset + (count + 1) * 8)
+        self.blob = buffer[self.blob_offset:self.blob_offset + self.offsets[count]]
+        self.end = _align(self.blob_offset + self.offsets[count])
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def raw(self, position):
+        """
+        :return: the encoded string found in the position
+        """
+        return bytes(self.blob[self.offsets[position]:self.offsets[position + 1]])
+
+    def __getitem__(self, position):
+        return str(self.raw(position), 'utf-8')
+
+    def find(self, string):
+        """
+        Binary search for a string in a sorted table.
+        :return: the position of the string or -1 if it is not in the table.
+        """
+        encoded = string.encode('utf-8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.raw(middle) < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.raw(low) == encoded:
+            return low
+        return -1
+
+
+class _MappedIndex(Mapping):
+    """
+    Base class for the indexes mapped in memory by BinaryFileDal. Keys are looked up by binary
+    search over the sorted key table and values are decoded only when they are requested. The
+    file stays mapped until close is called, or the block of a with statement ends.
+    """
+
+    def __init__(self, buffer, mapped=None):
+        """
+        :param buffer: a memoryview over the binary index
+        :param mapped: the mmap under the buffer, if any, unmapped by close
+        """
+        self.buffer = buffer
+        self.mapped = mapped
+        _, _, _, self.flags, count, self.total = HEADER.unpack_from(buffer, 0)
+        self.keys_table = _StringTable(buffer, HEADER.size, count)
+
+    def __len__(self):
+        return len(self.keys_table)
+
+    def __iter__(self):
+        for position in range(len(self.keys_table)):
+            yield self.keys_table[position]
+
+    def __contains__(self, key):
+        return isinstance(key, str) and self.keys_table.find(key) >= 0
+
+    def __getitem__(self, key):
+        position = self.keys_table.find(key) if isinstance(key, str) else -1
+        if position < 0:
+            raise KeyError(key)
+        return self.decode(position)
+
+    @abstractmethod
+    def decode(self, position):
+        """
+        Decode the value stored in the given position of the key table.
+        """
+
+    def close(self):
+        """
+        Release the views over the file and unmap it. The arrays given by columns and the
+        posting lists must not be used afterwards.
+        """
+        views = [self.buffer]
+        for value in vars(self).values():
+            if isinstance(value, memoryview):
+                views.append(value)
+            elif isinstance(value, _StringTable):
+                views.extend((value.offsets, value.blob))
+        for view in views:
+            view.release()
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MappedPostings(_MappedIndex):
+    """
+    An inverted index mapped in memory. Each term is bound to a range of the contiguous arrays
+    of doc ids, term frequencies, normalized term frequencies and weights, and to the upper
+    bounds of the normalized term frequency and of the weight that a document can reach.
+    """
+
+    def __init__(self, buffer, mapped=None):
+        super().__init__(buffer, mapped)
+        offset = self.keys_table.end
+        count = len(self.keys_table)
+        self.ranges = buffer[offset:offset + (count + 1) * 8].cast('Q')
+        offset = _align(offset + (count + 1) * 8)
+        self.max_ntfs = buffer[offset:offset + count * 8].cast('d')
+        offset = offset + count * 8
+        self.max_weights = buffer[offset:offset + count * 8].cast('d')
+        offset = offset + count * 8
+        (n_docs,) = struct.unpack_from('<Q', buffer, offset)
+        self.doc_keys = _StringTable(buffer, offset + 8, n_docs)
+        offset = self.doc_keys.end
+        self.doc_ids = buffer[offset:offset + self.total * 4].cast('I')
+        offset = _align(offset + self.total * 4)
+        self.tfs = buffer[offset:offset + self.total * 4].cast('I')
+        offset = _align(offset + self.total * 4)
+        self.ntfs = buffer[offset:offset + self.total * 8].cast('d')
+        offset = offset + self.total * 8
+        self.weights = buffer[offset:offset + self.total * 8].cast('d') \
+            if self.flags & HAS_WEIGHTS else None
+
+    def decode(self, position):
+        entries = set()
+        for i in range(self.ranges[position], self.ranges[position + 1]):
+            entry = (self.tfs[i], self.doc_keys[self.doc_ids[i]], self.ntfs[i])
+            if self.weights is not None:
+                entry += (self.weights[i],)
+            entries.add(entry)
+        return entries
+
+    def columns(self, key):
+        """
+        Give direct access to the posting arrays of a term, which are sorted by doc id.
+        :param key: the term to be looked up
+        :return: a tuple with the doc ids, the normalized term frequencies, the weights (or None,
+        if the index holds only raw frequencies), the upper bound of the normalized term frequency
+        and the upper bound of the weight of a document in the posting list. If the term is not in
+        the index, returns None.
+        """
+        position = self.keys_table.find(key)
+        if position < 0:
+            return None
+        start, end = self.ranges[position], self.ranges[position + 1]
+        weights = self.weights[start:end] if self.weights is not None else None
+        return (self.doc_ids[start:end], self.ntfs[start:end], weights,
+                self.max_ntfs[position], self.max_weights[position])
+
+
+class MappedCompressedPostings(_MappedIndex):
+    """
+    An inverted index mapped in memory whose posting lists are compressed (see
+    Postings.encode_blocks). The posting lists keep only doc ids and term frequencies: the
+    normalized term frequencies are computed from the length of the documents, and the search
+    engines weight them with the idf of the term at query time, as the ones of indexes without
+    weights.
+    """
+
+    def __init__(self, buffer, mapped=None):
+        super().__init__(buffer, mapped)
+        offset = self.keys_table.end
+        count = len(self.keys_table)
+        self.ranges = buffer[offset:offset + (count + 1) * 8].cast('Q')
+        offset = _align(offset + (count + 1) * 8)
+        self.max_ntfs = buffer[offset:offset + count * 8].cast('d')
+        offset = offset + count * 8
+        self.blob_ranges = buffer[offset:offset + (count + 1) * 8].cast('Q')
+        offset = _align(offset + (count + 1) * 8)
+        (n_docs,) = struct.unpack_from('<Q', buffer, offset)
+        self.doc_keys = _StringTable(buffer, offset + 8, n_docs)
+        offset = self.doc_keys.end
+        self.doc_lengths = buffer[offset:offset + n_docs * 4].cast('I')
+        self.blob = buffer[_align(offset + n_docs * 4):]
+
+    def postings(self, position):
+        """
+        :return: a BlockPostings over the posting list in the given position of the key table
+        """
+        return BlockPostings(self.blob[self.blob_ranges[position]:self.blob_ranges[position + 1]],
+                             self.ranges[position + 1] - self.ranges[position],
+                             self.doc_lengths)
+
+    def decode(self, position):
+        return {(tf, self.doc_keys[doc_id], ntf) for doc_id, tf, ntf in self.postings(position)}
+
+    def columns(self, key):
+        """
+        Give access to the posting list of a term as columns decoded block by block.
+        :param key: the term to be looked up
+        :return: a tuple in the format returned by MappedPostings.columns, without weights, or
+        None if the term is not in the index.
+        """
+        position = self.keys_table.find(key)
+        if position < 0:
+            return None
+        postings = self.postings(position)
+        return postings.column(0), postings.column(1), None, self.max_ntfs[position], 0.0
+
+
+class MappedStrings(_MappedIndex):
+    """
+    A forward index mapped in memory, where each key is bound to a set of strings.
+    """
+
+    def __init__(self, buffer, mapped=None):
+        super().__init__(buffer, mapped)
+        offset = self.keys_table.end
+        count = len(self.keys_table)
+        self.ranges = buffer[offset:offset + (count + 1) * 8].cast('Q')
+        self.values = _StringTable(buffer, _align(offset + (count + 1) * 8), self.total)
+
+    def decode(self, position):
+        return {self.values[i] for i in range(self.ranges[position], self.ranges[position + 1])}
+
+
+class BinaryFileDal(CSVFileDal):
+    """
+    A concrete implementation of Dao abstract class that persists the indexes in a compact binary
+    format (a sorted term dictionary, an offset table and contiguous posting arrays) and opens
+    them through mmap, so a searcher starts without parsing the files and reads only the posting
+    lists touched by a query. Data that is not an index, like the manifest, is kept in csv.
+    """
+
+    streaming = False
+
+    suffix = '.idx'
+
+    def __init__(self, path, compression=None):
+        """
+        :param path: directory where the indexes are persisted
+        :param compression: None to keep the posting lists as plain arrays or 'varbyte' to
+        compress them with doc id gaps and term frequencies in variable-byte codes, split in
+        blocks with skip pointers
+        """
+        super().__init__(path)
+        if compression not in (None, 'varbyte'):
+            raise ValueError("Unknown compression: {}".format(compression))
+        self.compression = compression
+
+    def binary_name(self, indexname):
+        """
+        :return: the name of the file that holds the binary version of the index
+        """
+        return os.path.splitext(indexname)[0] + self.suffix
+
+    def load(self, indexname=None):
+        """
+        Map an index in memory
+        :param indexname: name of the index to be loaded
+        :return: a read only mapping over the index, or the dict loaded by CSVFileDal if the
+        index was not persisted in the binary format
+        """
+        fullpath = os.path.join(self.path, self.binary_name(indexname))
+        if not os.path.exists(fullpath):
+            return super().load(indexname)
+        with METRICS.timer('dal.load'), open(fullpath, 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(mapped)
+        file_magic, magic, version = (HEADER.unpack_from(buffer, 0)[:3]
+                                      if len(buffer) >= HEADER.size else (None, None, None))
+        if file_magic != FILE_MAGIC or version != FORMAT_VERSION:
+            buffer.release()
+            mapped.close()
+            raise ValueError("{} is not a binary index of format version {}, it must be built "
+                             "again".format(fullpath, FORMAT_VERSION))
+        if magic == POSTINGS_MAGIC:
+            return MappedPostings(buffer, mapped)
+        if magic == COMPRESSED_MAGIC:
+            return MappedCompressedPostings(buffer, mapped)
+        return MappedStrings(buffer, mapped)
+
+    def save(self, indexdata, indexname=None):
+        """
+        Save an index in the binary format
+        :param indexname: name of the index to be saved
+        :param indexdata: data to be persisted (in dict format)
+        """
+        kind = _index_kind(indexdata)
+        if kind is None:
+            super().delete_all(self.binary_name(indexname))
+            super().save(indexdata, indexname)
+            return
+        with METRICS.timer('dal.save'):
+            keys = sorted(indexdata.keys(), key=lambda key: key.encode('utf-8'))
+            if kind == POSTINGS_MAGIC and self.compression:
+                writer = self.__compressed_postings(indexdata, keys)
+            elif kind == POSTINGS_MAGIC:
+                writer = self.__postings(indexdata, keys)
+            else:
+                writer = self.__strings(indexdata, keys)
+            with self.atomic_open(self.binary_name(indexname), mode='wb') as file:
+                writer.write(file)
+        super().delete_all(indexname)
+
+    @staticmethod
+    def __strings(indexdata, keys):
+        """
+        Encode a forward index.
+        """
+        values = [sorted(indexdata[key]) for key in keys]
+        ranges = [0]
+        for value in values:
+            ranges.append(ranges[-1] + len(value))
+        writer = _BinaryWriter(STRINGS_MAGIC, 0, len(keys), ranges[-1])
+        for section in _string_table(keys):
+            writer.add(section)
+        writer.add(struct.pack('<{}Q'.format(len(ranges)), *ranges))
+        offsets, blob = _string_table([string for value in values for string in value])
+        writer.add(offsets)
+        writer.add(blob)
+        return writer
+
+    @staticmethod
+    def __postings(indexdata, keys):
+        """
+        Encode an inverted index.
+        """
+        doc_keys = sorted({entry[1] for value in indexdata.values() for entry in value},
+                          key=lambda key: key.encode('utf-8'))
+        doc_ids = {key: doc_id for doc_id, key in enumerate(doc_keys)}
+        has_weights = any(len(entry) > 3 for value in indexdata.values() for entry in value)
+        ids, tfs, ntfs, weights, ranges = [], [], [], [], [0]
+        max_ntfs, max_weights = [], []
+        for key in keys:
+            doc_ntfs = collections.Counter()
+            doc_weights = collections.Counter()
+            for entry in sorted(indexdata[key], key=lambda entry: (doc_ids[entry[1]], entry)):
+                ids.append(doc_ids[entry[1]])
+                tfs.append(entry[0])
+                ntfs.append(entry[2])
+                doc_ntfs[entry[1]] += entry[2]
+                if has_weights:
+                    weights.append(entry[3])
+                    doc_weights[entry[1]] += entry[3]
+            ranges.append(len(ids))
+            max_ntfs.append(max(doc_ntfs.values(), default=0.0))
+            max_weights.append(max(doc_weights.values(), default=0.0))
+        writer = _BinaryWriter(POSTINGS_MAGIC, HAS_WEIGHTS if has_weights else 0, len(keys),
+                               len(ids))
+        for section in _string_table(keys):
+            writer.add(section)
+        writer.add(struct.pack('<{}Q'.format(len(ranges)), *ranges))
+        writer.add(struct.pack('<{}d'.format(len(keys)), *max_ntfs))
+        writer.add(struct.pack('<{}d'.format(len(keys)), *max_weights))
+        writer.add(struct.pack('<Q', len(doc_keys)))
+        for section in _string_table(doc_keys):
+            writer.add(section)
+        writer.add(struct.pack('<{}I'.format(len(ids)), *ids))
+        writer.add(struct.pack('<{}I'.format(len(tfs)), *tfs))
+        writer.add(struct.pack('<{}d'.format(len(ntfs)), *ntfs))
+        writer.add(struct.pack('<{}d'.format(len(weights)), *weights))
+        return writer
+
+    @staticmethod
+    def __compressed_postings(indexdata, keys):
+        """
+        Encode an inverted index with compressed posting lists. Neither the normalized term
+        frequencies nor the weights are stored: each document keeps its length, from which the
+        normalized term frequencies are computed exactly, and the weights are computed from them
+        at query time.
+        """
+        doc_lengths = dict()
+        for value in indexdata.values():
+            for entry in value:
+                if entry[2] > 0:
+                    doc_lengths.setdefault(entry[1], round(entry[0] / entry[2]))
+        doc_keys = sorted(doc_lengths, key=lambda key: key.encode('utf-8'))
+        doc_ids = {key: doc_id for doc_id, key in enumerate(doc_keys)}
+        ranges, blob_ranges, blob = [0], [0], bytearray()
+        max_ntfs = []
+        for key in keys:
+            entries = sorted(indexdata[key], key=lambda entry: (doc_ids[entry[1]], entry))
+            doc_ntfs = collections.Counter()
+            for entry in entries:
+                doc_ntfs[entry[1]] += entry[2]
+            blob += encode_blocks([doc_ids[entry[1]] for entry in entries],
+                                  [entry[0] for entry in entries])
+            ranges.append(ranges[-1] + len(entries))
+            blob_ranges.append(len(blob))
+            max_ntfs.append(max(doc_ntfs.values()))
+        writer = _BinaryWriter(COMPRESSED_MAGIC, 0, len(keys), ranges[-1])
+        for section in _string_table(keys):
+            writer.add(section)
+        writer.add(struct.pack('<{}Q'.format(len(ranges)), *ranges))
+        writer.add(struct.pack('<{}d'.format(len(keys)), *max_ntfs))
+        writer.add(struct.pack('<{}Q'.format(len(blob_ranges)), *blob_ranges))
+        writer.add(struct.pack('<Q', len(doc_keys)))
+        for section in _string_table(doc_keys):
+            writer.add(section)
+        writer.add(struct.pack('<{}I'.format(len(doc_keys)), *[doc_lengths[key]
+                                                              for key in doc_keys]))
+        writer.add(bytes(blob))
+        return writer
+
+    def delete_all(self, indexname):
+        """
+        Delete the storage object, either in csv or in the binary format.
+
+        :param indexname: Name of the index file to be removed
+        """
+        super().delete_all(self.binary_name(indexname))
+        super().delete_all(indexname)
+
+
+class _SqliteIndex(Mapping):
+    """
+    A read only mapping over an index stored by SqliteDal. Values are fetched from the database
+    one key at a time, when they are requested, so a search reads only the terms of its query.
+    Each read borrows a connection of the pool of the Dao, so the mapping sees the last commit
+    unless it is read inside a SqliteDal.snapshot, as the search engines do for each query.
+    """
+
+    def __init__(self, dal, name):
+        self.dal = dal
+        self.name = name
+        with dal.reader() as connection:
+            (self.size,) = connection.execute('SELECT COUNT(*) FROM entries WHERE name = ?',
+                                              (name,)).fetchone()
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        with self.dal.reader() as connection:
+            keys = connection.execute('SELECT key FROM entries WHERE name = ? ORDER BY key',
+                                      (self.name,)).fetchall()
+        return (key for (key,) in keys)
+
+    def __contains__(self, key):
+        return isinstance(key, str) and self.lookup(key) is not _MISSING
+
+    def __getitem__(self, key):
+        value = self.lookup(key) if isinstance(key, str) else _MISSING
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def lookup(self, key):
+        """
+        :return: the value of a key, or _MISSING if the key is not in the index
+        """
+        return self.dal.lookup(self.name, key, _MISSING)
+
+
+class SqliteDal(Dao):
+    """
+    A Dao that keeps every index of a directory in a single SQLite database, with a row for each
+    key of an index. The database is in WAL journaling mode, so readers don't block the writer and
+    the writer doesn't block readers. A transaction of the index engines is a single database
+    transaction, in which each save is a batch of inserts, and SQLite rolls back the ones
+    interrupted by a crash by itself. Forward and inverted indexes are loaded as read only
+    mappings that fetch each key when it is looked up; the other indexes are loaded as dicts.
+    Readers borrow the connections of a pool and keep a read transaction open only inside a
+    snapshot, so the write-ahead log is checkpointed once no query is running.
+    """
+
+    streaming = True
+
+    def __init__(self, path, filename=SQLITE_DATABASE, pool_size=4, wal_limit=1 << 24):
+        """
+        :param path: directory of the database, also used for the files kept next to the index,
+        i.e. the write-ahead log of the index engines
+        :param filename: name of the database file
+        :param pool_size: maximum number of connections opened to read the database, shared by
+        the threads that search it
+        :param wal_limit: size in bytes of the write-ahead log of SQLite past which a commit waits
+        for the running queries to end to checkpoint it and truncate it
+        """
+        self.path = path
+        self.filename = filename
+        self.pool_size = pool_size
+        self.wal_limit = wal_limit
+        self.__connect()
+
+    def __connect(self):
+        """
+        Start without connections; they are opened when they are first needed.
+        """
+        self.writer = None
+        self.depth = 0
+        self.write_lock = threading.RLock()
+        self.pool_lock = threading.Lock()
+        self.pool = queue.LifoQueue()
+        self.opened = 0
+        self.local = threading.local()
+
+    def __getstate__(self):
+        # Connections and locks can't be pickled, i.e. to give the Dao to a shard worker
+        return {'path': self.path, 'filename': self.filename, 'pool_size': self.pool_size,
+                'wal_limit': self.wal_limit}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__connect()
+
+    @staticmethod
+    def name(indexname):
+        """
+        :return: the name under which an index is stored, without directories
+        """
+        return os.path.basename(indexname)
+
+    def database(self):
+        """
+        :return: the full path of the database file
+        """
+        return os.path.join(self.path, self.filename)
+
+    def open(self, read_only=False):
+        """
+        Open a connection to the database, creating the database if it doesn't exist.
+        :param read_only: if True, the connection refuses to write
+        :return: the connection, in autocommit mode, so transactions are explicit
+        """
+        try:
+            os.makedirs(self.path)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST or not os.path.isdir(self.path):
+                raise
+        connection = sqlite3.connect(self.database(), isolation_level=None,
+                                     check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=FULL')
+        connection.execute('CREATE TABLE IF NOT EXISTS indexes '
+                           '(name TEXT PRIMARY KEY, mapped INTEGER NOT NULL)')
+        connection.execute('CREATE TABLE IF NOT EXISTS entries (name TEXT NOT NULL, '
+                           'key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (name, key)) '
+                           'WITHOUT ROWID')
+        if read_only:
+            connection.execute('PRAGMA query_only=ON')
+        return connection
+
+    @contextlib.contextmanager
+    def reader(self):
+        """
+        Borrow a connection of the pool to read the database. Up to pool_size connections are
+        opened; when all of them are in use, the thread waits for one to be given back. Inside a
+        snapshot, the connection pinned by the snapshot is used instead.
+        :return: the connection, which is given back to the pool when the block ends
+        """
+        pinned = getattr(self.local, 'connection', None)
+        if pinned is not None:
+            yield pinned
+            return
+        try:
+            connection = self.pool.get_nowait()
+        except queue.Empty:
+            connection = None
+            with self.pool_lock:
+                if self.opened < self.pool_size:
+                    self.opened += 1
+                    connection = self.open(read_only=True)
+            if connection is None:
+                connection = self.pool.get()
+        try:
+            yield connection
+        finally:
+            self.pool.put(connection)
+
+    @contextlib.contextmanager
+    def snapshot(self):
+        """
+        Pin a connection of the pool to the thread for the block, in a read transaction, so every
+        read of the block sees the database as it was at its first read while the writer commits.
+        The transaction ends with the block, so it holds the checkpoints of the write-ahead log
+        back only while a query runs. Nested snapshots join the outer one.
+        """
+        if getattr(self.local, 'connection', None) is not None:
+            yield
+            return
+        with self.reader() as connection:
+            connection.execute('BEGIN')
+            self.local.connection = connection
+            try:
+                yield
+            finally:
+                self.local.connection = None
+                connection.execute('COMMIT')
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Run the saves and deletes made in the block in a single database transaction, committed
+        when the block ends or rolled back if it raises. Nested transactions join the outer one,
+        and transactions of other threads wait for it.
+        """
+        with self.write_lock:
+            if self.writer is None:
+                self.writer = self.open()
+            self.depth += 1
+            if self.depth == 1:
+                self.writer.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.writer
+            except BaseException:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.writer.execute('ROLLBACK')
+                raise
+            self.depth -= 1
+            if self.depth == 0:
+                self.writer.execute('COMMIT')
+                self.__checkpoint()
+
+    def __checkpoint(self):
+        """
+        Checkpoint the write-ahead log and truncate it once it is larger than wal_limit. The
+        automatic checkpoints of SQLite never wait for readers, so the log keeps growing while
+        queries overlap one another; this one waits for the queries running to end.
+        """
+        try:
+            size = os.path.getsize(self.database() + '-wal')
+        except OSError:
+            return
+        if size > self.wal_limit:
+            self.writer.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def mapped(self, name):
+        """
+        :param name: the name of an index
+        :return: True if the index is loaded as a mapping, False if it is loaded as a dict, or
+        None if it was not saved
+        """
+        if not os.path.exists(self.database()):
+            return None
+        with self.reader() as connection:
+            row = connection.execute('SELECT mapped FROM indexes WHERE name = ?',
+                                     (name,)).fetchone()
+        return bool(row[0]) if row is not None else None
+
+    def load(self, indexname=None):
+        """
+        Load an index from the database
+        :param indexname: name of the index to be loaded
+        :return: a read only mapping over a forward or an inverted index, or a dict with any
+        other index
+        """
+        name = self.name(indexname)
+        with METRICS.timer('dal.load'):
+            mapped = self.mapped(name)
+            if mapped is None:
+                raise FileNotFoundError("No index {} in {}".format(name, self.database()))
+            if mapped:
+                return _SqliteIndex(self, name)
+            index = collections.defaultdict(set)
+            for key, value in self.scan(name):
+                index[key] = value
+        return index
+
+    def scan(self, indexname=None):
+        """
+        Read an index one key at a time
+        :param indexname: name of the index to be read
+        :return: Yields a tuple with each key and its value, in the order of the keys
+        """
+        with self.reader() as connection:
+            rows = connection.execute('SELECT key, value FROM entries WHERE name = ? ORDER BY key',
+                                      (self.name(indexname),))
+            for key, value in rows:
+                yield key, eval(value)
+
+    def lookup(self, indexname, key, default=None):
+        """
+        Read the value of a single key of an index, i.e. the postings of a term.
+        :param indexname: name of the index
+        :param key: the key, i.e. a term of an inverted index
+        :param default: the value returned if the key is not in the index
+        :return: the value bound to the key
+        """
+        with self.reader() as connection:
+            row = connection.execute('SELECT value FROM entries WHERE name = ? AND key = ?',
+                                     (self.name(indexname), key)).fetchone()
+        return eval(row[0]) if row is not None else default
+
+    def save(self, indexdata, indexname=None):
+        """
+        Save an index in the database, replacing the previous one, with a batch of inserts
+        :param indexname: name of the index to be saved
+        :param indexdata: data to be persisted (in dict format)
+        """
+        name = self.name(indexname)
+        kinds = list()
+
+        def rows():
+            for key, value in indexdata.items():
+                if not kinds:
+                    kinds.append(isinstance(value, (set, frozenset)))
+                yield name, str(key), repr(value)
+
+        with METRICS.timer('dal.save'), self.transaction() as connection:
+            connection.execute('DELETE FROM entries WHERE name = ?', (name,))
+            connection.executemany('INSERT INTO entries (name, key, value) VALUES (?, ?, ?)',
+                                   rows())
+            connection.execute('INSERT OR REPLACE INTO indexes (name, mapped) VALUES (?, ?)',
+                               (name, int(bool(kinds and kinds[0]))))
+
+    def delete_all(self, indexname):
+        """
+        Delete an index from the database.
+
+        :param indexname: Name of the index to be removed
+        """
+        name = self.name(indexname)
+        if not os.path.exists(self.database()):
+            return
+        with self.transaction() as connection:
+            connection.execute('DELETE FROM entries WHERE name = ?', (name,))
+            connection.execute('DELETE FROM indexes WHERE name = ?', (name,))
+
+    def close(self):
+        """
+        Close the connections to the database.
+        """
+        with self.write_lock:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+        with self.pool_lock:
+            while self.opened:
+                self.pool.get().close()
+                self.opened -= 1
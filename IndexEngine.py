@@ -12,12 +12,310 @@ Module may contain different index engines
 """
 
 import collections
+import heapq
+import itertools
+import operator
+import os
+import shutil
+import tempfile
+import threading
+import zlib
 
 from math import log10
 from nltk.probability import FreqDist
 
-from Dal import CSVFileDal
+from Dal import CSVFileDal, WriteAheadLog
+from Metrics import METRICS
 from Normalizer import Normalizer, SnowballStemmerNormalizer
+from Postings import CompactIndex, encode_positions
+from Terms import TermDictionary
+
+FORWARD_INDEX = 'forward_index.csv'
+INVERTED_INDEX = 'inverted_index.csv'
+MANIFEST = 'manifest.csv'
+STEMS = 'stems.csv'
+POSITIONS = 'positions.csv'
+DOC_LENGTHS = 'doc_lengths.csv'
+TOMBSTONES = 'tombstones.csv'
+TERMS = 'terms.csv'
+FORWARD_BLOCK = 'forward_block.csv'
+INVERTED_BLOCK = 'inverted_block.csv'
+# The indexes persisted in segments by the IncrementalIndexEngine
+SEGMENTED = (FORWARD_INDEX, INVERTED_INDEX, POSITIONS, DOC_LENGTHS, TERMS)
+# Times load_index starts over when the manifest changes while the index is being loaded
+LOAD_ATTEMPTS = 5
+# Rough size, in bytes, of the Python objects held in memory by a SPIMI block
+POSTING_BYTES = 200
+TERM_BYTES = 250
+DOCUMENT_BYTES = 300
+
+
+def segment_name(indexname, segment):
+    """
+    Build the name of a segment of an index, i.e. inverted_index.csv -> inverted_index.00001.csv
+    :param indexname: name of the index the segment belongs to
+    :param segment: number of the segment
+    :return: the name under which the segment is persisted
+    """
+    base, extension = os.path.splitext(indexname)
+    return '{}.{:05d}{}'.format(base, segment, extension)
+
+
+def merge_index(target, source):
+    """
+    Fold the entries of the source index into the target index, joining the sets of entries
+    of the keys present in both.
+    :param target: index that will receive the entries
+    :param source: index whose entries will be added to the target
+    :return: the target index
+    """
+    for key, entries in source.items():
+        target.setdefault(key, set()).update(entries)
+    return target
+
+
+def remove_documents(forward, inverted, keys):
+    """
+    Remove documents from a forward and an inverted index held in dicts, dropping the terms left
+    without entries.
+    :param forward: the forward index
+    :param inverted: the inverted index
+    :param keys: the keys of the documents to be removed
+    """
+    keys = set(keys)
+    if not keys:
+        return
+    for key in keys:
+        forward.pop(key, None)
+    for term in list(inverted.keys()):
+        entries = inverted[term]
+        if any(entry[1] in keys for entry in entries):
+            entries = {entry for entry in entries if entry[1] not in keys}
+            if entries:
+                inverted[term] = entries
+            else:
+                del inverted[term]
+
+
+def invert(document_entries, normalize):
+    """
+    Build the forward and the inverted entries of a batch of documents.
+    :param document_entries: a dict created by the parse method of a Crawler
+    :param normalize: function that turns a token into a stem
+    :return: a tuple with the forward entries and the inverted entries of the batch
+    """
+    forward = {key: {(document_entries[key][0])} for key in document_entries.keys()}
+    inverted = collections.defaultdict(set)
+    for key in document_entries.keys():
+        freq_dist = FreqDist(document_entries[key][1])
+        for token, qty_in_doc in freq_dist.items():
+            inverted[normalize(token)].add((qty_in_doc, key, freq_dist.freq(token)))
+    return forward, inverted
+
+
+def invert_positions(document_entries, normalize):
+    """
+    Build the positional entries of a batch of documents, i.e. the positions of the tokens of
+    each stem in the list of tokens of each document.
+    :param document_entries: a dict created by the parse method of a Crawler
+    :param normalize: function that turns a token into a stem
+    :return: a dict with each stem bound to a dict with the key of each document where it appears
+    and its positions there, encoded by Postings.encode_positions
+    """
+    positions = collections.defaultdict(dict)
+    for key in document_entries.keys():
+        stem_positions = collections.defaultdict(list)
+        for position, token in enumerate(document_entries[key][1]):
+            stem_positions[normalize(token)].append(position)
+        for stem, doc_positions in stem_positions.items():
+            positions[stem][key] = encode_positions(doc_positions)
+    return positions
+
+
+def document_lengths(inverted):
+    """
+    Find out the number of tokens of the documents of an inverted index, since the normalized
+    term frequency of an entry is its term frequency over the number of tokens of the document.
+    :param inverted: dict with each term bound to a set of tuples (qty_in_doc, doc_key, ntf[,
+    tf-idf])
+    :return: a dict with the key of each document bound to its number of tokens
+    """
+    lengths = dict()
+    for entries in inverted.values():
+        for entry in entries:
+            if entry[2] > 0:
+                lengths.setdefault(entry[1], round(entry[0] / entry[2]))
+    return lengths
+
+
+def shard_dals(path, shards, dal_class=CSVFileDal):
+    """
+    Create the Daos of the shards of an index, each one in its own directory under path.
+    :param path: directory of the sharded index
+    :param shards: number of shards
+    :param dal_class: the class of Dao used by the shards
+    :return: a list with the Dao of each shard
+    """
+    return [dal_class(os.path.join(path, 'shard-{:02d}'.format(shard)))
+            for shard in range(shards)]
+
+
+def load_manifest(dal):
+    """
+    Load the manifest of the index, which holds its generation and lists the segments not merged
+    yet.
+    :param dal: the Dao where the index is persisted
+    :return: a dict with the manifest entries or an empty dict, if there is no manifest
+    """
+    try:
+        return dict(dal.load(MANIFEST))
+    except FileNotFoundError:
+        return dict()
+
+
+def load_index(dal):
+    """
+    Load the forward and the inverted indexes, folding in every segment that was not merged into
+    the base index yet. If the manifest changes while the index is loaded, i.e. a merge replaced
+    the base index and retired the segments, the load starts over, up to LOAD_ATTEMPTS times.
+    :param dal: the Dao where the index is persisted
+    :return: a tuple with the forward index, the inverted index and the manifest
+    """
+    for attempt in range(1, LOAD_ATTEMPTS + 1):
+        manifest = load_manifest(dal)
+        try:
+            forward_index, inverted_index = _load_index(dal, manifest)
+        except FileNotFoundError:
+            if attempt == LOAD_ATTEMPTS or load_manifest(dal) == manifest:
+                raise
+            continue
+        if attempt == LOAD_ATTEMPTS or load_manifest(dal) == manifest:
+            return forward_index, inverted_index, manifest
+
+
+def _load_index(dal, manifest):
+    """
+    Load the forward and the inverted indexes listed by a manifest.
+    :return: a tuple with the forward index and the inverted index
+    """
+    segments = manifest.get('segments', [])
+    tombstones = load_tombstones(dal) if segments else dict()
+    try:
+        forward_index = dal.load(FORWARD_INDEX)
+        inverted_index = dal.load(INVERTED_INDEX)
+    except FileNotFoundError:
+        if not manifest:
+            raise
+        forward_index = collections.defaultdict(set)
+        inverted_index = collections.defaultdict(set)
+    if segments:
+        forward_index = collections.defaultdict(set, forward_index)
+        inverted_index = collections.defaultdict(set, inverted_index)
+        remove_documents(forward_index, inverted_index, tombstones)
+    for segment in segments:
+        forward = dal.load(segment_name(FORWARD_INDEX, segment))
+        inverted = dal.load(segment_name(INVERTED_INDEX, segment))
+        dead = [key for key, tombstone in tombstones.items() if tombstone > segment]
+        if dead:
+            forward, inverted = dict(forward), dict(inverted)
+            remove_documents(forward, inverted, dead)
+        merge_index(forward_index, forward)
+        merge_index(inverted_index, inverted)
+    return forward_index, inverted_index
+
+
+def _load_segments(dal, indexname, manifest):
+    """
+    Load an index saved with each segment, besides the base index, by the IncrementalIndexEngine.
+    Segments saved without it, i.e. by older versions of the engine, are skipped.
+    :param dal: the Dao where the index is persisted
+    :param indexname: the name of the index in the base
+    :param manifest: the manifest that lists the segments, or None to load it
+    :return: a list of tuples with the entries of the base index and of each segment, in order,
+    and the set of keys of the documents that are dead in them
+    """
+    if manifest is None:
+        manifest = load_manifest(dal)
+    segments = manifest.get('segments', [])
+    tombstones = load_tombstones(dal) if segments else dict()
+    loaded = list()
+    for segment in [0] + segments:
+        try:
+            index = dal.load(segment_name(indexname, segment) if segment else indexname)
+        except FileNotFoundError:
+            continue
+        loaded.append((index, {key for key, tombstone in tombstones.items()
+                               if tombstone > segment}))
+    return loaded
+
+
+def load_positions(dal, manifest=None):
+    """
+    Load the positional index, kept by the index engines created with positional=True, folding
+    in the positions saved with the segments not merged yet.
+    :param dal: the Dao where the index is persisted
+    :param manifest: the manifest of the index, or None to load it
+    :return: a dict with each stem bound to a dict with the encoded positions of the stem in each
+    document, or an empty dict if there is no positional index
+    """
+    loaded = _load_segments(dal, POSITIONS, manifest)
+    if len(loaded) == 1 and not loaded[0][1]:
+        return loaded[0][0]
+    positions = dict()
+    for index, dead in loaded:
+        for stem, documents in index.items():
+            positions.setdefault(stem, dict()).update(
+                (key, value) for key, value in documents.items() if key not in dead)
+    return positions
+
+
+def load_tombstones(dal):
+    """
+    Load the tombstones of the documents deleted or replaced whose entries are still persisted.
+    The entries of a document are dead in the base index and in the segments numbered below its
+    tombstone, so a document replaced in a new segment is alive there.
+    :param dal: the Dao where the index is persisted
+    :return: a dict with the key of each document bound to its tombstone, or an empty dict
+    """
+    try:
+        return dict(dal.load(TOMBSTONES))
+    except FileNotFoundError:
+        return dict()
+
+
+def load_terms(dal, manifest=None):
+    """
+    Load the sorted term dictionary persisted with the index, joining the dictionaries saved
+    with the segments not merged yet.
+    :param dal: the Dao where the index is persisted
+    :param manifest: the manifest of the index, or None to load it
+    :return: a Terms.TermDictionary, or None if the dictionary was not persisted
+    """
+    dictionaries = [TermDictionary(blocks) for blocks, _ in _load_segments(dal, TERMS, manifest)]
+    if len(dictionaries) <= 1:
+        return dictionaries[0] if dictionaries else None
+    terms = TermDictionary()
+    for term, _ in itertools.groupby(heapq.merge(*dictionaries)):
+        terms.append(term)
+    return terms
+
+
+def load_lengths(dal, manifest=None):
+    """
+    Load the number of tokens of each document, used by the scoring models that normalize by
+    the length of the documents, folding in the lengths saved with the segments not merged yet.
+    :param dal: the Dao where the index is persisted
+    :param manifest: the manifest of the index, or None to load it
+    :return: a dict with the key of each document bound to its number of tokens, or an empty dict
+    if the lengths were not persisted
+    """
+    loaded = _load_segments(dal, DOC_LENGTHS, manifest)
+    if len(loaded) == 1 and not loaded[0][1]:
+        return loaded[0][0]
+    lengths = dict()
+    for index, dead in loaded:
+        lengths.update((key, length) for key, length in index.items() if key not in dead)
+    return lengths
 
 
 class IndexEngine(object):
@@ -26,7 +324,8 @@ class IndexEngine(object):
     path
     """
 
-    def __init__(self, normalizer=None, dal=None):
+    def __init__(self, normalizer=None, dal=None, positional=False, wal=False,
+                 deleted_threshold=0.2, analyzer=None):
         """
         Creates a new instance of the IndexEngine. The IndexEngine is responsible for maintain,
         classify an order the indexes.
@@ -38,21 +337,129 @@ class IndexEngine(object):
         to classify frequency of occurrence of the same word through the indexed documents.
         :param dal: an object from a class that inherits from Dal. It will be used to load and
         persist the indexes. It can be either a connection to a database or a simple file writer.
+        :param positional: if True, the positions of the stems in each document are also indexed,
+        so phrase and proximity queries can be searched.
+        :param wal: if True, the documents given to add_documents are logged to a write-ahead log
+        before being indexed, and initialize replays the ones whose commit was lost in a crash.
+        It needs a Dao persisted in a directory, like CSVFileDal.
+        :param deleted_threshold: ratio of the persisted documents that may be deleted or replaced
+        before their entries are purged from the files of the index.
+        :param analyzer: a Tokenizer.SinglePassAnalyzer that stems the tokens through its memo. The
+        documents must be tokenized by a crawler created with the same analyzer, and the index
+        searched by a SearchEngine created with it. Its normalizer is used if normalizer is not
+        provided.
 
         """
         self.inverted_index = collections.defaultdict(set)
         self.forward_index = collections.defaultdict(set)
+        self.positional = positional
+        self.positions = dict()
+        self.doc_lengths = dict()
+        self.tombstones = dict()
+        self.deleted_threshold = deleted_threshold
+        self.analyzer = analyzer
         self.normalizer = normalizer
+        if not self.normalizer and analyzer is not None:
+            self.normalizer = analyzer.normalizer
         self.dal = dal
         if not self.dal:
             self.dal = CSVFileDal('./index/')
+        self.dal.recover()
+        self.wal = WriteAheadLog(self.dal.path) if wal else None
+        manifest = load_manifest(self.dal)
+        self.generation = manifest.get('generation', 0)
+        self.wal_sequence = manifest.get('wal_sequence', 0)
 
     def initialize(self):
         """
         Load data into the two indexes.
         """
-        self.inverted_index = (self.dal.load('inverted_index.csv'))
-        self.forward_index = (self.dal.load('forward_index.csv'))
+        forward_index, inverted_index = self.load_base()
+        self.inverted_index = collections.defaultdict(set, inverted_index)
+        self.forward_index = collections.defaultdict(set, forward_index)
+        self.doc_lengths = load_lengths(self.dal)
+        if self.positional:
+            self.positions = load_positions(self.dal)
+        self.tombstones = load_tombstones(self.dal)
+        self.remove_documents(self.tombstones)
+        self.replay()
+
+    def load_base(self):
+        """
+        Load the persisted forward and inverted indexes. With a write-ahead log, an index never
+        committed is taken as empty, so the batches logged before its first commit can be
+        replayed.
+        :return: a tuple with the forward index and the inverted index
+        """
+        try:
+            return self.dal.load(FORWARD_INDEX), self.dal.load(INVERTED_INDEX)
+        except FileNotFoundError:
+            if self.wal is None or load_manifest(self.dal):
+                raise
+            return dict(), dict()
+
+    def replay(self):
+        """
+        Index again the batches of documents of the write-ahead log that were not committed to the
+        index, i.e. because the process crashed while they were being indexed.
+        """
+        if self.wal is not None:
+            for sequence, document_entries in self.wal.replay(self.wal_sequence):
+                self.wal_sequence = sequence
+                self._index_documents(document_entries)
+            self.wal.truncate()
+
+    def save_stems(self):
+        """
+        Persist the tokens already stemmed by the normalizer next to the index, so search engines
+        can start with a warm stem cache.
+        """
+        if isinstance(self.normalizer, Normalizer):
+            vocabulary = self.normalizer.vocabulary()
+            if vocabulary:
+                self.dal.save(vocabulary, STEMS)
+
+    def save_lengths(self, inverted):
+        """
+        Persist the number of tokens of the documents, computed once at index time from their
+        entries.
+        :param inverted: dict with the inverted entries of the documents
+        """
+        self.doc_lengths.update(document_lengths(inverted))
+        self.dal.save(self.doc_lengths, DOC_LENGTHS)
+
+    def save_terms(self, terms, indexname=TERMS):
+        """
+        Persist the sorted term dictionary of the index, used by the search engines to expand
+        prefixes, wildcard patterns and misspelled words.
+        :param terms: iterable with every term of the index, or a Terms.TermDictionary
+        :param indexname: the name under which the dictionary is persisted, i.e. the one of a
+        segment
+        """
+        if not isinstance(terms, TermDictionary):
+            terms = TermDictionary.from_terms(terms)
+        self.dal.save(terms.as_dict(), indexname)
+
+    def save_tombstones(self):
+        """
+        Persist the tombstones of the documents deleted or replaced, or remove them if there is
+        none.
+        """
+        if self.tombstones:
+            self.dal.save(self.tombstones, TOMBSTONES)
+        else:
+            self.dal.delete_all(TOMBSTONES)
+
+    def save_manifest(self):
+        """
+        Bump the generation of the index and persist it, so resident search engines know they
+        must reload the index. It must be called after the indexes were saved.
+        """
+        self.generation += 1
+        manifest = {'generation': self.generation}
+        if self.wal is not None:
+            manifest['wal_sequence'] = self.wal_sequence
+        self.dal.save(manifest, MANIFEST)
 
     def __normalize(self, term):
         """
@@ -61,33 +468,193 @@ class IndexEngine(object):
         param: terms: list of terms to be normalized
         return: a stem representing a normalized version of a term
         """
+        if self.analyzer is not None:
+            return self.analyzer.normalize(term)
         if not self.normalizer or not isinstance(self.normalizer, Normalizer):
             self.normalizer = SnowballStemmerNormalizer()
         return self.normalizer.normalize(term)
 
+    def _invert(self, document_entries):
+        """
+        Build the forward and the inverted entries of a batch of documents, without touching the
+        indexes held by the engine.
+        :param document_entries: a dict created by the parse method of a Crawler
+        :return: a tuple with the forward entries and the inverted entries of the batch
+        """
+        METRICS.count('index.documents', len(document_entries))
+        with METRICS.timer('index.invert'):
+            return invert(document_entries, self.__normalize)
+
+    def _invert_positions(self, document_entries):
+        """
+        Build the positional entries of a batch of documents, without touching the indexes held by
+        the engine.
+        :param document_entries: a dict created by the parse method of a Crawler
+        :return: a dict in the format returned by invert_positions
+        """
+        with METRICS.timer('index.invert_positions'):
+            return invert_positions(document_entries, self.__normalize)
+
     def add_documents(self, document_entries):
         """
-        Add new documents to be indexed.
+        Add new documents to be indexed. The indexes they change are committed all together, and
+        if there is a write-ahead log, they are logged before.
         :param document_entries: a set of objects from the class DocumentEntry
         """
         if document_entries:
-            forward = {key: {(document_entries[key][0])} for key in document_entries.keys()}
-            for key in document_entries.keys():
-                freq_dist = FreqDist(document_entries[key][1])
-                for token in document_entries[key][1]:
-                    if len(self.inverted_index) is 0 \
-                            or self.__normalize(token) not in self.inverted_index.keys():
-                        self.inverted_index[self.__normalize(token)] \
-                            .add((freq_dist.get(token), key, freq_dist.freq(token)))
-                    else:
-                        if not freq_dist.get(token) is None:
-                            self.inverted_index[self.__normalize(token)] \
-                                .add((freq_dist.get(token), key, freq_dist.freq(token)))
+            if self.wal is not None:
+                self.wal_sequence += 1
+                self.wal.append(self.wal_sequence, document_entries)
+            self._index_documents(document_entries)
+            if self.wal is not None:
+                self.wal.truncate()
 
+    def _index_documents(self, document_entries):
+        """
+        Invert the documents and commit them to the indexes in a single transaction.
+        :param document_entries: a dict created by the parse method of a Crawler
+        """
+        with self.dal.transaction():
+            if self.positional:
+                self.add_positions(self._invert_positions(document_entries))
+            self.add_postings(*self._invert(document_entries))
+
+    def add_positions(self, positions):
+        """
+        Add the positional entries of documents and persist the positional index. The positions of
+        a document indexed again replace the old ones.
+        :param positions: dict in the format returned by invert_positions
+        """
+        self.remove_positions({key for documents in positions.values() for key in documents
+                               if key in self.forward_index})
+        for stem, documents in positions.items():
+            self.positions.setdefault(stem, dict()).update(documents)
+        self.dal.save(self.positions, POSITIONS)
+
+    def add_postings(self, forward, inverted):
+        """
+        Add the entries of documents already inverted, i.e. by the workers of a
+        ParallelIngestPipeline. Documents already in the index are replaced. The whole index is
+        persisted, so the entries of the deleted documents are purged from it.
+        :param forward: dict with the forward entries of the documents
+        :param inverted: dict with the inverted entries of the documents
+        """
+        if forward:
+            self.remove_documents([key for key in forward.keys() if key in self.forward_index])
+            merge_index(self.inverted_index, inverted)
             self.forward_index.update(forward)
+            with METRICS.timer('index.tf_idf'):
+                self.tf_idf()
+            with self.dal.transaction():
+                self.dal.save(self.forward_index, FORWARD_INDEX)
+                self.dal.save(self.inverted_index, INVERTED_INDEX)
+                self.save_terms(self.inverted_index.keys())
+                self.save_lengths(inverted)
+                self.save_stems()
+                if self.tombstones:
+                    self.tombstones.clear()
+                    self.save_tombstones()
+                    if self.positional:
+                        self.dal.save(self.positions, POSITIONS)
+                self.save_manifest()
+
+    def remove_documents(self, keys):
+        """
+        Remove documents from the indexes held in memory, without persisting them.
+        :param keys: the keys of the documents
+        """
+        remove_documents(self.forward_index, self.inverted_index, keys)
+        for key in keys:
+            self.doc_lengths.pop(key, None)
+
+    def remove_positions(self, keys):
+        """
+        Remove documents from the positional index held in memory, without persisting it.
+        :param keys: the keys of the documents
+        """
+        keys = set(keys)
+        if keys and self.positions:
+            for stem in list(self.positions.keys()):
+                documents = self.positions[stem]
+                if any(key in documents for key in keys):
+                    self.positions[stem] = {key: value for key, value in documents.items()
+                                            if key not in keys}
+                    if not self.positions[stem]:
+                        del self.positions[stem]
+
+    def delete_documents(self, keys):
+        """
+        Delete documents from the index. They leave the indexes held in memory at once, but only
+        their tombstones are persisted, so the cost is bound to the number of documents deleted.
+        Search engines skip them while scoring until their entries are purged from the files,
+        which happens on the next call to add_documents or once the deleted documents pass the
+        deleted threshold.
+        :param keys: the keys of the documents to be deleted
+        """
+        keys = [key for key in keys if key in self.forward_index]
+        if keys:
+            self.remove_documents(keys)
+            self.remove_positions(keys)
+            for key in keys:
+                self.tombstones[key] = self.tombstone()
+            if self.deleted_ratio() > self.deleted_threshold:
+                self.purge()
+            else:
+                with self.dal.transaction():
+                    self.save_tombstones()
+                    self.save_manifest()
+
+    def update_documents(self, document_entries):
+        """
+        Replace documents already indexed by their new versions. Documents not indexed yet are
+        added.
+        :param document_entries: a dict created by the parse method of a Crawler
+        """
+        self.add_documents(document_entries)
+
+    def apply_changes(self, changes):
+        """
+        Index the documents found by a recrawl. The crawl manifest of the changes must be saved
+        afterwards (see Crawler.save_crawl_manifest).
+        :param changes: a Crawler.CrawlChanges
+        """
+        self.delete_documents(changes.deleted)
+        document_entries = dict(changes.added)
+        document_entries.update(changes.modified)
+        self.update_documents(document_entries)
+
+    def tombstone(self):
+        """
+        :return: the tombstone of a document deleted now: the first segment in which the document
+        may be alive again. The base index is the segment 0.
+        """
+        return 1
+
+    def deleted_ratio(self):
+        """
+        :return: the ratio of the documents persisted in the files of the index that are deleted
+        or replaced
+        """
+        total = len(self.forward_index) + len(self.tombstones)
+        return len(self.tombstones) / total if total else 0.0
+
+    def purge(self):
+        """
+        Rewrite the index without the entries of the deleted documents, recomputing the TF-IDF of
+        the remaining ones.
+        """
+        with METRICS.timer('index.tf_idf'):
             self.tf_idf()
-            self.dal.save(self.forward_index, 'forward_index.csv')
-            self.dal.save(self.inverted_index, 'inverted_index.csv')
+        self.tombstones.clear()
+        with self.dal.transaction():
+            self.dal.save(self.forward_index, FORWARD_INDEX)
+            self.dal.save(self.inverted_index, INVERTED_INDEX)
+            self.save_terms(self.inverted_index.keys())
+            self.dal.save(self.doc_lengths, DOC_LENGTHS)
+            if self.positional:
+                self.dal.save(self.positions, POSITIONS)
+            self.save_tombstones()
+            self.save_manifest()
 
     def idf(self, token):
         """
@@ -125,5 +692,576 @@ class IndexEngine(object):
         """
         self.inverted_index.clear()
         self.forward_index.clear()
-        self.dal.delete_all("./index/forward_index")
-        self.dal.delete_all("./index/inverted_index")
+        self.positions.clear()
+        self.doc_lengths.clear()
+        self.tombstones.clear()
+        if self.wal is not None:
+            self.wal.truncate()
+        with self.dal.transaction():
+            self.dal.delete_all(FORWARD_INDEX)
+            self.dal.delete_all(INVERTED_INDEX)
+            self.dal.delete_all(POSITIONS)
+            self.dal.delete_all(DOC_LENGTHS)
+            self.dal.delete_all(TOMBSTONES)
+            self.dal.delete_all(TERMS)
+            self.save_manifest()
+
+
+class CompactIndexEngine(IndexEngine):
+    """
+    An Index Engine that assigns dense integer ids to the documents and keeps the postings as
+    sorted array backed columns (see Postings.CompactIndex). The uuid of each document is kept
+    only in the doc table, which also works as the forward index.
+    """
+
+    def __init__(self, normalizer=None, dal=None, positional=False, wal=False,
+                 deleted_threshold=0.2, analyzer=None):
+        super().__init__(normalizer=normalizer, dal=dal, positional=positional, wal=wal,
+                         deleted_threshold=deleted_threshold, analyzer=analyzer)
+        self.inverted_index = CompactIndex()
+        self.forward_index = self.inverted_index.doc_table
+
+    def initialize(self):
+        """
+        Load data into the two indexes, converting them to the compact format.
+        """
+        self.inverted_index = CompactIndex.from_index(*self.load_base())
+        self.forward_index = self.inverted_index.doc_table
+        self.doc_lengths = load_lengths(self.dal)
+        if self.positional:
+            self.positions = load_positions(self.dal)
+        self.tombstones = load_tombstones(self.dal)
+        self.remove_documents(self.tombstones)
+        self.replay()
+
+    def add_postings(self, forward, inverted):
+        """
+        Add the entries of documents already inverted. Documents already in the index are
+        replaced, and the remaining ones may get new doc ids.
+        :param forward: dict with the forward entries of the documents
+        :param inverted: dict with the inverted entries of the documents
+        """
+        if forward:
+            self.remove_documents([key for key in forward.keys() if key in self.forward_index])
+            for key in forward.keys():
+                for name in sorted(forward[key]):
+                    self.forward_index.add(key, name)
+            self.inverted_index.add(inverted)
+            with METRICS.timer('index.tf_idf'):
+                self.tf_idf()
+            with self.dal.transaction():
+                self.dal.save(self.forward_index, FORWARD_INDEX)
+                self.dal.save(self.inverted_index, INVERTED_INDEX)
+                self.save_terms(self.inverted_index.keys())
+                self.save_lengths(inverted)
+                self.save_stems()
+                if self.tombstones:
+                    self.tombstones.clear()
+                    self.save_tombstones()
+                    if self.positional:
+                        self.dal.save(self.positions, POSITIONS)
+                self.save_manifest()
+
+    def remove_documents(self, keys):
+        """
+        Remove documents from the indexes held in memory, rebuilding the compact index without
+        them.
+        :param keys: the keys of the documents
+        """
+        keys = [key for key in keys if key in self.forward_index]
+        if keys:
+            self.inverted_index = self.inverted_index.without(keys)
+            self.forward_index = self.inverted_index.doc_table
+            for key in keys:
+                self.doc_lengths.pop(key, None)
+
+    def idf(self, token):
+        """
+        Calc the inverse document frequency represented by the formula
+        idf = log_10(total_num_of_docs/num_docs_with_token)
+        """
+        return log10(len(self.forward_index) / len(self.inverted_index.postings[token]))
+
+    def tf_idf(self):
+        """
+        Calc the TF-IDF for all tokens in the inverted_index, rewriting only the weight columns
+        """
+        for token, postings in self.inverted_index.postings.items():
+            postings.reweight(self.idf(token))
+
+
+class IncrementalIndexEngine(IndexEngine):
+    """
+    An Index Engine that ingests documents incrementally. The postings keep only the raw term
+    frequencies, so the IDF is computed lazily at query time, and every call to add_documents
+    persists only its own delta as a new segment. The segments are folded into the base index by
+    a periodic merge that runs in background.
+    """
+
+    def __init__(self, normalizer=None, dal=None, merge_threshold=8, positional=False,
+                 wal=False, deleted_threshold=0.2, analyzer=None):
+        """
+        Creates a new instance of the IncrementalIndexEngine. The segments and the tombstones
+        listed next to the index are read here, so documents added without initialize go to new
+        segments instead of overwriting the ones persisted. Documents can only be replaced or
+        deleted once the index was loaded by initialize.
+
+        :param normalizer: an object from a class that inherits from Normalizer.
+        :param dal: an object from a class that inherits from Dal.
+        :param merge_threshold: number of segments that triggers a background merge.
+        :param positional: if True, the positions of the stems in each document are also indexed.
+        :param wal: if True, the documents are logged to a write-ahead log before being indexed.
+        :param deleted_threshold: ratio of the persisted documents that may be deleted or replaced
+        before a background merge purges their entries.
+        :param analyzer: a Tokenizer.SinglePassAnalyzer, as in IndexEngine.
+        """
+        super().__init__(normalizer=normalizer, dal=dal, positional=positional, wal=wal,
+                         deleted_threshold=deleted_threshold, analyzer=analyzer)
+        self.merge_threshold = merge_threshold
+        manifest = load_manifest(self.dal)
+        self.segments = list(manifest.get('segments', []))
+        self.next_segment = manifest.get('next_segment', max(self.segments, default=0) + 1)
+        self.retired = list(manifest.get('retired', []))
+        self.tombstones = load_tombstones(self.dal)
+        self.lock = threading.RLock()
+        self.merger = None
+
+    def initialize(self):
+        """
+        Load data into the two indexes, including the segments not merged yet. With a write-ahead
+        log, an index never committed starts empty, so the batches logged before its first commit
+        can be replayed.
+        """
+        with self.lock:
+            try:
+                forward_index, inverted_index, manifest = load_index(self.dal)
+            except FileNotFoundError:
+                if self.wal is None or load_manifest(self.dal):
+                    raise
+                forward_index, inverted_index, manifest = dict(), dict(), dict()
+            self.forward_index = collections.defaultdict(set, forward_index)
+            self.inverted_index = collections.defaultdict(set, inverted_index)
+            self.generation = manifest.get('generation', 0)
+            self.segments = list(manifest.get('segments', []))
+            self.next_segment = manifest.get('next_segment', max(self.segments, default=0) + 1)
+            self.retired = list(manifest.get('retired', []))
+            self.doc_lengths = dict(load_lengths(self.dal, manifest))
+            if self.positional:
+                self.positions = dict(load_positions(self.dal, manifest))
+            self.wal_sequence = manifest.get('wal_sequence', 0)
+            self.tombstones = load_tombstones(self.dal)
+            if not self.segments:
+                self.remove_documents(self.tombstones)
+                self.remove_positions(self.tombstones)
+        self.replay()
+
+    def _index_documents(self, document_entries):
+        """
+        Invert the documents and commit them as a new segment, in a single transaction.
+        :param document_entries: a dict created by the parse method of a Crawler
+        """
+        positions = self._invert_positions(document_entries) if self.positional else None
+        forward, inverted = self._invert(document_entries)
+        with self.dal.transaction(), self.lock:
+            if positions is not None:
+                self.add_positions(positions)
+            self.add_postings(forward, inverted)
+
+    def add_positions(self, positions):
+        """
+        Add the positional entries of documents, persisting only these entries with the segment
+        committed next by add_postings, so both must be called in the same transaction.
+        :param positions: dict in the format returned by invert_positions
+        """
+        with self.lock:
+            self.remove_positions({key for documents in positions.values() for key in documents
+                                   if key in self.forward_index})
+            for stem, documents in positions.items():
+                self.positions.setdefault(stem, dict()).update(documents)
+            self.dal.save(positions, segment_name(POSITIONS, self.next_segment))
+
+    def add_postings(self, forward, inverted):
+        """
+        Add the entries of documents already inverted, persisting only these entries, their
+        lengths and their terms as a new segment. Documents already in the index are replaced:
+        the tombstones of their old versions are persisted with the new segment.
+        :param forward: dict with the forward entries of the documents
+        :param inverted: dict with the inverted entries of the documents
+        """
+        if forward:
+            with self.dal.transaction(), self.lock:
+                replaced = [key for key in forward.keys() if key in self.forward_index]
+                self.remove_documents(replaced)
+                segment = self.next_segment
+                for key in replaced:
+                    self.tombstones[key] = segment
+                merge_index(self.forward_index, forward)
+                merge_index(self.inverted_index, inverted)
+                self.segments.append(segment)
+                self.next_segment = segment + 1
+                self.dal.save(forward, segment_name(FORWARD_INDEX, segment))
+                self.dal.save(inverted, segment_name(INVERTED_INDEX, segment))
+                self.save_terms(inverted.keys(), segment_name(TERMS, segment))
+                lengths = document_lengths(inverted)
+                self.doc_lengths.update(lengths)
+                self.dal.save(lengths, segment_name(DOC_LENGTHS, segment))
+                if replaced:
+                    self.save_tombstones()
+                self.save_manifest()
+                if len(self.segments) >= self.merge_threshold or \
+                        self.deleted_ratio() > self.deleted_threshold:
+                    self.merge(wait=False)
+
+    def delete_documents(self, keys):
+        """
+        Delete documents from the index, persisting only their tombstones. Once the deleted
+        documents pass the deleted threshold, a background merge purges their entries.
+        :param keys: the keys of the documents to be deleted
+        """
+        with self.dal.transaction(), self.lock:
+            keys = [key for key in keys if key in self.forward_index]
+            if not keys:
+                return
+            self.remove_documents(keys)
+            self.remove_positions(keys)
+            for key in keys:
+                self.tombstones[key] = self.tombstone()
+            self.save_tombstones()
+            self.save_manifest()
+            if self.deleted_ratio() > self.deleted_threshold:
+                self.merge(wait=False)
+
+    def tombstone(self):
+        return self.next_segment
+
+    def purge(self):
+        """
+        Purge the entries of the deleted documents with a merge, waiting for it.
+        """
+        self.merge(wait=True)
+
+    def save_manifest(self, bump=True):
+        """
+        Persist the generation of the index and the list of segments not merged yet.
+        :param bump: if True, bumps the generation of the index. Merges don't change the contents
+        of the index, so they keep the generation as it is.
+        """
+        if bump:
+            self.generation += 1
+        manifest = {'generation': self.generation, 'segments': self.segments,
+                    'next_segment': self.next_segment, 'retired': self.retired}
+        if self.wal is not None:
+            manifest['wal_sequence'] = self.wal_sequence
+        self.dal.save(manifest, MANIFEST)
+
+    def weight(self, token, entry):
+        """
+        Calc the TF-IDF of an entry of the inverted index with the statistics of the moment
+        :param token: the normalized token the entry belongs to
+        :param entry: a tuple (qty_in_doc, doc_key, ntf) from the inverted index
+        :return: the TF-IDF of the entry
+        """
+        return entry[2] * self.idf(token)
+
+    def merge(self, wait=True):
+        """
+        Fold all segments into the base index in a background thread. The merge is idempotent:
+        if it is interrupted, the segments are still listed in the manifest and will be joined
+        again with the base index. The files of the merged segments are kept as retired until the
+        next merge, so search engines that read the manifest before this merge can still load
+        them.
+        :param wait: if True, blocks until the merge is finished
+        """
+        with self.lock:
+            if not self.merger or not self.merger.is_alive():
+                self.merger = threading.Thread(target=self.__merge, daemon=True)
+                self.merger.start()
+            merger = self.merger
+        if wait:
+            merger.join()
+
+    def __merge(self):
+        """
+        Rewrite the base index, with its lengths, positions and term dictionary, with a snapshot
+        of the indexes, which holds no entry of the deleted documents, and drop the merged
+        segments and the tombstones applied by the snapshot.
+        """
+        with self.lock:
+            merged = list(self.segments)
+            applied = dict(self.tombstones)
+            forward = {key: set(value) for key, value in self.forward_index.items()}
+            inverted = {key: set(value) for key, value in self.inverted_index.items()}
+            doc_lengths = dict(self.doc_lengths)
+            positions = None
+            if self.positional:
+                positions = {stem: dict(documents) for stem, documents in self.positions.items()}
+        with self.dal.transaction():
+            self.dal.save(forward, FORWARD_INDEX)
+            self.dal.save(inverted, INVERTED_INDEX)
+            self.dal.save(doc_lengths, DOC_LENGTHS)
+            if positions is not None:
+                self.dal.save(positions, POSITIONS)
+            self.save_terms(inverted.keys())
+            self.save_stems()
+        with self.dal.transaction(), self.lock:
+            self.segments = [segment for segment in self.segments if segment not in merged]
+            for key, tombstone in applied.items():
+                if self.tombstones.get(key) == tombstone:
+                    del self.tombstones[key]
+            obsolete, self.retired = self.retired, merged
+            if applied:
+                self.save_tombstones()
+            self.save_manifest(bump=bool(applied))
+        for segment in obsolete:
+            self.delete_segment(segment)
+
+    def delete_segment(self, segment):
+        """
+        Remove the files of a segment.
+        :param segment: the number of the segment
+        """
+        for indexname in SEGMENTED:
+            self.dal.delete_all(segment_name(indexname, segment))
+
+    def reset(self):
+        """
+        Reset the indexes to an empty state, removing the base index and all of its segments
+        """
+        if self.merger:
+            self.merger.join()
+        with self.dal.transaction(), self.lock:
+            self.inverted_index.clear()
+            self.forward_index.clear()
+            for segment in self.segments + self.retired:
+                self.delete_segment(segment)
+            self.segments = []
+            self.retired = []
+            self.next_segment = 1
+            self.positions.clear()
+            self.doc_lengths.clear()
+            self.tombstones.clear()
+            if self.wal is not None:
+                self.wal.truncate()
+            self.dal.delete_all(FORWARD_INDEX)
+            self.dal.delete_all(INVERTED_INDEX)
+            self.dal.delete_all(POSITIONS)
+            self.dal.delete_all(DOC_LENGTHS)
+            self.dal.delete_all(TOMBSTONES)
+            self.dal.delete_all(TERMS)
+            self.save_manifest()
+
+
+class StreamedIndex:
+    """
+    An index whose entries are produced by a generator, to be saved by a streaming Dao.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    def items(self):
+        """
+        :return: the generator of tuples (key, value) of the index
+        """
+        return self.entries
+
+
+class SpimiIndexEngine(IndexEngine):
+    """
+    An Index Engine that builds the indexes from a stream of documents with bounded memory,
+    following the Single-Pass In-Memory Indexing: documents are inverted in fixed-size batches
+    into an in-memory block, which is flushed to disk sorted by term whenever it outgrows the
+    memory budget. At the end the blocks are merged term by term, computing the TF-IDF of each
+    term while the final index is written.
+    """
+
+    def __init__(self, normalizer=None, dal=None, memory_budget=64 * 1024 * 1024,
+                 batch_size=100, block_path=None, analyzer=None):
+        """
+        Creates a new instance of the SpimiIndexEngine.
+
+        :param normalizer: an object from a class that inherits from Normalizer.
+        :param dal: an object from a class that inherits from Dal. If its save method is not
+        streaming, the merged index is materialized in memory before being saved.
+        :param memory_budget: approximated number of bytes a block can take before being flushed.
+        :param batch_size: number of documents inverted at once.
+        :param block_path: directory where the blocks are flushed. If not provided, a temporary
+        directory is used.
+        :param analyzer: a Tokenizer.SinglePassAnalyzer, as in IndexEngine.
+        """
+        super().__init__(normalizer=normalizer, dal=dal, analyzer=analyzer)
+        self.memory_budget = memory_budget
+        self.batch_size = batch_size
+        self.block_path = block_path
+
+    def add_stream(self, documents):
+        """
+        Build the indexes from scratch with the documents of a stream, replacing the persisted
+        indexes. The indexes are not kept in memory, use initialize to load them.
+        :param documents: an iterable of tuples (key, (full path name, tokens)), like the ones
+        yielded by Crawler.stream
+        """
+        path = self.block_path or tempfile.mkdtemp(prefix='spimi-')
+        blocks = CSVFileDal(path)
+        block, forward, used = collections.defaultdict(set), dict(), 0
+        batch, flushed, count = dict(), 0, 0
+        self.doc_lengths = dict()
+        try:
+            for key, entry in itertools.chain(documents, [(None, None)]):
+                if key is not None:
+                    batch[key] = entry
+                if len(batch) >= self.batch_size or (key is None and batch):
+                    used += self.__fill(block, forward, batch)
+                    count += len(batch)
+                    batch = dict()
+                if used >= self.memory_budget or (key is None and forward):
+                    flushed += 1
+                    blocks.save(StreamedIndex((term, block[term]) for term in sorted(block)),
+                                segment_name(INVERTED_BLOCK, flushed))
+                    blocks.save(forward, segment_name(FORWARD_BLOCK, flushed))
+                    block, forward, used = collections.defaultdict(set), dict(), 0
+            with self.dal.transaction():
+                self.__save(StreamedIndex(itertools.chain.from_iterable(
+                    blocks.scan(segment_name(FORWARD_BLOCK, block_number))
+                    for block_number in range(1, flushed + 1))), FORWARD_INDEX)
+                terms = TermDictionary()
+                self.__save(StreamedIndex(self.__merge(blocks, flushed, count, terms)),
+                            INVERTED_INDEX)
+                self.save_terms(terms)
+                self.dal.save(self.doc_lengths, DOC_LENGTHS)
+                self.save_stems()
+                self.tombstones.clear()
+                self.save_tombstones()
+                self.save_manifest()
+        finally:
+            if not self.block_path:
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                for block_number in range(1, flushed + 1):
+                    blocks.delete_all(segment_name(FORWARD_BLOCK, block_number))
+                    blocks.delete_all(segment_name(INVERTED_BLOCK, block_number))
+        self.inverted_index.clear()
+        self.forward_index.clear()
+
+    def __fill(self, block, forward, batch):
+        """
+        Invert a batch of documents into the in-memory block.
+        :return: the approximated number of bytes added to the block
+        """
+        batch_forward, batch_inverted = self._invert(batch)
+        forward.update(batch_forward)
+        self.doc_lengths.update(document_lengths(batch_inverted))
+        used = DOCUMENT_BYTES * len(batch_forward)
+        for term, entries in batch_inverted.items():
+            if term not in block:
+                used += TERM_BYTES
+            block[term].update(entries)
+            used += POSTING_BYTES * len(entries)
+        return used
+
+    @staticmethod
+    def __merge(blocks, flushed, count, terms):
+        """
+        Merge the sorted blocks term by term, weighting the entries of each term with its TF-IDF.
+        :param blocks: the Dao where the blocks were flushed
+        :param flushed: number of blocks
+        :param count: number of documents in the blocks
+        :param terms: the Terms.TermDictionary where the merged terms are appended
+        :return: Yields a tuple with each term and its entries, in the order of the terms
+        """
+        scans = [blocks.scan(segment_name(INVERTED_BLOCK, block_number))
+                 for block_number in range(1, flushed + 1)]
+        merged = heapq.merge(*scans, key=operator.itemgetter(0))
+        for term, group in itertools.groupby(merged, key=operator.itemgetter(0)):
+            terms.append(term)
+            entries = set().union(*(entries for _, entries in group))
+            idf = log10(count / len(entries))
+            yield term, {(entry[0], entry[1], entry[2], entry[2] * idf) for entry in entries}
+
+    def __save(self, index, indexname):
+        """
+        Save an index produced by a generator, materializing it if the Dao is not streaming.
+        """
+        self.dal.save(index if self.dal.streaming else dict(index.items()), indexname)
+
+
+class ShardedIndexEngine:
+    """
+    An Index Engine that partitions the documents among shards by the hash of their keys. Each
+    shard is an independent index engine persisted by its own Dao, so the shards can be searched
+    in parallel by a SearchEngine.ShardedSearchEngine.
+    """
+
+    def __init__(self, normalizer=None, dals=None, engine_class=IndexEngine):
+        """
+        Creates a new instance of the ShardedIndexEngine.
+
+        :param normalizer: an object from a class that inherits from Normalizer, shared by the
+        shards.
+        :param dals: list with the Dao of each shard. If not provided, uses four shards persisted
+        as csv under './index/' (see shard_dals).
+        :param engine_class: the class of index engine used by the shards.
+        """
+        if not dals:
+            dals = shard_dals('./index/', 4)
+        self.shards = [engine_class(normalizer=normalizer, dal=dal) for dal in dals]
+
+    def shard(self, key):
+        """
+        :param key: the key of a document
+        :return: the number of the shard that holds the document
+        """
+        return zlib.crc32(key.encode('utf-8')) % len(self.shards)
+
+    def initialize(self):
+        """
+        Load data into the indexes of all shards.
+        """
+        for shard in self.shards:
+            shard.initialize()
+
+    def add_documents(self, document_entries):
+        """
+        Route new documents to their shards and index them there.
+        :param document_entries: a dict created by the parse method of a Crawler
+        """
+        routed = collections.defaultdict(dict)
+        for key, entry in document_entries.items():
+            routed[self.shard(key)][key] = entry
+        for number, entries in routed.items():
+            self.shards[number].add_documents(entries)
+
+    def delete_documents(self, keys):
+        """
+        Route the keys of the documents to be deleted to their shards and delete them there.
+        :param keys: the keys of the documents to be deleted
+        """
+        routed = collections.defaultdict(list)
+        for key in keys:
+            routed[self.shard(key)].append(key)
+        for number, shard_keys in routed.items():
+            self.shards[number].delete_documents(shard_keys)
+
+    def update_documents(self, document_entries):
+        """
+        Route documents to their shards and replace them there.
+        :param document_entries: a dict created by the parse method of a Crawler
+        """
+        self.add_documents(document_entries)
+
+    def apply_changes(self, changes):
+        """
+        Index the documents found by a recrawl in their shards.
+        :param changes: a Crawler.CrawlChanges
+        """
+        self.delete_documents(changes.deleted)
+        document_entries = dict(changes.added)
+        document_entries.update(changes.modified)
+        self.update_documents(document_entries)
+
+    def reset(self):
+        """
+        Reset the indexes of all shards to an empty state
+        """
+        for shard in self.shards:
+            shard.reset()
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+# Author: Helton Dória Costa <helton.doria@gmail.com>
+# Copyright (C) 2016-2016
+# URL: <http://github.com/heltondoria/information_retrival>
+# For license information, see LICENSE.TXT
+"""
+Module that contains the instrumentation of the engines and the statistics of the indexes
+"""
+import collections
+import os
+import re
+import threading
+import time
+
+
+def _metric_name(prefix, name, suffix=''):
+    """
+    Turn a dotted metric name into a Prometheus one, i.e. index.tf_idf -> ir_index_tf_idf.
+    """
+    return re.sub(r'[^a-zA-Z0-9_]', '_', '{}_{}{}'.format(prefix, name, suffix))
+
+
+class _NullTimer:
+    """
+    The timer given while the metrics are disabled, which does nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _Timer:
+    """
+    A timer that adds the time spent in its block to a metric.
+    """
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """
+    A registry of counters and timers fed by the hooks in the crawlers, normalizers, index
+    engines, Daos and search engines. It is disabled by default, when the hooks cost a single
+    attribute lookup.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.counters = collections.Counter()
+        self.timers = dict()
+        self.lock = threading.Lock()
+
+    def enable(self):
+        """
+        Start collecting metrics.
+        """
+        self.enabled = True
+
+    def disable(self):
+        """
+        Stop collecting metrics, keeping the ones already collected.
+        """
+        self.enabled = False
+
+    def reset(self):
+        """
+        Drop the metrics collected.
+        """
+        with self.lock:
+            self.counters.clear()
+            self.timers.clear()
+
+    def count(self, name, value=1):
+        """
+        Add a value to a counter.
+        :param name: dotted name of the counter, i.e. search.queries
+        :param value: the value to be added
+        """
+        if self.enabled:
+            with self.lock:
+                self.counters[name] += value
+
+    def observe(self, name, seconds):
+        """
+        Add a duration to a timer.
+        :param name: dotted name of the timer, i.e. index.tf_idf
+        :param seconds: the duration
+        """
+        if self.enabled:
+            with self.lock:
+                calls, total = self.timers.get(name, (0, 0.0))
+                self.timers[name] = (calls + 1, total + seconds)
+
+    def timer(self, name):
+        """
+        Time a block of code, i.e. with METRICS.timer('index.tf_idf'): ...
+        :param name: dotted name of the timer
+        :return: a context manager
+        """
+        return _Timer(self, name) if self.enabled else _NULL_TIMER
+
+    def snapshot(self):
+        """
+        :return: a dict with the counters and, for each timer, its number of calls and its total
+        number of seconds
+        """
+        with self.lock:
+            return {'counters': dict(self.counters),
+                    'timers': {name: {'calls': calls, 'seconds': seconds}
+                               for name, (calls, seconds) in self.timers.items()}}
+
+    def prometheus(self, prefix='ir'):
+        """
+        :param prefix: prefix of the names of the metrics
+        :return: the metrics in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines = list()
+        for name, value in sorted(snapshot['counters'].items()):
+            metric = _metric_name(prefix, name, '_total')
+            lines.extend(['# TYPE {} counter'.format(metric), '{} {}'.format(metric, value)])
+        for name, timer in sorted(snapshot['timers'].items()):
+            metric = _metric_name(prefix, name, '_seconds')
+            lines.extend(['# TYPE {} summary'.format(metric),
+                          '{}_count {}'.format(metric, timer['calls']),
+                          '{}_sum {}'.format(metric, timer['seconds'])])
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+
+
+class IndexStats:
+    """
+    The statistics of a forward and an inverted index: number of documents, vocabulary size,
+    number of postings and the distribution of the lengths of the posting lists, and the bytes
+    taken by the index files.
+    """
+
+    def __init__(self, forward_index, inverted_index, path=None):
+        """
+        :param forward_index: the forward index, in any of the formats of the engines
+        :param inverted_index: the inverted index, in any of the formats of the engines
+        :param path: directory of the index files. If given, their sizes are summed.
+        """
+        columns = getattr(inverted_index, 'columns', None)
+        lengths = sorted(len(columns(term)[0]) if columns else len(inverted_index[term])
+                         for term in inverted_index.keys())
+        self.documents = len(forward_index)
+        self.vocabulary = len(lengths)
+        self.postings = sum(lengths)
+        self.posting_lengths = {
+            'min': lengths[0] if lengths else 0,
+            'max': lengths[-1] if lengths else 0,
+            'mean': self.postings / len(lengths) if lengths else 0.0,
+            'p50': lengths[len(lengths) // 2] if lengths else 0,
+            'p90': lengths[min(len(lengths) - 1, len(lengths) * 9 // 10)] if lengths else 0,
+            'p99': lengths[min(len(lengths) - 1, len(lengths) * 99 // 100)] if lengths else 0}
+        self.histogram = collections.Counter(1 << (length - 1).bit_length() for length in lengths)
+        self.bytes = dict()
+        if path and os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if os.path.isfile(os.path.join(path, name)):
+                    self.bytes[name] = os.path.getsize(os.path.join(path, name))
+
+    @classmethod
+    def from_engine(cls, engine):
+        """
+        :param engine: an IndexEngine or a SearchEngine, with its indexes loaded
+        :return: the statistics of the indexes held by the engine
+        """
+        return cls(engine.forward_index, engine.inverted_index, getattr(engine.dal, 'path', None))
+
+    def as_dict(self):
+        """
+        :return: a dict with the statistics. The histogram counts the posting lists by the power
+        of 2 that bounds their length.
+        """
+        return {'documents': self.documents, 'vocabulary': self.vocabulary,
+                'postings': self.postings, 'posting_lengths': dict(self.posting_lengths),
+                'histogram': dict(sorted(self.histogram.items())),
+                'bytes': dict(self.bytes), 'total_bytes': sum(self.bytes.values())}
+
+    def prometheus(self, prefix='ir_index'):
+        """
+        :param prefix: prefix of the names of the metrics
+        :return: the statistics in the Prometheus text exposition format, as gauges
+        """
+        lines = list()
+        for name in ('documents', 'vocabulary', 'postings'):
+            metric = _metric_name(prefix, name)
+            lines.extend(['# TYPE {} gauge'.format(metric),
+                          '{} {}'.format(metric, getattr(self, name))])
+        metric = _metric_name(prefix, 'posting_length')
+        lines.append('# TYPE {} gauge'.format(metric))
+        lines.extend('{}{{stat="{}"}} {}'.format(metric, stat, value)
+                     for stat, value in self.posting_lengths.items())
+        metric = _metric_name(prefix, 'posting_lists')
+        lines.append('# TYPE {} gauge'.format(metric))
+        lines.extend('{}{{upper="{}"}} {}'.format(metric, bound, count)
+                     for bound, count in sorted(self.histogram.items()))
+        metric = _metric_name(prefix, 'bytes')
+        lines.append('# TYPE {} gauge'.format(metric))
+        lines.extend('{}{{file="{}"}} {}'.format(metric, name, size)
+                     for name, size in self.bytes.items())
+        return '\n'.join(lines) + '\n'
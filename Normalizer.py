@@ -11,6 +11,9 @@ from abc import ABCMeta, abstractmethod
 
 from nltk import SnowballStemmer
 
+from Cache import LRUCache
+from Metrics import METRICS
+
 
 class Normalizer(metaclass=ABCMeta):
     """
@@ -36,15 +39,38 @@ class Normalizer(metaclass=ABCMeta):
         """
         pass
 
+    def vocabulary(self):
+        """
+        Give the tokens already normalized, so they can be persisted with the index. Normalizers
+        without a cache have nothing to give.
+        :return: A dict with each stem or lemma as key and the set of tokens it came from
+        """
+        return dict()
+
+    def preload(self, vocabulary):
+        """
+        Warm up the normalizer with tokens normalized before. Normalizers without a cache
+        ignore it.
+        :param vocabulary: A dict in the format returned by vocabulary
+        """
+        pass
+
 
 class SnowballStemmerNormalizer(Normalizer):
     """
-    A Normalizer that uses the NLTK SnowballStemmer to normalize tokens.
+    A Normalizer that uses the NLTK SnowballStemmer to normalize tokens. Stemming is pure and
+    expensive, so the stems are memoized in a LRU cache.
     """
 
-    def __init__(self, language='english'):
+    def __init__(self, language='english', cache_size=65536):
+        """
+        :param language: Language of the stemmer
+        :param cache_size: Maximum number of stems kept in the cache. If None, the cache grows
+        with the vocabulary of the corpus and if 0, the cache is disabled.
+        """
         self.language = language
         self.stemmer = SnowballStemmer(self.language)
+        self.cache = LRUCache(cache_size)
 
     def normalize(self, token):
         """
@@ -52,8 +78,12 @@ class SnowballStemmerNormalizer(Normalizer):
         :param token:
         :return: A stem of the token, or the token, if a stem could not be produced.
         """
-
-        return self.stemmer.stem(token)
+        stem = self.cache.get(token)
+        if stem is None:
+            METRICS.count('normalizer.stemmed')
+            stem = self.stemmer.stem(token)
+            self.cache.put(token, stem)
+        return stem
 
     def normalize_list(self, tokens):
         """
@@ -62,4 +92,29 @@ class SnowballStemmerNormalizer(Normalizer):
         :return: Yields a normalized token
         """
         for token in tokens:
-            yield self.stemmer.stem(token)
+            yield self.normalize(token)
+
+    def cache_info(self):
+        """
+        :return: a dict with the hits, misses, current size and maximum size of the stem cache
+        """
+        return self.cache.info()
+
+    def vocabulary(self):
+        """
+        Give the tokens held by the stem cache, so they can be persisted with the index.
+        :return: A dict with each stem as key and the set of tokens it came from
+        """
+        vocabulary = dict()
+        for token, stem in self.cache.items():
+            vocabulary.setdefault(stem, set()).add(token)
+        return vocabulary
+
+    def preload(self, vocabulary):
+        """
+        Warm up the stem cache with tokens stemmed before.
+        :param vocabulary: A dict in the format returned by vocabulary
+        """
+        for stem, tokens in vocabulary.items():
+            for token in tokens:
+                self.cache.put(token, stem)
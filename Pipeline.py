@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# Author: Helton Dória Costa <helton.doria@gmail.com>
+# Copyright (C) 2016-2016
+# URL: <http://github.com/heltondoria/information_retrival>
+# For license information, see LICENSE.TXT
+"""
+Module that contains pipelines that feed the index engines with documents
+"""
+import collections
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from Crawler import SimpleTxtCrawler
+from IndexEngine import invert, invert_positions, merge_index
+from Normalizer import Normalizer, SnowballStemmerNormalizer
+
+_WORKER = dict()
+
+
+def _initialize_worker(crawler, normalizer, positional=False, logged=False):
+    """
+    Keep the crawler and the normalizer in the worker process, so they are sent only once.
+    """
+    _WORKER['crawler'] = crawler
+    _WORKER['normalizer'] = normalizer
+    _WORKER['positional'] = positional
+    _WORKER['logged'] = logged
+
+
+def _ingest_shard(files):
+    """
+    Load, tokenize, normalize and invert a shard of files in a worker process.
+    :param files: list with the full path name of the files in the shard
+    :return: a tuple with the partial forward index, the partial inverted index, the partial
+    positional index of the shard, which is None if the positions are not indexed, and the
+    documents of the shard, which are None if they are not logged to a write-ahead log
+    """
+    crawler = _WORKER['crawler']
+    normalize = _WORKER['normalizer'].normalize
+    documents = crawler.parse(crawler.load_files(files))
+    positions = invert_positions(documents, normalize) if _WORKER['positional'] else None
+    return invert(documents, normalize) + (positions,
+                                           documents if _WORKER['logged'] else None)
+
+
+class ParallelIngestPipeline:
+    """
+    A pipeline that shards the files found by a crawler across a pool of processes. Each worker
+    produces a partial index of its shard, and the partial indexes are merged in the order of the
+    files, so the result is the same one produced by IndexEngine.add_documents.
+    """
+
+    def __init__(self, indexer, crawler=None, workers=None):
+        """
+        Creates a new instance of the ParallelIngestPipeline.
+        :param indexer: the IndexEngine that will receive the documents
+        :param crawler: a crawler that knows how to list and load files, like SimpleTxtCrawler.
+        If not provided, uses a SimpleTxtCrawler with the analyzer of the indexer, if it has one.
+        :param workers: number of worker processes. If not provided, uses the number of CPUs.
+        """
+        self.indexer = indexer
+        self.crawler = crawler
+        if not self.crawler:
+            self.crawler = SimpleTxtCrawler(getattr(indexer, 'analyzer', None))
+        self.workers = workers or os.cpu_count() or 1
+
+    def normalizer(self):
+        """
+        :return: the analyzer of the indexer, which stems the tokens like a normalizer, the
+        normalizer of the indexer, or the default normalizer if it has none
+        """
+        if getattr(self.indexer, 'analyzer', None) is not None:
+            return self.indexer.analyzer
+        if isinstance(self.indexer.normalizer, Normalizer):
+            return self.indexer.normalizer
+        return SnowballStemmerNormalizer()
+
+    def run(self, path):
+        """
+        Index all documents in the path. If the indexer has a write-ahead log, the documents are
+        logged as a single batch before being committed, as add_documents does.
+        :param path: Path from which the files should be loaded
+        """
+        files = self.crawler.files(path)
+        if not files:
+            return
+        size = -(-len(files) // self.workers)
+        shards = [files[start:start + size] for start in range(0, len(files), size)]
+        positional = getattr(self.indexer, 'positional', False)
+        wal = getattr(self.indexer, 'wal', None)
+        if len(shards) == 1:
+            _initialize_worker(self.crawler, self.normalizer(), positional, wal is not None)
+            partials = [_ingest_shard(shards[0])]
+        else:
+            with ProcessPoolExecutor(max_workers=len(shards), initializer=_initialize_worker,
+                                     initargs=(self.crawler, self.normalizer(), positional,
+                                               wal is not None)) as pool:
+                partials = list(pool.map(_ingest_shard, shards))
+        forward = dict()
+        inverted = collections.defaultdict(set)
+        positions = collections.defaultdict(dict)
+        document_entries = dict()
+        for partial_forward, partial_inverted, partial_positions, partial_documents in partials:
+            forward.update(partial_forward)
+            merge_index(inverted, partial_inverted)
+            for stem, documents in (partial_positions or dict()).items():
+                positions[stem].update(documents)
+            document_entries.update(partial_documents or dict())
+        if wal is not None and document_entries:
+            self.indexer.wal_sequence += 1
+            wal.append(self.indexer.wal_sequence, document_entries)
+        with self.indexer.dal.transaction():
+            if positional:
+                self.indexer.add_positions(positions)
+            self.indexer.add_postings(forward, inverted)
+        if wal is not None:
+            wal.truncate()
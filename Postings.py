@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+# Author: Helton Dória Costa <helton.doria@gmail.com>
+# Copyright (C) 2016-2016
+# URL: <http://github.com/heltondoria/information_retrival>
+# For license information, see LICENSE.TXT
+"""
+Module that contains compact, array backed representations of the indexes
+"""
+import bisect
+from array import array
+from collections.abc import Mapping, Sequence
+from math import log10
+
+
+class DocTable(Mapping):
+    """
+    A table that assigns dense integer ids to the documents, keeping their stable keys (the
+    uuids given by the crawlers) and their names. As a mapping, it works as a forward index,
+    binding each key to the set with the name of the document.
+    """
+
+    def __init__(self):
+        self.keys_by_id = list()
+        self.names = list()
+        self.ids = dict()
+
+    def add(self, key, name):
+        """
+        Add a document to the table, if it is not there yet.
+        :param key: the stable key of the document
+        :param name: the full path name of the document
+        :return: the id of the document
+        """
+        doc_id = self.ids.get(key)
+        if doc_id is None:
+            doc_id = len(self.keys_by_id)
+            self.ids[key] = doc_id
+            self.keys_by_id.append(key)
+            self.names.append(name)
+        return doc_id
+
+    def __getitem__(self, key):
+        return {self.names[self.ids[key]]}
+
+    def __contains__(self, key):
+        return key in self.ids
+
+    def __iter__(self):
+        return iter(self.keys_by_id)
+
+    def __len__(self):
+        return len(self.keys_by_id)
+
+    def clear(self):
+        """
+        Remove all documents from the table.
+        """
+        self.keys_by_id.clear()
+        self.names.clear()
+        self.ids.clear()
+
+
+class PostingList:
+    """
+    The postings of a term stored as columns: doc ids and term frequencies as unsigned ints and
+    normalized term frequencies and weights as float32, sorted by doc id with one entry per
+    document.
+    """
+
+    def __init__(self):
+        self.doc_ids = array('I')
+        self.tfs = array('I')
+        self.ntfs = array('f')
+        self.weights = array('f')
+        self.max_ntf = 0.0
+        self.max_weight = 0.0
+
+    def append(self, doc_id, tf, ntf, weight=0.0):
+        """
+        Append the entry of a document. Documents must be appended in the order of their ids.
+        """
+        self.doc_ids.append(doc_id)
+        self.tfs.append(tf)
+        self.ntfs.append(ntf)
+        self.weights.append(weight)
+        self.max_ntf = max(self.max_ntf, ntf)
+        self.max_weight = max(self.max_weight, weight)
+
+    def reweight(self, idf):
+        """
+        Set the weight of every entry to its TF-IDF
+        :param idf: the inverse document frequency of the term
+        """
+        self.weights = array('f', (ntf * idf for ntf in self.ntfs))
+        self.max_weight = self.max_ntf * idf
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __iter__(self):
+        return zip(self.doc_ids, self.tfs, self.ntfs, self.weights)
+
+
+class CompactIndex(Mapping):
+    """
+    An inverted index that keeps a PostingList for each term and a DocTable for the documents.
+    As a mapping, it gives the same sets of tuples (qty_in_doc, doc_key, ntf, tf-idf) held by the
+    dict based indexes, while the search engines read the columns directly.
+    """
+
+    def __init__(self, doc_table=None):
+        self.doc_table = doc_table if doc_table is not None else DocTable()
+        self.postings = dict()
+
+    @property
+    def doc_keys(self):
+        """
+        :return: a sequence that translates doc ids to document keys
+        """
+        return self.doc_table.keys_by_id
+
+    @classmethod
+    def from_index(cls, forward_index, inverted_index):
+        """
+        Build a compact index from a forward and an inverted index in the dict format.
+        :param forward_index: dict with the key of each document bound to the set with its name
+        :param inverted_index: dict with each term bound to a set of tuples (qty_in_doc,
+        doc_key, ntf) or (qty_in_doc, doc_key, ntf, tf-idf)
+        :return: a new CompactIndex
+        """
+        index = cls()
+        for key in sorted(forward_index.keys()):
+            for name in sorted(forward_index[key]):
+                index.doc_table.add(key, name)
+        index.add(inverted_index)
+        return index
+
+    def add(self, inverted):
+        """
+        Add the entries of documents already in the doc table. Entries of the same term and
+        document are joined.
+        :param inverted: dict with each term bound to a set of tuples (qty_in_doc, doc_key, ntf)
+        or (qty_in_doc, doc_key, ntf, tf-idf)
+        """
+        total = len(self.doc_table)
+        for term, entries in inverted.items():
+            docs = dict()
+            weighted = True
+            for entry in entries:
+                doc_id = self.doc_table.ids[entry[1]]
+                tf, ntf, weight = docs.get(doc_id, (0, 0.0, 0.0))
+                weighted = weighted and len(entry) > 3
+                docs[doc_id] = (tf + entry[0], ntf + entry[2],
+                                weight + (entry[3] if len(entry) > 3 else 0.0))
+            if not docs:
+                continue
+            postings = self.postings.setdefault(term, PostingList())
+            for doc_id in sorted(docs):
+                postings.append(doc_id, *docs[doc_id])
+            if not weighted:
+                postings.reweight(log10(total / len(postings)))
+
+    def columns(self, key):
+        """
+        Give direct access to the columns of the posting list of a term.
+        :param key: the term to be looked up
+        :return: a tuple with the doc ids, the normalized term frequencies, the weights, the
+        upper bound of the normalized term frequency and the upper bound of the weight of a
+        document in the posting list. If the term is not in the index, returns None.
+        """
+        postings = self.postings.get(key)
+        if postings is None:
+            return None
+        return (postings.doc_ids, postings.ntfs, postings.weights, postings.max_ntf,
+                postings.max_weight)
+
+    def __getitem__(self, key):
+        keys = self.doc_table.keys_by_id
+        return {(tf, keys[doc_id], ntf, weight)
+                for doc_id, tf, ntf, weight in self.postings[key]}
+
+    def __contains__(self, key):
+        return key in self.postings
+
+    def __iter__(self):
+        return iter(self.postings)
+
+    def __len__(self):
+        return len(self.postings)
+
+    def without(self, keys):
+        """
+        Build a copy of the index without some documents. The remaining documents get new ids.
+        :param keys: the keys of the documents to be left out
+        :return: a new CompactIndex
+        """
+        keys = set(keys)
+        forward = {key: self.doc_table[key] for key in self.doc_table if key not in keys}
+        inverted = {term: {entry for entry in self[term] if entry[1] not in keys}
+                    for term in self.postings}
+        return CompactIndex.from_index(forward, inverted)
+
+    def clear(self):
+        """
+        Remove all terms and documents from the index.
+        """
+        self.postings.clear()
+        self.doc_table.clear()
+
+
+class Bitmap:
+    """
+    A set of doc ids kept as one bit per document, like the tombstones of the deleted documents
+    of an index.
+    """
+
+    def __init__(self, size=0, doc_ids=()):
+        """
+        :param size: number of documents of the index
+        :param doc_ids: the doc ids in the set
+        """
+        self.bits = bytearray((size + 7) // 8)
+        self.count = 0
+        for doc_id in doc_ids:
+            self.add(doc_id)
+
+    def add(self, doc_id):
+        """
+        Add a doc id, which must be lower than the size of the bitmap.
+        """
+        if doc_id not in self:
+            self.bits[doc_id >> 3] |= 1 << (doc_id & 7)
+            self.count += 1
+
+    def __contains__(self, doc_id):
+        if not 0 <= doc_id < len(self.bits) << 3:
+            return False
+        return bool(self.bits[doc_id >> 3] >> (doc_id & 7) & 1)
+
+    def __iter__(self):
+        return (doc_id for doc_id in range(len(self.bits) << 3) if doc_id in self)
+
+    def __len__(self):
+        return self.count
+
+
+BLOCK_SIZE = 128
+
+
+def encode_varbyte(values, output=None):
+    """
+    Encode non negative integers with the variable-byte code: 7 bits per byte, with the high bit
+    set in every byte but the last one of each value.
+    :param values: iterable of integers to be encoded
+    :param output: bytearray where the codes are appended. If not provided, a new one is created.
+    :return: the bytearray with the codes
+    """
+    output = output if output is not None else bytearray()
+    for value in values:
+        while value >= 0x80:
+            output.append((value & 0x7f) | 0x80)
+            value >>= 7
+        output.append(value)
+    return output
+
+
+def decode_varbyte(data, count, offset=0):
+    """
+    Decode integers encoded by encode_varbyte.
+    :param data: bytes with the codes
+    :param count: number of integers to be decoded
+    :param offset: position of the first code in data
+    :return: a tuple with the list of integers and the position after the last code
+    """
+    values = []
+    value = shift = 0
+    while len(values) < count:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+    return values, offset
+
+
+def encode_blocks(doc_ids, tfs):
+    """
+    Compress a posting list sorted by doc id: the list is split in blocks of BLOCK_SIZE entries,
+    each one holding the gaps between its doc ids followed by its term frequencies, all of them
+    variable-byte encoded. The blocks are preceded by a skip table with the last doc id and the
+    size in bytes of each block, so readers can jump to the block of a doc id.
+    :param doc_ids: sorted list of doc ids
+    :param tfs: list of term frequencies
+    :return: the encoded posting list
+    """
+    blocks = list()
+    skips = list()
+    last = 0
+    for start in range(0, len(doc_ids), BLOCK_SIZE):
+        docs = doc_ids[start:start + BLOCK_SIZE]
+        block = encode_varbyte(doc - previous for doc, previous in zip(docs, [last] + docs))
+        encode_varbyte(tfs[start:start + BLOCK_SIZE], block)
+        skips.extend((docs[-1] - last, len(block)))
+        blocks.append(block)
+        last = docs[-1]
+    output = encode_varbyte([len(blocks)])
+    encode_varbyte(skips, output)
+    for block in blocks:
+        output += block
+    return bytes(output)
+
+
+class BlockPostings:
+    """
+    A reader of a posting list encoded by encode_blocks, which decodes a block only when one of
+    its entries is requested and uses the skip table to find the block of a doc id.
+    """
+
+    def __init__(self, data, count, doc_lengths):
+        """
+        :param data: buffer with the encoded posting list, i.e. a memoryview over a file mapped in
+        memory. It is read in place, without being copied.
+        :param count: number of entries in the posting list
+        :param doc_lengths: sequence with the number of tokens of each document, used to compute
+        the normalized term frequencies
+        """
+        self.data = data
+        self.count = count
+        self.doc_lengths = doc_lengths
+        (n_blocks,), offset = decode_varbyte(self.data, 1)
+        skips, offset = decode_varbyte(self.data, 2 * n_blocks, offset)
+        self.last_docs = list()
+        self.starts = list()
+        last = 0
+        for block in range(n_blocks):
+            last += skips[2 * block]
+            self.last_docs.append(last)
+            self.starts.append(offset)
+            offset += skips[2 * block + 1]
+        self.cached = (None, None)
+
+    def block(self, number):
+        """
+        Decode a block.
+        :return: a tuple with the doc ids, the normalized term frequencies and the term
+        frequencies of the entries in the block
+        """
+        if self.cached[0] == number:
+            return self.cached[1]
+        size = min(BLOCK_SIZE, self.count - number * BLOCK_SIZE)
+        values, _ = decode_varbyte(self.data, 2 * size, self.starts[number])
+        doc = self.last_docs[number - 1] if number else 0
+        docs = list()
+        for gap in values[:size]:
+            doc += gap
+            docs.append(doc)
+        tfs = values[size:]
+        ntfs = [tf / self.doc_lengths[doc] for doc, tf in zip(docs, tfs)]
+        self.cached = (number, (docs, ntfs, tfs))
+        return self.cached[1]
+
+    def bisect_left(self, target, low=0):
+        """
+        Find the position of the first entry whose doc id is equal or greater than target,
+        decoding only the block where it is.
+        """
+        number = bisect.bisect_left(self.last_docs, target, low // BLOCK_SIZE)
+        if number >= len(self.last_docs):
+            return self.count
+        docs = self.block(number)[0]
+        start = max(low - number * BLOCK_SIZE, 0)
+        return number * BLOCK_SIZE + bisect.bisect_left(docs, target, start)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        """
+        Iterate over the entries of the posting list
+        :return: Yields a tuple (doc_id, tf, ntf) for each entry
+        """
+        for number in range(len(self.last_docs)):
+            docs, ntfs, tfs = self.block(number)
+            yield from zip(docs, tfs, ntfs)
+
+    def column(self, field):
+        """
+        :param field: 0 for doc ids, 1 for normalized term frequencies and 2 for term frequencies
+        :return: a sequence over a column of the posting list
+        """
+        return BlockColumn(self, field)
+
+
+class BlockColumn(Sequence):
+    """
+    A column of a BlockPostings, decoded block by block.
+    """
+
+    def __init__(self, postings, field):
+        self.postings = postings
+        self.field = field
+
+    def __len__(self):
+        return self.postings.count
+
+    def __getitem__(self, position):
+        return self.postings.block(position // BLOCK_SIZE)[self.field][position % BLOCK_SIZE]
+
+    def bisect_left(self, target, low=0):
+        """
+        Binary search for a doc id with the help of the skip table.
+        """
+        return self.postings.bisect_left(target, low)
+
+
+def encode_positions(positions):
+    """
+    Encode the sorted positions of a term in a document as the variable-byte codes of their
+    number followed by the gaps between them.
+    :param positions: sorted list of positions
+    :return: the encoded positions
+    """
+    output = encode_varbyte([len(positions)])
+    return bytes(encode_varbyte((position - previous for position, previous
+                                 in zip(positions, [0] + positions)), output))
+
+
+def decode_positions(data):
+    """
+    Decode the positions encoded by encode_positions.
+    :param data: bytes with the encoded positions
+    :return: the sorted list of positions
+    """
+    (count,), offset = decode_varbyte(data, 1)
+    gaps, _ = decode_varbyte(data, count, offset)
+    positions = list()
+    position = 0
+    for gap in gaps:
+        position += gap
+        positions.append(position)
+    return positions
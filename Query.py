@@ -0,0 +1,509 @@
+# -*- coding: utf-8 -*-
+# Author: Helton Dória Costa <helton.doria@gmail.com>
+# Copyright (C) 2016-2016
+# URL: <http://github.com/heltondoria/information_retrival>
+# For license information, see LICENSE.TXT
+"""
+Module that contains the parser and the evaluation of structured queries, i.e. phrases,
+proximity and boolean operators, over sorted posting lists
+"""
+import bisect
+import collections
+import heapq
+import re
+
+QUERY_TOKENS = re.compile(r'"[^"]*"?|[()]|\bNEAR/\d+\b|[^\s"()]+')
+# A * or a ? inside a word, i.e. butterf* or b?tterfly; a trailing ? is taken as punctuation
+WILDCARD = re.compile(r'\w\*|\*\w|\w\?\w')
+# A word followed by ~ and, optionally, the maximum edit distance, i.e. butterfly~ or butterfly~2
+FUZZY = re.compile(r'(\w[^\s~"()]*)~(\d*)(?![^\s"()])')
+OPERATORS = re.compile(r'["()]|\bNEAR/\d+\b|\b(AND|OR|NOT)\b|' + WILDCARD.pattern + '|' +
+                       FUZZY.pattern)
+
+
+def gallop(sequence, target, low=0):
+    """
+    Find the position of the first item equal or greater than target, starting at low: the
+    search probes positions at growing distances from low and then bisects the last gap, so
+    moving a cursor a short way costs little even over long sequences. Sequences that know how to
+    bisect themselves, like the columns of compressed posting lists, do it with their skip table.
+    :param sequence: sorted sequence
+    :param target: the item to be found
+    :param low: the position where the search starts
+    :return: the position of the first item equal or greater than target, or len(sequence)
+    """
+    search = getattr(sequence, 'bisect_left', None)
+    if search:
+        return search(target, low)
+    high = len(sequence)
+    if low >= high or sequence[low] >= target:
+        return low
+    step = 1
+    while low + step < high and sequence[low + step] < target:
+        low += step
+        step *= 2
+    return bisect.bisect_left(sequence, target, low + 1, min(low + step, high))
+
+
+def intersect(sequences):
+    """
+    Intersect sorted sequences, walking the shortest one and galloping over the others.
+    :param sequences: list of sorted sequences, i.e. the documents of posting lists. Repeated
+    items are allowed.
+    :return: the sorted list of the items present in all sequences, without repetitions
+    """
+    if not sequences:
+        return []
+    sequences = sorted(sequences, key=len)
+    shortest, others = sequences[0], sequences[1:]
+    cursors = [0] * len(others)
+    result = list()
+    for position in range(len(shortest)):
+        item = shortest[position]
+        if result and result[-1] == item:
+            continue
+        for number, other in enumerate(others):
+            cursors[number] = gallop(other, item, cursors[number])
+            if cursors[number] >= len(other):
+                return result
+            if other[cursors[number]] != item:
+                break
+        else:
+            result.append(item)
+    return result
+
+
+def difference(sequence, excluded):
+    """
+    Remove from a sorted sequence the items of another one, galloping over the excluded items.
+    :param sequence: sorted sequence, repeated items are allowed
+    :param excluded: sorted sequence with the items to be removed
+    :return: the sorted list of the items of sequence not in excluded, without repetitions
+    """
+    result = list()
+    cursor = 0
+    for position in range(len(sequence)):
+        item = sequence[position]
+        if result and result[-1] == item:
+            continue
+        cursor = gallop(excluded, item, cursor)
+        if cursor >= len(excluded) or excluded[cursor] != item:
+            result.append(item)
+    return result
+
+
+def union(sequences):
+    """
+    Join sorted sequences.
+    :param sequences: list of sorted sequences, repeated items are allowed
+    :return: the sorted list of the items present in any sequence, without repetitions
+    """
+    result = list()
+    for item in heapq.merge(*sequences):
+        if not result or result[-1] != item:
+            result.append(item)
+    return result
+
+
+class Term:
+    """
+    A stem of the query.
+    """
+
+    def __init__(self, stem):
+        self.stem = stem
+
+    def stems(self):
+        """
+        :return: the list of stems that take part in the score of the documents matched
+        """
+        return [self.stem]
+
+    def matches(self, engine):
+        """
+        :param engine: the SearchEngine whose indexes are searched
+        :return: the sorted sequence of documents matched, which may repeat documents
+        """
+        return engine.posting_docs(self.stem)
+
+    def spans(self, engine, doc):
+        """
+        :return: the sorted list of tuples (first position, last position) of each occurrence in
+        the document
+        """
+        return [(position, position) for position in engine.doc_positions(self.stem, doc)]
+
+    def __repr__(self):
+        return self.stem
+
+
+class Phrase:
+    """
+    A sequence of stems that must appear next to each other and in order, i.e. "blue butterfly".
+    """
+
+    def __init__(self, stems):
+        self.terms = list(stems)
+
+    def stems(self):
+        """
+        :return: the list of stems that take part in the score of the documents matched
+        """
+        return list(self.terms)
+
+    def matches(self, engine):
+        """
+        :param engine: the SearchEngine whose indexes are searched
+        :return: the sorted list of documents that hold the phrase. The documents that hold all
+        stems are found by intersecting their posting lists and only them have their positions
+        checked.
+        """
+        if not self.terms:
+            return []
+        candidates = intersect([engine.posting_docs(stem) for stem in set(self.terms)])
+        return [doc for doc in candidates if self.spans(engine, doc)]
+
+    def spans(self, engine, doc):
+        """
+        Find the occurrences of the phrase in a document. The positions of the rarest stem drive
+        the search, and the positions the other stems should be in are galloped to.
+        :return: the sorted list of tuples (first position, last position) of each occurrence in
+        the document
+        """
+        positions = [engine.doc_positions(stem, doc) for stem in self.terms]
+        rarest = min(range(len(positions)), key=lambda offset: len(positions[offset]))
+        cursors = [0] * len(positions)
+        spans = list()
+        for position in positions[rarest]:
+            start = position - rarest
+            if start < 0:
+                continue
+            for offset, stem_positions in enumerate(positions):
+                cursors[offset] = gallop(stem_positions, start + offset, cursors[offset])
+                if cursors[offset] >= len(stem_positions):
+                    return spans
+                if stem_positions[cursors[offset]] != start + offset:
+                    break
+            else:
+                spans.append((start, start + len(positions) - 1))
+        return spans
+
+    def __repr__(self):
+        return '"{}"'.format(' '.join(self.terms))
+
+
+class Near:
+    """
+    Two operands that must appear at most distance positions apart, in any order, i.e.
+    blue NEAR/3 butterfly.
+    """
+
+    def __init__(self, left, right, distance):
+        self.left = left
+        self.right = right
+        self.distance = distance
+
+    def stems(self):
+        """
+        :return: the list of stems that take part in the score of the documents matched
+        """
+        return self.left.stems() + self.right.stems()
+
+    def matches(self, engine):
+        """
+        :param engine: the SearchEngine whose indexes are searched
+        :return: the sorted list of documents where the operands are close enough
+        """
+        candidates = intersect([self.left.matches(engine), self.right.matches(engine)])
+        return [doc for doc in candidates if self.spans(engine, doc)]
+
+    def spans(self, engine, doc):
+        """
+        :return: the sorted list of tuples (first position, last position) of each pair of
+        occurrences of the operands close enough in the document
+        """
+        left = self.left.spans(engine, doc)
+        right = self.right.spans(engine, doc)
+        if not left or not right:
+            return []
+        starts = [span[0] for span in right]
+        longest = max(last - first for first, last in right)
+        spans = set()
+        cursor = 0
+        for first, last in left:
+            cursor = gallop(starts, first - self.distance - longest, cursor)
+            for other_first, other_last in right[cursor:]:
+                if other_first > last + self.distance:
+                    break
+                if other_first > last:
+                    gap = other_first - last
+                else:
+                    gap = first - other_last
+                if gap <= self.distance:
+                    spans.add((min(first, other_first), max(last, other_last)))
+        return sorted(spans)
+
+    def __repr__(self):
+        return 'NEAR/{}({!r}, {!r})'.format(self.distance, self.left, self.right)
+
+
+class And:
+    """
+    Operands that must all be matched. Operands under a Not must not be matched.
+    """
+
+    def __init__(self, operands):
+        self.operands = list(operands)
+
+    def stems(self):
+        """
+        :return: the list of stems that take part in the score of the documents matched
+        """
+        return [stem for operand in self.operands for stem in operand.stems()]
+
+    def matches(self, engine):
+        """
+        Intersect the documents of the operands, starting by the posting lists of the terms, which
+        are cheap, so the other operands are evaluated only if the intersection is not empty yet.
+        The documents of the negated operands are removed at the end.
+        :param engine: the SearchEngine whose indexes are searched
+        :return: the sorted list of documents matched by all operands
+        """
+        positives = [operand for operand in self.operands if not isinstance(operand, Not)]
+        negatives = [operand.operand for operand in self.operands if isinstance(operand, Not)]
+        terms = [operand.matches(engine) for operand in positives if isinstance(operand, Term)]
+        result = intersect(terms) if terms else None
+        for operand in positives:
+            if result is not None and not result:
+                return []
+            if not isinstance(operand, Term):
+                docs = operand.matches(engine)
+                result = intersect([result, docs]) if result is not None else docs
+        if result is None:
+            result = engine.all_docs()
+        for operand in negatives:
+            if not result:
+                break
+            result = difference(result, operand.matches(engine))
+        return list(result)
+
+    def spans(self, engine, doc):
+        """
+        :return: the sorted list of tuples (first position, last position) of the occurrences of
+        every operand not negated in the document
+        """
+        return sorted(set().union(*(operand.spans(engine, doc) for operand in self.operands)))
+
+    def __repr__(self):
+        return 'AND({})'.format(', '.join(repr(operand) for operand in self.operands))
+
+
+class Not:
+    """
+    An operand that must not be matched. Alone, it matches every document without the operand.
+    """
+
+    def __init__(self, operand):
+        self.operand = operand
+
+    def stems(self):
+        """
+        :return: an empty list, since the stems of negated operands don't take part in the score
+        """
+        return []
+
+    def matches(self, engine):
+        """
+        :param engine: the SearchEngine whose indexes are searched
+        :return: the sorted list of the documents of the index not matched by the operand
+        """
+        return difference(engine.all_docs(), self.operand.matches(engine))
+
+    def spans(self, engine, doc):
+        """
+        :return: an empty list, since negated operands have no occurrences to be close to
+        """
+        return []
+
+    def __repr__(self):
+        return 'NOT({!r})'.format(self.operand)
+
+
+class Or:
+    """
+    Operands of which at least one must be matched, like the words of a plain search.
+    """
+
+    def __init__(self, operands):
+        self.operands = list(operands)
+
+    def stems(self):
+        """
+        :return: the list of stems that take part in the score of the documents matched
+        """
+        return [stem for operand in self.operands for stem in operand.stems()]
+
+    def matches(self, engine):
+        """
+        :param engine: the SearchEngine whose indexes are searched
+        :return: the sorted list of documents matched by any operand
+        """
+        return union([operand.matches(engine) for operand in self.operands])
+
+    def spans(self, engine, doc):
+        """
+        :return: the sorted list of tuples (first position, last position) of the occurrences of
+        every operand in the document
+        """
+        return sorted(set().union(*(operand.spans(engine, doc) for operand in self.operands)))
+
+    def __repr__(self):
+        return 'OR({})'.format(', '.join(repr(operand) for operand in self.operands))
+
+
+def combine(operator, operands):
+    """
+    Join the operands of an operator, dropping the ones without stems.
+    :param operator: And or Or
+    :param operands: list of operands, in which None stands for an operand without stems
+    :return: the node of the operator, the only operand or None, if no operand has stems
+    """
+    operands = [operand for operand in operands if operand is not None]
+    if len(operands) > 1:
+        return operator(operands)
+    return operands[0] if operands else None
+
+
+def disjoin(operands):
+    """
+    Join the operands of a disjunction. Negated operands exclude documents, like the -word of
+    other search engines, so they are joined by And to the disjunction of the other operands
+    instead of matching every document without them.
+    :param operands: list of operands, in which None stands for an operand without stems
+    :return: the node of the disjunction, the only operand or None, if no operand has stems
+    :raise ValueError: if every operand of the disjunction is negated
+    """
+    operands = [operand for operand in operands if operand is not None]
+    negatives = [operand for operand in operands if isinstance(operand, Not)]
+    if not negatives or len(operands) == 1:
+        return combine(Or, operands)
+    positives = [operand for operand in operands if not isinstance(operand, Not)]
+    if not positives:
+        raise ValueError("NOT needs an operand that is not negated to exclude documents from: "
+                         "{}".format(' '.join(repr(operand) for operand in negatives)))
+    return combine(And, [combine(Or, positives)] + negatives)
+
+
+def is_query(sentence):
+    """
+    :param sentence: string to be searched for
+    :return: True if the sentence uses any query operator, so it must be parsed by a QueryParser
+    instead of being searched as a bag of words
+    """
+    return bool(OPERATORS.search(sentence))
+
+
+class QueryParser:
+    """
+    A parser of queries made of words, "quoted phrases", the proximity operator NEAR/k and the
+    boolean operators AND, OR and NOT, grouped by parentheses. NOT binds tighter than NEAR/k,
+    which binds tighter than AND, which binds tighter than OR. Operands next to each other without
+    an operator are joined by OR, as in a plain search. Negated operands of a disjunction exclude
+    documents from the other operands, so blue NOT butterfly is blue AND NOT butterfly, and a
+    disjunction of negated operands only is rejected. Words with the wildcards * and ?, i.e.
+    butterf*, and words followed by ~ and an optional edit distance, i.e. butterfly~1, are
+    expanded to the stems of the index they match, joined by OR.
+    """
+
+    def __init__(self, analyze, expand=None):
+        """
+        :param analyze: function that turns a text into the list of its stems, dropping stopwords,
+        the same way the documents were indexed
+        :param expand: function that turns a wildcard pattern, i.e. butterf*, or a fuzzy word,
+        i.e. butterfly~2, into the list of the stems of the index it matches. If not provided,
+        these tokens are analyzed as plain words.
+        """
+        self.analyze = analyze
+        self.expand = expand
+
+    def parse(self, sentence):
+        """
+        :param sentence: the query
+        :return: the root of the tree of the query, or None if it has no stems
+        :raise ValueError: if the query is a disjunction of negated operands only
+        """
+        tokens = collections.deque(QUERY_TOKENS.findall(sentence))
+        operands = list()
+        while tokens:
+            operands.append(self.__or(tokens))
+            if tokens:
+                tokens.popleft()
+        return disjoin(operands)
+
+    def __or(self, tokens):
+        """
+        Parse operands joined by OR, explicitly or not, up to the end of the group.
+        """
+        operands = [self.__and(tokens)]
+        while tokens and tokens[0] != ')':
+            if tokens[0] == 'OR':
+                tokens.popleft()
+            operands.append(self.__and(tokens))
+        return disjoin(operands)
+
+    def __and(self, tokens):
+        """
+        Parse operands joined by AND.
+        """
+        operands = [self.__not(tokens)]
+        while tokens and tokens[0] == 'AND':
+            tokens.popleft()
+            operands.append(self.__not(tokens))
+        return combine(And, operands)
+
+    def __not(self, tokens):
+        """
+        Parse an operand, negated or not.
+        """
+        if tokens and tokens[0] == 'NOT':
+            tokens.popleft()
+            operand = self.__not(tokens)
+            return Not(operand) if operand is not None else None
+        return self.__near(tokens)
+
+    def __near(self, tokens):
+        """
+        Parse operands joined by NEAR/k.
+        """
+        operand = self.__operand(tokens)
+        while tokens and tokens[0].startswith('NEAR/'):
+            distance = int(tokens.popleft()[5:])
+            right = self.__operand(tokens)
+            if operand is not None and right is not None:
+                operand = Near(operand, right, distance)
+            else:
+                operand = operand if operand is not None else right
+        return operand
+
+    def __operand(self, tokens):
+        """
+        Parse a group, a phrase or a word. A word may be split in several stems by the analyzer,
+        which are joined by OR, as are the stems a wildcard pattern or a fuzzy word expands to.
+        """
+        if not tokens or tokens[0] == ')':
+            return None
+        token = tokens.popleft()
+        if token == '(':
+            operand = self.__or(tokens)
+            if tokens:
+                tokens.popleft()
+            return operand
+        if token in ('AND', 'OR') or token.startswith('NEAR/'):
+            return None
+        if self.expand is not None and not token.startswith('"') and \
+                (WILDCARD.search(token) or FUZZY.fullmatch(token)):
+            return combine(Or, [Term(stem) for stem in self.expand(token)])
+        stems = self.analyze(token.strip('"'))
+        if token.startswith('"') and len(stems) > 1:
+            return Phrase(stems)
+        return combine(Or, [Term(stem) for stem in stems])
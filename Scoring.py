@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Author: Helton Dória Costa <helton.doria@gmail.com>
+# Copyright (C) 2016-2016
+# URL: <http://github.com/heltondoria/information_retrival>
+# For license information, see LICENSE.TXT
+"""
+Module that contains the scoring models used by the search engines to weight the postings at
+query time
+"""
+from abc import ABCMeta, abstractmethod
+from math import log, log10
+
+
+class ScoringModel(metaclass=ABCMeta):
+    """
+    Abstract class to define a interface for scoring models. The weight of a posting is the idf
+    of its term times the weight of its normalized term frequency, which may depend on a norm
+    computed once per document from its length. The weight must grow with the normalized term
+    frequency and shrink as the norm grows, so the search engines can bound it.
+    """
+
+    def norm(self, length, average_length):
+        """
+        Compute the norm of a document. Models that don't normalize by the length return 0.
+        :param length: number of tokens of the document
+        :param average_length: average number of tokens of the documents of the index
+        :return: the norm of the document
+        """
+        return 0.0
+
+    @abstractmethod
+    def idf(self, doc_count, doc_frequency):
+        """
+        :param doc_count: number of documents in the index
+        :param doc_frequency: number of documents that hold the term
+        :return: the inverse document frequency of the term
+        """
+        pass
+
+    @abstractmethod
+    def term_weight(self, ntf, norm):
+        """
+        Weight a normalized term frequency. It must use only arithmetic operators, so it can be
+        applied to NumPy arrays as well as to floats.
+        :param ntf: the normalized term frequency of the term in the document
+        :param norm: the norm of the document
+        :return: the weight of the posting, before being multiplied by the idf
+        """
+        pass
+
+
+class TfIdfModel(ScoringModel):
+    """
+    The TF-IDF computed by the index engines, i.e. ntf * log10(N/df), evaluated at query time.
+    """
+
+    def idf(self, doc_count, doc_frequency):
+        return log10(doc_count / doc_frequency)
+
+    def term_weight(self, ntf, norm):
+        return ntf
+
+
+class BM25Model(ScoringModel):
+    """
+    The Okapi BM25 model. The term frequency is recovered from the normalized term frequency and
+    the length of the document, so the weight of the term frequency becomes
+    ntf * (k1 + 1) / (ntf + k1 * (1 - b) / length + k1 * b / average_length), whose denominator
+    holds the norm of the document.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        """
+        :param k1: saturation of the term frequency
+        :param b: strength of the normalization by the length of the document, from 0 to 1
+        """
+        self.k1 = k1
+        self.b = b
+
+    def norm(self, length, average_length):
+        return self.k1 * (1 - self.b) / max(length, 1) + self.k1 * self.b / average_length
+
+    def idf(self, doc_count, doc_frequency):
+        return log(1 + (doc_count - doc_frequency + 0.5) / (doc_frequency + 0.5))
+
+    def term_weight(self, ntf, norm):
+        return ntf * (self.k1 + 1) / (ntf + norm)
@@ -6,14 +6,35 @@
 """
 Module that contains search engines that will look for information held by the index
 """
+import bisect
 import collections
+import heapq
+import itertools
 import operator
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from math import log10
 
 from Dal import CSVFileDal
-from IndexEngine import IndexEngine
+from IndexEngine import STEMS, document_lengths, load_index, load_lengths, load_manifest, \
+    load_positions, load_terms, load_tombstones
+from Metrics import METRICS
 from Normalizer import SnowballStemmerNormalizer
+from Postings import Bitmap, CompactIndex, decode_positions
+from Query import FUZZY, QueryParser, is_query
+from Terms import TermDictionary
 from Tokenizer import EnglishRegexpTokenizer
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MISSING = object()
+# Highest edit distance of a fuzzy word, which bounds the cost of its expansion
+MAX_EDIT_DISTANCE = 2
+
 
 def ranking(query_result):
     """
@@ -24,55 +45,901 @@ def ranking(query_result):
     return sorted(query_result.items(), key=operator.itemgetter(1), reverse=True)
 
 
+class PostingCursor:
+    """
+    A cursor over a posting list sorted by document, used by the dynamic pruning of top-k
+    searches. Entries of the same document are adjacent and their weights are summed.
+    """
+
+    def __init__(self, docs, weights, upper_bound, scale=1.0):
+        """
+        :param docs: sorted sequence with the document of each entry of the posting list
+        :param weights: sequence with the weight of each entry of the posting list
+        :param upper_bound: the highest score a single document can get from this posting list
+        :param scale: factor applied to every weight, i.e. the idf of the term or the number of
+        times the term appears in the query
+        """
+        self.docs = docs
+        self.weights = weights
+        self.scale = scale
+        # The idf of a stem with more entries than documents is negative, so its weights are never
+        # above 0 and MaxScore needs non-negative bounds
+        self.upper_bound = max(upper_bound * scale, 0.0)
+        self.position = 0
+
+    def doc(self):
+        """
+        :return: the document under the cursor or None, if the cursor is exhausted
+        """
+        if self.position < len(self.docs):
+            return self.docs[self.position]
+        return None
+
+    def advance(self, target):
+        """
+        Move the cursor to the first document equal or greater than target, skipping the entries
+        in between by binary search, or by the skip pointers of compressed posting lists.
+        """
+        search = getattr(self.docs, 'bisect_left', None)
+        if search:
+            self.position = search(target, self.position)
+        else:
+            self.position = bisect.bisect_left(self.docs, target, self.position)
+
+    def take(self):
+        """
+        Sum the weights of the document under the cursor and move the cursor to the next one.
+        :return: the score of the document for this posting list
+        """
+        doc = self.docs[self.position]
+        score = 0.0
+        while self.position < len(self.docs) and self.docs[self.position] == doc:
+            score += self.weights[self.position]
+            self.position += 1
+        return score * self.scale
+
+
+class ModelCursor(PostingCursor):
+    """
+    A cursor over a posting list weighted at query time by a scoring model (see
+    Scoring.ScoringModel). Entries of the same document are adjacent and their normalized term
+    frequencies are summed before being weighted.
+    """
+
+    def __init__(self, docs, ntfs, max_ntf, model, norms, min_norm, scale=1.0):
+        """
+        :param docs: sorted sequence with the document of each entry of the posting list
+        :param ntfs: sequence with the normalized term frequency of each entry of the posting list
+        :param max_ntf: the highest normalized term frequency of a document in the posting list
+        :param model: the ScoringModel
+        :param norms: the norm of each document, indexed by the documents in docs
+        :param min_norm: the lowest norm of a document of the index
+        :param scale: factor applied to every weight, i.e. the idf of the term times the number of
+        times the term appears in the query
+        """
+        super().__init__(docs, ntfs, model.term_weight(max_ntf, min_norm), scale)
+        self.model = model
+        self.norms = norms
+
+    def take(self):
+        doc = self.docs[self.position]
+        ntf = 0.0
+        while self.position < len(self.docs) and self.docs[self.position] == doc:
+            ntf += self.weights[self.position]
+            self.position += 1
+        return self.model.term_weight(ntf, self.norms[doc]) * self.scale
+
+
+def max_score(cursors, k, deleted=None):
+    """
+    Select the k best documents with the MaxScore dynamic pruning: posting lists are sorted by
+    their upper bounds and, once the heap is full, the lists whose summed upper bounds can't beat
+    the k-th score stop driving the candidates and are only probed for documents that can still
+    enter the heap.
+    :param cursors: a list of PostingCursor, one for each term of the query
+    :param k: the number of documents to be returned, at least 1
+    :param deleted: if given, the documents in it are skipped without being scored
+    :return: a list of tuples (score, doc) with the k best documents, ordered by relevance
+    """
+    if k < 1:
+        raise ValueError("k must be positive, got {}".format(k))
+    cursors = sorted(cursors, key=lambda cursor: cursor.upper_bound)
+    bounds = list()
+    for cursor in cursors:
+        bounds.append(cursor.upper_bound + (bounds[-1] if bounds else 0.0))
+    heap = list()
+    threshold = 0.0
+    essential = 0
+    while essential < len(cursors):
+        docs = [cursor.doc() for cursor in cursors[essential:]]
+        docs = [doc for doc in docs if doc is not None]
+        if not docs:
+            break
+        current = min(docs)
+        if deleted is not None and current in deleted:
+            for cursor in cursors[essential:]:
+                if cursor.doc() == current:
+                    cursor.take()
+            continue
+        score = 0.0
+        for cursor in cursors[essential:]:
+            if cursor.doc() == current:
+                score += cursor.take()
+        for position in range(essential - 1, -1, -1):
+            if score + bounds[position] <= threshold:
+                break
+            cursor = cursors[position]
+            cursor.advance(current)
+            if cursor.doc() == current:
+                score += cursor.take()
+        if len(heap) < k:
+            heapq.heappush(heap, (score, current))
+        elif score > heap[0][0]:
+            heapq.heapreplace(heap, (score, current))
+        if len(heap) == k:
+            threshold = heap[0][0]
+            while essential < len(cursors) and bounds[essential] <= threshold:
+                essential += 1
+    return sorted(heap, key=lambda entry: (-entry[0], entry[1]))
+
+
 class SearchEngine:
     """
     An search engine that search for words in a set of documents based on a given index.
     """
 
-    def __init__(self, stemmer=None, language='english'):
+    def __init__(self, stemmer=None, language='english', dal=None, resident=False,
+                 compact=False, cache=None, scoring=None, max_expansions=50, analyzer=None):
         """
         Creates a new instance of the SearchEngine.
         :param stemmer: A stemmer to be used to normalize the searched terms. If either a stemmer is
         not provided, uses NLTK SnowballStemmer as default.
         :param language: Language to use during normalization fase
+        :param dal: an object from a class that inherits from Dal, from which the indexes will be
+        loaded. If not provided, uses a CSVFileDal over './index/'.
+        :param resident: if True, the indexes are kept in memory across searches and reloaded only
+        when the generation of the index persisted by the IndexEngine changes.
+        :param compact: if True, indexes loaded as dicts are converted to a CompactIndex, with
+        integer doc ids and array backed posting lists. Best used with resident.
+        :param cache: a Cache.LRUCache to hold the results of the searches, keyed by the stems of
+        the sentence. It is cleared whenever the generation of the index changes.
+        :param scoring: a Scoring.ScoringModel that weights the postings at query time, i.e.
+        Scoring.BM25Model. If None, the TF-IDF weights stored in the index are used. The model can
+        be replaced at any time; the norms of the documents are computed again from the lengths
+        persisted by the IndexEngine.
+        :param max_expansions: maximum number of stems a wildcard pattern or a fuzzy word of a
+        query is expanded to
+        :param analyzer: a Tokenizer.SinglePassAnalyzer that tokenizes, folds the case, drops the
+        stopwords and stems the queries in a single pass. It must be the analyzer the index was
+        built with. Its normalizer is used if stemmer is not provided.
         """
         self.language = language
+        self.analyzer = analyzer
         self.normalizer = stemmer
-        self.tokenizer = EnglishRegexpTokenizer()
-        self.dal = CSVFileDal('./index/')
+        if not self.normalizer and analyzer is not None:
+            self.normalizer = analyzer.normalizer
+        self.tokenizer = EnglishRegexpTokenizer() if analyzer is None else analyzer
+        self.dal = dal
+        if not self.dal:
+            self.dal = CSVFileDal('./index/')
         self.inverted_index = collections.defaultdict(set)
         self.forward_index = collections.defaultdict(set)
+        self.resident = resident
+        self.compact = compact
+        self.generation = None
+        self.manifest = None
+        self.sorted_postings = dict()
+        self.stems_loaded = False
+        self.cache = cache
+        self.memo = None
+        self.positions = None
+        self.scoring = scoring
+        self.norms = None
+        self.min_norm = 0.0
+        self.norms_model = None
+        self.cache_model = scoring
+        self.deleted = None
+        self.deleted_keys = frozenset()
+        self.terms = None
+        self.max_expansions = max_expansions
         if not self.normalizer:
             self.normalizer = SnowballStemmerNormalizer()
+        self.parser = QueryParser(self.analyze, self.expand)
 
-    def search(self, sentence=None):
+    def search(self, sentence=None, k=None):
 
         """
         Search by the words in the sentence and bring a result ordered by relevance
-        :param sentence: string of words to be searched for
+        :param sentence: string of words to be searched for. It may hold the boolean operators
+        AND, OR and NOT grouped by parentheses, "quoted phrases", the proximity operator NEAR/k,
+        wildcard patterns like butterf* and fuzzy words like butterfly~1 (see Query.QueryParser).
+        Phrases and proximity need a positional index.
+        :param k: if given, only the k most relevant documents are returned and documents that
+        can't reach them are pruned without being fully scored. It must be at least 1, or a
+        ValueError is raised.
         :return: A list of references ordered by relevance
         """
-        self.load_index()
-        if sentence:
+        with self.dal.snapshot():
+            if self.resident:
+                self.refresh()
+            else:
+                self.load_index()
+            if sentence:
+                return self.__search(sentence, k)
+            else:
+                print("Nothing to do")
+
+    def complete(self, prefix, k=10):
+        """
+        Suggest the stems of the index that start with a prefix, i.e. to autocomplete a query.
+        :param prefix: the beginning of a word, matched against the stems as it is, lower cased
+        :param k: maximum number of stems returned
+        :return: A list with the stems, the ones held by most documents first
+        """
+        with self.dal.snapshot():
+            if self.resident:
+                self.refresh()
+            else:
+                self.load_index()
+            stems = self.term_dictionary().prefix(prefix.lower())
+            return heapq.nlargest(k, stems, key=self.document_frequency)
+
+    def search_batch(self, queries):
+        """
+        Search a batch of sentences over the same load of the indexes. The postings of the stems
+        shared by the sentences are looked up and decoded only once for the whole batch.
+        :param queries: list of tuples (sentence, k), as the arguments of search
+        :return: a list with the result of each query, as returned by search
+        """
+        with self.dal.snapshot():
+            if self.resident:
+                self.refresh()
+            else:
+                self.load_index()
+            self.memo = dict()
+            try:
+                return [self.__search(sentence, k) if sentence else None
+                        for sentence, k in queries]
+            finally:
+                self.memo = None
+
+    def __search(self, sentence, k):
+        """
+        Normalize the sentence and rank the documents, going through the cache if there is one.
+        """
+        if k is not None and k < 1:
+            raise ValueError("k must be positive, got {}".format(k))
+        METRICS.count('search.queries')
+        with METRICS.timer('search.query'):
+            return self.__lookup(sentence, k)
+
+    def __lookup(self, sentence, k):
+        """
+        Parse or analyze the sentence and look its ranking up in the cache before computing it.
+        """
+        if self.cache is not None and self.cache_model is not self.scoring:
+            self.cache.clear()
+            self.cache_model = self.scoring
+        structured = is_query(sentence)
+        if structured:
+            query = self.parser.parse(sentence)
+            key = (repr(query), k)
+        else:
+            query = self.analyze(sentence)
+            key = (tuple(sorted(query)), k)
+        if self.cache is None:
+            return self.rank_query(query, k) if structured else self.rank(query, k)
+        result = self.cache.get(key, MISSING)
+        if result is MISSING:
+            METRICS.count('search.cache_misses')
+            result = self.rank_query(query, k) if structured else self.rank(query, k)
+            self.cache.put(key, result)
+        else:
+            METRICS.count('search.cache_hits')
+        return list(result) if result else result
+
+    def analyze(self, sentence):
+        """
+        :param sentence: string of words
+        :return: the list of the stems of the words, without stopwords
+        """
+        if self.analyzer is not None:
+            return list(self.analyzer.analyze(sentence))
+        return list(self.normalizer.normalize_list(self.tokenizer.tokenize(sentence)))
+
+    def expand(self, token):
+        """
+        Expand a wildcard pattern or a fuzzy word of a query to the stems of the index it matches,
+        looked up in the term dictionary. Patterns are matched against the stems as they are,
+        lower cased, while fuzzy words are stemmed first.
+        :param token: a pattern in which * stands for any sequence of characters and ? for a single
+        one, i.e. butterf*, or a word followed by ~ and, optionally, the maximum edit distance,
+        i.e. butterfly~1. The distance defaults to and is capped by MAX_EDIT_DISTANCE.
+        :return: a list with at most max_expansions stems
+        """
+        terms = self.term_dictionary()
+        fuzzy = FUZZY.fullmatch(token)
+        if fuzzy is None:
+            return terms.wildcard(token.lower(), self.max_expansions)
+        distance = min(int(fuzzy.group(2) or MAX_EDIT_DISTANCE), MAX_EDIT_DISTANCE)
+        stems = list()
+        for stem in self.analyze(fuzzy.group(1)):
+            for match in terms.fuzzy(stem, distance, self.max_expansions):
+                if match not in stems:
+                    stems.append(match)
+        return stems[:self.max_expansions]
+
+    def term_dictionary(self):
+        """
+        :return: the Terms.TermDictionary of the loaded index, loaded once per generation. It is
+        built from the inverted index if the IndexEngine did not persist it.
+        """
+        if self.terms is None:
+            self.terms = load_terms(self.dal, self.manifest)
+            if self.terms is None:
+                self.terms = TermDictionary.from_terms(self.inverted_index.keys())
+        return self.terms
+
+    def rank_query(self, query, k=None):
+        """
+        Rank the documents matched by a structured query, scoring them by the sum of the weights of
+        the stems of the query, as rank does.
+        :param query: the root of a query parsed by a Query.QueryParser, or None
+        :param k: if given, only the k most relevant documents are returned
+        :return: A list of references ordered by relevance, or None if no document was found
+        """
+        if query is None:
+            return None
+        docs = query.matches(self)
+        if docs and self.deleted is not None:
+            docs = [doc for doc in docs if doc not in self.deleted]
+        if not docs:
+            return None
+        scores = [0.0] * len(docs)
+        for stem, count in collections.Counter(query.stems()).items():
+            if stem not in self.inverted_index.keys():
+                continue
+            cursor = self.cursor(stem, count)
+            for position, doc in enumerate(docs):
+                cursor.advance(doc)
+                if cursor.doc() == doc:
+                    scores[position] += cursor.take()
+            METRICS.count('search.postings_scanned', cursor.position)
+        result = dict()
+        for doc, score in zip(docs, scores):
+            for doc_name in self.forward_index[self.doc_key(doc)]:
+                result[doc_name] = score
+        result = ranking(result)
+        return result[:k] if k is not None else result
+
+    def rank(self, stems, k=None):
+        """
+        Score the documents that hold the stems and rank them by relevance
+        :param stems: list with the normalized terms of the query
+        :param k: if given, only the k most relevant documents are returned and documents that
+        can't reach them are pruned without being fully scored
+        :return: A list of references ordered by relevance, or None if no document was found
+        """
+        if self.scoring is not None and k is None:
+            k = max(len(self.forward_index), 1)
+        if k is not None:
+            cursors = [self.cursor(stem, count) for stem, count in collections.Counter(stems)
+                       .items() if stem in self.inverted_index.keys()]
+            result = [(doc_name, score) for score, doc in max_score(cursors, k, self.deleted)
+                      for doc_name in self.forward_index[self.doc_key(doc)]]
+            METRICS.count('search.postings_scanned', sum(cursor.position for cursor in cursors))
+            if len(result) > 0:
+                return result
+        else:
             result = dict()
-            tokens = self.tokenizer.tokenize(sentence)
-            for stem in self.normalizer.normalize_list(tokens):
+            for stem in stems:
                 if stem in self.inverted_index.keys():
-                    for doc in self.inverted_index[stem]:
+                    idf = self.idf(stem)
+                    METRICS.count('search.postings_scanned', len(self.entries(stem)))
+                    for doc in self.entries(stem):
+                        if doc[1] in self.deleted_keys:
+                            continue
+                        weight = doc[3] if len(doc) > 3 else doc[2] * idf
                         doc_set = self.forward_index[doc[1]]
                         for doc_name in doc_set:
                             if doc_name in result.keys():
-                                result[doc_name] = result[doc_name] + doc[3]
+                                result[doc_name] = result[doc_name] + weight
                             else:
-                                result[doc_name] = doc[3]
+                                result[doc_name] = weight
             if len(result) > 0:
                 return ranking(result)
+        return None
+
+    def cursor(self, stem, count=1, idf=None):
+        """
+        Create a cursor over the posting list of a stem. Mapped indexes are walked directly over
+        their arrays, while the posting sets of indexes held in dicts are sorted once per load.
+        :param stem: a stem present in the inverted index
+        :param count: number of times the stem appears in the query
+        :param idf: if given, the postings are weighted by their normalized term frequency times
+        this idf instead of by the weights in the index, i.e. with the statistics of all shards
+        :return: a PostingCursor over the posting list
+        """
+        columns = self.posting_columns(stem)
+        if columns and self.scoring is not None:
+            return self.model_cursor(stem, columns[0], columns[1], columns[3], count, idf)
+        if columns:
+            docs, ntfs, weights, max_ntf, max_weight = columns
+            if weights is None or idf is not None:
+                if idf is None:
+                    idf = log10(len(self.forward_index) / len(docs))
+                return PostingCursor(docs, ntfs, max_ntf, count * idf)
+            return PostingCursor(docs, weights, max_weight, count)
+        if stem not in self.sorted_postings:
+            local_idf = self.idf(stem)
+            weights = collections.Counter()
+            ntfs = collections.Counter()
+            for doc in self.entries(stem):
+                weights[doc[1]] += doc[3] if len(doc) > 3 else doc[2] * local_idf
+                ntfs[doc[1]] += doc[2]
+            docs = sorted(weights)
+            self.sorted_postings[stem] = (docs, [weights[doc] for doc in docs],
+                                          max(weights.values()), [ntfs[doc] for doc in docs],
+                                          max(ntfs.values()))
+        docs, weights, max_weight, ntfs, max_ntf = self.sorted_postings[stem]
+        if self.scoring is not None:
+            return self.model_cursor(stem, docs, ntfs, max_ntf, count, idf)
+        if idf is not None:
+            return PostingCursor(docs, ntfs, max_ntf, count * idf)
+        return PostingCursor(docs, weights, max_weight, count)
+
+    def model_cursor(self, stem, docs, ntfs, max_ntf, count=1, idf=None):
+        """
+        Create a cursor that weights a posting list with the scoring model.
+        :param stem: a stem present in the inverted index
+        :param docs: sorted sequence with the documents of the posting list
+        :param ntfs: sequence with the normalized term frequencies of the posting list
+        :param max_ntf: the highest normalized term frequency of a document in the posting list
+        :param count: number of times the stem appears in the query
+        :param idf: if given, used instead of the idf given by the model
+        :return: a ModelCursor over the posting list
+        """
+        if self.norms_model is not self.scoring:
+            self.prepare_scoring()
+        if idf is None:
+            idf = self.scoring.idf(len(self.forward_index), self.document_frequency(stem))
+        return ModelCursor(docs, ntfs, max_ntf, self.scoring, self.norms, self.min_norm,
+                           count * idf)
+
+    def prepare_scoring(self):
+        """
+        Compute the norm of every document for the scoring model from the lengths persisted with
+        the index, once per load of the indexes or replacement of the model. The norms of indexes
+        with integer doc ids are kept in an array indexed by them.
+        """
+        self.norms_model = self.scoring
+        self.norms = None
+        self.min_norm = 0.0
+        if self.scoring is None:
+            return
+        lengths = load_lengths(self.dal, self.manifest) or document_lengths(self.inverted_index)
+        average = sum(lengths.values()) / len(lengths) if lengths else 1.0
+        doc_keys = getattr(self.inverted_index, 'doc_keys', None)
+        if doc_keys is not None:
+            self.norms = array('d', (self.scoring.norm(lengths.get(doc_keys[doc], 0), average)
+                                     for doc in range(len(doc_keys))))
+            self.min_norm = min(self.norms, default=0.0)
         else:
-            print("Nothing to do")
+            self.norms = {key: self.scoring.norm(length, average)
+                          for key, length in lengths.items()}
+            self.min_norm = min(self.norms.values(), default=0.0)
+
+    def document_frequency(self, stem):
+        """
+        :param stem: a stem present in the inverted index
+        :return: the number of entries in the posting list of the stem
+        """
+        columns = self.posting_columns(stem)
+        if columns:
+            return len(columns[0])
+        return len(self.entries(stem))
+
+    def posting_docs(self, stem):
+        """
+        :param stem: a stem of the query
+        :return: the sorted sequence with the documents of the posting list of the stem, in which
+        a document may be repeated, or an empty list if the stem is not in the index
+        """
+        if stem not in self.inverted_index.keys():
+            return []
+        return self.cursor(stem).docs
+
+    def all_docs(self):
+        """
+        :return: the sorted sequence with every document of the index, in the same form as the
+        documents given by posting_docs
+        """
+        doc_keys = getattr(self.inverted_index, 'doc_keys', None)
+        if doc_keys is not None:
+            return range(len(doc_keys))
+        return sorted(self.forward_index.keys())
+
+    def doc_positions(self, stem, doc):
+        """
+        :param stem: a stem of the query
+        :param doc: a document, as given by posting_docs
+        :return: the sorted list of the positions of the stem in the document. The positional
+        index is loaded only when the first structured query is searched.
+        """
+        if self.positions is None:
+            self.positions = load_positions(self.dal, self.manifest)
+        data = self.positions.get(stem, dict()).get(self.doc_key(doc))
+        return decode_positions(data) if data else []
+
+    def entries(self, stem):
+        """
+        :param stem: a stem present in the inverted index
+        :return: the set of tuples (qty_in_doc, doc_key, ntf[, tf-idf]) of the stem. While a batch
+        is searched, the set is built only once.
+        """
+        if self.memo is None:
+            return self.inverted_index[stem]
+        if ('entries', stem) not in self.memo:
+            self.memo[('entries', stem)] = self.inverted_index[stem]
+        return self.memo[('entries', stem)]
+
+    def posting_columns(self, stem):
+        """
+        :param stem: a stem present in the inverted index
+        :return: the columns of the posting list of the stem, as given by the columns method of
+        mapped and compact indexes, or None if the index has no columns. While a batch is
+        searched, the columns are looked up only once.
+        """
+        columns = getattr(self.inverted_index, 'columns', None)
+        if not columns:
+            return None
+        if self.memo is None:
+            return columns(stem)
+        if ('columns', stem) not in self.memo:
+            self.memo[('columns', stem)] = columns(stem)
+        return self.memo[('columns', stem)]
+
+    def statistics(self, stems):
+        """
+        Give the statistics of the index needed to compute the idf of the stems over a collection
+        of indexes, like the shards of a ShardedIndexEngine.
+        :param stems: list with the normalized terms of the query
+        :return: a tuple with the number of documents in the index and a dict with the document
+        frequency of each stem found in the index
+        """
+        with self.dal.snapshot():
+            if self.resident:
+                self.refresh()
+            else:
+                self.load_index()
+            return len(self.forward_index), {stem: self.document_frequency(stem) for stem in
+                                             set(stems) if stem in self.inverted_index.keys()}
+
+    def rank_with_idf(self, stems, idfs, k=None):
+        """
+        Score the documents that hold the stems with idfs computed elsewhere, i.e. by a
+        ShardedSearchEngine, using the indexes loaded by the last call to statistics.
+        :param stems: list with the normalized terms of the query
+        :param idfs: dict with the idf of each stem
+        :param k: if given, only the k most relevant documents are returned
+        :return: A list of tuples (score, doc_name) ordered by relevance
+        """
+        with self.dal.snapshot():
+            cursors = [self.cursor(stem, count, idfs[stem]) for stem, count
+                       in collections.Counter(stems).items()
+                       if stem in idfs and stem in self.inverted_index.keys()]
+            if not cursors:
+                return []
+            return [(score, doc_name) for score, doc
+                    in max_score(cursors, k if k is not None else max(len(self.forward_index), 1),
+                                 self.deleted)
+                    for doc_name in self.forward_index[self.doc_key(doc)]]
+
+    def doc_key(self, doc):
+        """
+        Translate the document returned by a PostingCursor to its key in the forward index.
+        """
+        doc_keys = getattr(self.inverted_index, 'doc_keys', None)
+        return doc_keys[doc] if doc_keys is not None else doc
+
+    def idf(self, stem):
+        """
+        Calc the inverse document frequency of a stem, used to weight the entries of indexes that
+        hold only raw term frequencies (see IncrementalIndexEngine).
+        :param stem: a stem present in the inverted index
+        :return: the inverse document frequency of the stem
+        """
+        return log10(len(self.forward_index) / len(self.entries(stem)))
 
     def load_index(self):
         """
-        Load index from csv files
+        Load index from csv files, including the segments not merged yet
+        """
+        previous = self.generation
+        with METRICS.timer('search.load_index'):
+            self.forward_index, self.inverted_index, manifest = load_index(self.dal)
+        self.generation = manifest.get('generation')
+        self.manifest = manifest
+        if self.cache is not None and (self.generation != previous or previous is None):
+            self.cache.clear()
+        if self.compact and not hasattr(self.inverted_index, 'columns'):
+            self.inverted_index = CompactIndex.from_index(self.forward_index, self.inverted_index)
+            self.forward_index = self.inverted_index.doc_table
+        self.sorted_postings = dict()
+        self.positions = None
+        self.norms = None
+        self.norms_model = None
+        self.terms = None
+        self.load_deleted(manifest)
+        if not self.stems_loaded:
+            self.load_stems()
+
+    def load_deleted(self, manifest):
+        """
+        Load the tombstones of the documents deleted but still persisted, which are skipped while
+        scoring. Indexes with segments are purged of them by load_index. The tombstones of
+        indexes with integer doc ids are kept in a Bitmap.
+        :param manifest: the manifest of the index loaded
+        """
+        self.deleted = None
+        self.deleted_keys = frozenset()
+        if manifest.get('segments'):
+            return
+        self.deleted_keys = frozenset(key for key in load_tombstones(self.dal)
+                                      if key in self.forward_index)
+        if not self.deleted_keys:
+            return
+        doc_keys = getattr(self.inverted_index, 'doc_keys', None)
+        if doc_keys is not None:
+            self.deleted = Bitmap(len(doc_keys), (doc for doc, key in enumerate(doc_keys)
+                                                  if key in self.deleted_keys))
+        else:
+            self.deleted = self.deleted_keys
+
+    def load_stems(self):
+        """
+        Warm up the normalizer with the stems persisted next to the index. Stems never change, so
+        they are loaded only once.
+        """
+        self.stems_loaded = True
+        try:
+            self.normalizer.preload(self.dal.load(STEMS))
+        except FileNotFoundError:
+            pass
+
+    def refresh(self):
+        """
+        Reload the indexes only if they were never loaded or if their generation changed since
+        the last load.
+        """
+        generation = load_manifest(self.dal).get('generation')
+        if self.generation is None or generation != self.generation:
+            self.load_index()
+
+
+class NumpySearchEngine(SearchEngine):
+    """
+    A search engine that keeps the posting lists as NumPy arrays and scores a query with
+    vectorized scatter-adds over a dense score accumulator, selecting the top-k documents with
+    argpartition. It needs NumPy installed.
+    """
+
+    def __init__(self, stemmer=None, language='english', dal=None, resident=True, compact=False,
+                 cache=None, scoring=None, max_expansions=50, analyzer=None):
+        """
+        Creates a new instance of the NumpySearchEngine. See SearchEngine for the parameters;
+        this engine is resident by default, since its arrays are built once per load.
+        """
+        if numpy is None:
+            raise ImportError("NumpySearchEngine needs numpy installed")
+        super().__init__(stemmer=stemmer, language=language, dal=dal, resident=resident,
+                         compact=compact, cache=cache, scoring=scoring,
+                         max_expansions=max_expansions, analyzer=analyzer)
+        self.arrays = dict()
+        self.norm_array = None
+        self.doc_keys = list()
+        self.doc_ids = dict()
+        self.live = None
+
+    def load_index(self):
+        """
+        Load the indexes and drop the arrays built for the previous ones.
+        """
+        super().load_index()
+        self.arrays = dict()
+        self.doc_keys = getattr(self.inverted_index, 'doc_keys', None)
+        self.doc_ids = dict()
+        if self.doc_keys is None:
+            self.doc_keys = sorted(self.forward_index.keys())
+            self.doc_ids = {key: doc_id for doc_id, key in enumerate(self.doc_keys)}
+        self.live = None
+        if self.deleted_keys:
+            self.live = numpy.fromiter((key not in self.deleted_keys for key in self.doc_keys),
+                                       bool, len(self.doc_keys))
+
+    def prepare_scoring(self):
+        """
+        Compute the norms of the documents as an array indexed by the doc ids of the arrays, and
+        drop the arrays weighted with another model.
+        """
+        super().prepare_scoring()
+        self.arrays = dict()
+        self.norm_array = None
+        if isinstance(self.norms, dict):
+            self.norm_array = numpy.fromiter((self.norms.get(key, 0.0) for key in self.doc_keys),
+                                             numpy.float64, len(self.doc_keys))
+        elif self.norms is not None:
+            self.norm_array = numpy.frombuffer(self.norms, dtype=numpy.float64)
+
+    def postings(self, stem):
+        """
+        Give the posting list of a stem as NumPy arrays, built once per load. The arrays over
+        mapped or compact indexes share their memory.
+        :param stem: a stem present in the inverted index
+        :return: a tuple with the array of doc ids and the array of weights
+        """
+        if self.norms_model is not self.scoring:
+            self.prepare_scoring()
+        if stem not in self.arrays and self.scoring is not None:
+            self.arrays[stem] = self.__model_postings(stem)
+        if stem not in self.arrays:
+            columns = self.posting_columns(stem)
+            if columns:
+                docs, ntfs, weights, _, _ = columns
+                doc_ids = self.__array(docs, numpy.uint32)
+                if weights is None:
+                    weights = self.__array(ntfs, numpy.float64) * \
+                        log10(len(self.forward_index) / len(docs))
+                else:
+                    weights = self.__array(weights, numpy.float64)
+            else:
+                idf = self.idf(stem)
+                entries = self.entries(stem)
+                doc_ids = numpy.fromiter((self.doc_ids[doc[1]] for doc in entries),
+                                         numpy.uint32, len(entries))
+                weights = numpy.fromiter((doc[3] if len(doc) > 3 else doc[2] * idf
+                                          for doc in entries), numpy.float64, len(entries))
+            self.arrays[stem] = (doc_ids, weights)
+        return self.arrays[stem]
+
+    def __model_postings(self, stem):
+        """
+        Weight the posting list of a stem with the scoring model, summing first the normalized
+        term frequencies of the entries of the same document.
+        """
+        columns = self.posting_columns(stem)
+        if columns:
+            doc_ids = self.__array(columns[0], numpy.uint32)
+            ntfs = self.__array(columns[1], numpy.float64)
+        else:
+            entries = self.entries(stem)
+            doc_ids = numpy.fromiter((self.doc_ids[doc[1]] for doc in entries), numpy.uint32,
+                                     len(entries))
+            ntfs = numpy.fromiter((doc[2] for doc in entries), numpy.float64, len(entries))
+        unique = numpy.unique(doc_ids)
+        ntfs = numpy.bincount(doc_ids, ntfs, minlength=len(self.doc_keys))[unique]
+        idf = self.scoring.idf(len(self.forward_index), len(doc_ids))
+        return unique, self.scoring.term_weight(ntfs, self.norm_array[unique]) * idf
+
+    @staticmethod
+    def __array(column, dtype):
+        """
+        Wrap a column of a posting list as an array, without copies when it is a buffer.
+        """
+        if isinstance(column, (memoryview, array)):
+            return numpy.frombuffer(column, dtype=column.format if isinstance(
+                column, memoryview) else column.typecode)
+        return numpy.fromiter(column, dtype, len(column))
+
+    def rank(self, stems, k=None):
+        """
+        Score the documents that hold the stems with scatter-adds and rank them by relevance
+        :param stems: list with the normalized terms of the query
+        :param k: if given, only the k most relevant documents are returned
+        :return: A list of references ordered by relevance, or None if no document was found
+        """
+        stems = collections.Counter(stems)
+        scores = numpy.zeros(len(self.doc_keys))
+        matched = numpy.zeros(len(self.doc_keys), dtype=bool)
+        for stem, count in stems.items():
+            if stem in self.inverted_index.keys():
+                doc_ids, weights = self.postings(stem)
+                METRICS.count('search.postings_scanned', len(doc_ids))
+                scores += numpy.bincount(doc_ids, weights * count, minlength=len(scores))
+                matched[doc_ids] = True
+        if self.live is not None:
+            matched &= self.live
+        candidates = numpy.flatnonzero(matched)
+        if len(candidates) == 0:
+            return None
+        if k is not None and k < len(candidates):
+            candidates = candidates[numpy.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[numpy.argsort(-scores[candidates], kind='stable')]
+        return [(doc_name, float(scores[doc])) for doc in candidates
+                for doc_name in self.forward_index[self.doc_keys[doc]]]
+
+
+_SHARD = dict()
+
+
+def _initialize_shard(dal):
+    """
+    Keep a resident search engine over a shard in the worker process.
+    """
+    _SHARD['searcher'] = SearchEngine(dal=dal, resident=True)
+
+
+def _shard_statistics(stems):
+    """
+    Give the statistics of the shard held by the worker process.
+    """
+    return _SHARD['searcher'].statistics(stems)
+
+
+def _shard_rank(stems, idfs, k):
+    """
+    Rank the documents of the shard held by the worker process.
+    """
+    return _SHARD['searcher'].rank_with_idf(stems, idfs, k)
+
+
+class ShardedSearchEngine:
+    """
+    A search engine that coordinates the search over the shards of a ShardedIndexEngine. Each
+    shard is kept resident by its own worker process; a query is fanned out first to collect the
+    document frequencies of its stems, so every shard scores with the same global idf, and then
+    to get the top-k documents of each shard, which are merged in the final ranking.
+    """
+
+    def __init__(self, dals, stemmer=None):
+        """
+        Creates a new instance of the ShardedSearchEngine.
+        :param dals: list with the Dao of each shard, like the ones given by
+        IndexEngine.shard_dals
+        :param stemmer: A stemmer to be used to normalize the searched terms. If either a stemmer is
+        not provided, uses NLTK SnowballStemmer as default.
+        """
+        self.normalizer = stemmer
+        self.tokenizer = EnglishRegexpTokenizer()
+        if not self.normalizer:
+            self.normalizer = SnowballStemmerNormalizer()
+        self.workers = [ProcessPoolExecutor(max_workers=1, initializer=_initialize_shard,
+                                            initargs=(dal,)) for dal in dals]
+
+    def search(self, sentence=None, k=None):
+        """
+        Search by the words in the sentence over all shards and bring a result ordered by
+        relevance
+        :param sentence: string of words to be searched for
+        :param k: if given, only the k most relevant documents are returned
+        :return: A list of references ordered by relevance
+        """
+        if not sentence:
+            print("Nothing to do")
+            return None
+        if k is not None and k < 1:
+            raise ValueError("k must be positive, got {}".format(k))
+        stems = list(self.normalizer.normalize_list(self.tokenizer.tokenize(sentence)))
+        statistics = [worker.submit(_shard_statistics, stems) for worker in self.workers]
+        total = 0
+        frequencies = collections.Counter()
+        for future in statistics:
+            documents, shard_frequencies = future.result()
+            total += documents
+            frequencies.update(shard_frequencies)
+        idfs = {stem: log10(total / frequency) for stem, frequency in frequencies.items()}
+        rankings = [worker.submit(_shard_rank, stems, idfs, k) for worker in self.workers]
+        merged = itertools.chain.from_iterable(future.result() for future in rankings)
+        result = sorted(merged, key=lambda entry: (-entry[0], entry[1]))
+        if k is not None:
+            result = result[:k]
+        if len(result) > 0:
+            return [(doc_name, score) for score, doc_name in result]
+        return None
+
+    def close(self):
+        """
+        Stop the worker processes.
         """
-        self.inverted_index = self.dal.load("inverted_index.csv")
-        self.forward_index = self.dal.load("forward_index.csv")
+        for worker in self.workers:
+            worker.shutdown()
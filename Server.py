@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Author: Helton Dória Costa <helton.doria@gmail.com>
+# Copyright (C) 2016-2016
+# URL: <http://github.com/heltondoria/information_retrival>
+# For license information, see LICENSE.TXT
+"""
+Module that contains a local HTTP query service in front of the search engines
+"""
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from Dal import BinaryFileDal, CSVFileDal
+from SearchEngine import SearchEngine
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           500: 'Internal Server Error', 504: 'Gateway Timeout'}
+
+
+class QueryServer:
+    """
+    An asyncio HTTP server that answers GET /search?q=<sentence>&k=<k> with the ranking of a
+    resident SearchEngine as JSON. Queries that arrive while a batch is being formed or scored are
+    searched together by SearchEngine.search_batch, in a worker thread, so the event loop keeps
+    accepting connections. Queries that miss their deadline are answered with 504.
+    """
+
+    def __init__(self, searcher=None, host='127.0.0.1', port=8080, deadline=1.0,
+                 batch_window=0.002, max_batch=64):
+        """
+        Creates a new instance of the QueryServer.
+        :param searcher: the SearchEngine that answers the queries. If not provided, uses a
+        resident SearchEngine over './index/'.
+        :param host: address where the server listens
+        :param port: port where the server listens. If 0, a free port is chosen.
+        :param deadline: number of seconds a query may take, from its arrival to its answer
+        :param batch_window: number of seconds to wait for more queries before scoring a batch
+        :param max_batch: maximum number of queries in a batch
+        """
+        self.searcher = searcher
+        if not self.searcher:
+            self.searcher = SearchEngine(resident=True)
+        self.host = host
+        self.port = port
+        self.deadline = deadline
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.queue = None
+        self.batcher = None
+        self.server = None
+
+    async def start(self):
+        """
+        Start listening and batching queries. The port actually bound is kept in self.port.
+        """
+        self.queue = asyncio.Queue()
+        self.batcher = asyncio.ensure_future(self.__batch_loop())
+        self.server = await asyncio.start_server(self.__handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        """
+        Start the server and serve until it is cancelled.
+        """
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self):
+        """
+        Stop listening, stop batching and shut the worker thread down.
+        """
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.batcher:
+            self.batcher.cancel()
+            try:
+                await self.batcher
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=True)
+
+    async def search(self, sentence, k=None):
+        """
+        Queue a query for the next batch and wait for its result.
+        :param sentence: string of words to be searched for
+        :param k: if given, only the k most relevant documents are returned
+        :return: A list of references ordered by relevance, or None if no document was found
+        :raise asyncio.TimeoutError: if the query is not answered before the deadline
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((sentence, k, future))
+        return await asyncio.wait_for(future, self.deadline)
+
+    async def __batch_loop(self):
+        """
+        Gather the queued queries in batches and score each batch in the worker thread. Queries
+        cancelled by their deadline while waiting are dropped before scoring.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            end = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = end - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            batch = [query for query in batch if not query[2].done()]
+            if not batch:
+                continue
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, self.searcher.search_batch,
+                    [(sentence, k) for sentence, k, _ in batch])
+            except Exception as error:  # pylint: disable=broad-except
+                if len(batch) == 1:
+                    if not batch[0][2].done():
+                        batch[0][2].set_exception(error)
+                    continue
+                # A single malformed query fails its whole batch, so each query is searched alone
+                for query in batch:
+                    await self.__search_alone(loop, *query)
+                continue
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def __search_alone(self, loop, sentence, k, future):
+        """
+        Search a query out of a batch, in the worker thread, and give its result to its future.
+        """
+        if future.done():
+            return
+        try:
+            result = await loop.run_in_executor(self.executor, self.searcher.search, sentence, k)
+        except Exception as error:  # pylint: disable=broad-except
+            if not future.done():
+                future.set_exception(error)
+            return
+        if not future.done():
+            future.set_result(result)
+
+    async def __handle(self, reader, writer):
+        """
+        Answer one HTTP request and close the connection.
+        """
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+            status, body = await self.__respond(request.decode('latin-1').split())
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            return
+        payload = json.dumps(body).encode('utf-8')
+        writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n"
+                     "Connection: close\r\n\r\n".format(status, REASONS[status], len(payload))
+                     .encode('latin-1') + payload)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def __respond(self, request):
+        """
+        Route a request line.
+        :param request: the request line split in method, target and version
+        :return: a tuple with the HTTP status and the object to be sent as JSON
+        """
+        if len(request) < 2:
+            return 400, {'error': 'malformed request'}
+        method, target = request[0], urlsplit(request[1])
+        if target.path != '/search':
+            return 404, {'error': 'not found'}
+        if method != 'GET':
+            return 405, {'error': 'method not allowed'}
+        params = parse_qs(target.query)
+        sentence = params.get('q', [''])[0]
+        if not sentence:
+            return 400, {'error': 'missing parameter q'}
+        try:
+            k = int(params['k'][0]) if 'k' in params else None
+        except ValueError:
+            return 400, {'error': 'k must be an integer'}
+        if k is not None and k < 1:
+            return 400, {'error': 'k must be positive'}
+        try:
+            result = await self.search(sentence, k)
+        except asyncio.TimeoutError:
+            return 504, {'error': 'deadline exceeded'}
+        except ValueError as error:
+            return 400, {'error': str(error)}
+        except Exception as error:  # pylint: disable=broad-except
+            return 500, {'error': str(error)}
+        return 200, {'query': sentence, 'results': result or []}
+
+
+def main():
+    """
+    Serve the index of a folder until interrupted
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--index', default='./index/', help='folder of the index')
+    parser.add_argument('--binary', action='store_true', help='the index is in the binary format')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--deadline', type=float, default=1.0,
+                        help='seconds a query may take before being answered with 504')
+    args = parser.parse_args()
+    dal = BinaryFileDal(args.index) if args.binary else CSVFileDal(args.index)
+    server = QueryServer(SearchEngine(dal=dal, resident=True), args.host, args.port,
+                         args.deadline)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
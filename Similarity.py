@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# Author: Helton Dória Costa <helton.doria@gmail.com>
+# Copyright (C) 2016-2016
+# URL: <http://github.com/heltondoria/information_retrival>
+# For license information, see LICENSE.TXT
+"""
+Module that contains the search for documents similar to a given document or text
+"""
+import collections
+import heapq
+from array import array
+from math import log10, sqrt
+
+from SearchEngine import SearchEngine
+
+
+class SimilarityEngine:
+    """
+    A "more like this" search over the documents of an index. Each document is represented by
+    its TF-IDF vector normalized to unit length, and the vectors are kept as a CSR matrix: the
+    term ids and the weights of all documents in two contiguous arrays, with an array of offsets
+    telling where the row of each document starts. The transposed matrix lists the documents of
+    each term, so only the documents that share one of the top weighted terms of the query are
+    compared with it by the cosine.
+    """
+
+    def __init__(self, searcher=None, top_terms=10):
+        """
+        Creates a new instance of the SimilarityEngine.
+        :param searcher: the SearchEngine whose indexes, normalizer and tokenizer are used. If not
+        provided, uses a resident SearchEngine over './index/'.
+        :param top_terms: number of terms of the query, the ones with the highest weights, whose
+        documents are the candidates to be compared with it
+        """
+        self.searcher = searcher
+        if not self.searcher:
+            self.searcher = SearchEngine(resident=True)
+        self.top_terms = top_terms
+        self.built = False
+        self.generation = None
+        self.doc_keys = list()
+        self.doc_ids = dict()
+        self.term_ids = dict()
+        self.indptr = array('Q')
+        self.indices = array('I')
+        self.data = array('d')
+        self.column_indptr = array('Q')
+        self.column_indices = array('I')
+
+    def refresh(self):
+        """
+        Rebuild the vectors if they were never built or if the generation of the index changed.
+        """
+        self.searcher.refresh()
+        if not self.built or self.searcher.generation != self.generation:
+            self.build()
+
+    def build(self):
+        """
+        Build the normalized TF-IDF vectors of the documents from the inverted index of the
+        searcher, in the CSR format, and their transpose.
+        """
+        forward_index = self.searcher.forward_index
+        inverted_index = self.searcher.inverted_index
+        self.doc_keys = sorted(key for key in forward_index.keys()
+                               if key not in self.searcher.deleted_keys)
+        self.doc_ids = {key: doc_id for doc_id, key in enumerate(self.doc_keys)}
+        terms = sorted(inverted_index.keys())
+        self.term_ids = {term: term_id for term_id, term in enumerate(terms)}
+        rows = [dict() for _ in self.doc_keys]
+        for term_id, term in enumerate(terms):
+            entries = [entry for entry in inverted_index[term] if entry[1] in self.doc_ids]
+            if not entries:
+                continue
+            idf = log10(len(self.doc_keys) / len(entries))
+            for entry in entries:
+                row = rows[self.doc_ids[entry[1]]]
+                row[term_id] = row.get(term_id, 0.0) + \
+                    (entry[3] if len(entry) > 3 else entry[2] * idf)
+        self.indptr = array('Q', [0])
+        self.indices = array('I')
+        self.data = array('d')
+        columns = [array('I') for _ in terms]
+        for doc_id, row in enumerate(rows):
+            norm = sqrt(sum(weight * weight for weight in row.values())) or 1.0
+            for term_id in sorted(row):
+                self.indices.append(term_id)
+                self.data.append(row[term_id] / norm)
+                columns[term_id].append(doc_id)
+            self.indptr.append(len(self.indices))
+        self.column_indptr = array('Q', [0])
+        self.column_indices = array('I')
+        for column in columns:
+            self.column_indices.extend(column)
+            self.column_indptr.append(len(self.column_indices))
+        self.generation = self.searcher.generation
+        self.built = True
+
+    def similar(self, doc_key, k=10):
+        """
+        Find the documents most similar to a document of the index.
+        :param doc_key: the key of the document
+        :param k: number of documents to be returned
+        :return: A list of tuples (doc_name, cosine) ordered by similarity, without the document
+        itself, or None if the document is not in the index or no similar document was found
+        """
+        self.refresh()
+        doc_id = self.doc_ids.get(doc_key)
+        if doc_id is None:
+            return None
+        start, end = self.indptr[doc_id], self.indptr[doc_id + 1]
+        return self.__nearest(dict(zip(self.indices[start:end], self.data[start:end])), k,
+                              doc_id)
+
+    def similar_text(self, text, k=10):
+        """
+        Find the documents most similar to a text, weighted as a document with the idfs of the
+        index.
+        :param text: the text to be compared with the documents
+        :param k: number of documents to be returned
+        :return: A list of tuples (doc_name, cosine) ordered by similarity, or None if no
+        similar document was found
+        """
+        self.refresh()
+        stems = self.searcher.analyze(text)
+        vector = dict()
+        for stem, count in collections.Counter(stems).items():
+            term_id = self.term_ids.get(stem)
+            if term_id is not None:
+                frequency = self.column_indptr[term_id + 1] - self.column_indptr[term_id]
+                vector[term_id] = count / len(stems) * log10(len(self.doc_keys) / frequency)
+        norm = sqrt(sum(weight * weight for weight in vector.values()))
+        if not norm:
+            return None
+        return self.__nearest({term_id: weight / norm for term_id, weight in vector.items()}, k)
+
+    def __nearest(self, vector, k, excluded=None):
+        """
+        Compare a unit vector with the documents that share its top weighted terms.
+        :param vector: dict with the weight of each term id
+        :param k: number of documents to be returned
+        :param excluded: a doc id left out of the result
+        :return: A list of tuples (doc_name, cosine) ordered by similarity, or None if no
+        document was found
+        """
+        top = heapq.nlargest(self.top_terms, vector, key=vector.get)
+        candidates = set()
+        for term_id in top:
+            candidates.update(self.column_indices[self.column_indptr[term_id]:
+                                                  self.column_indptr[term_id + 1]])
+        candidates.discard(excluded)
+        scores = list()
+        for doc_id in candidates:
+            score = 0.0
+            for position in range(self.indptr[doc_id], self.indptr[doc_id + 1]):
+                score += vector.get(self.indices[position], 0.0) * self.data[position]
+            scores.append((score, doc_id))
+        best = heapq.nlargest(k, scores, key=lambda entry: (entry[0], -entry[1]))
+        result = [(doc_name, score) for score, doc_id in best
+                  for doc_name in self.searcher.forward_index[self.doc_keys[doc_id]]]
+        return result if result else None
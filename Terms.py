@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+# Author: Helton Dória Costa <helton.doria@gmail.com>
+# Copyright (C) 2016-2016
+# URL: <http://github.com/heltondoria/information_retrival>
+# For license information, see LICENSE.TXT
+"""
+Module that contains the sorted term dictionary, which expands prefixes, wildcard patterns and
+misspelled words to the terms of an index
+"""
+import bisect
+import itertools
+import re
+
+from Postings import decode_varbyte, encode_varbyte
+
+# Number of terms front coded together; only the first term of each block is kept whole
+TERM_BLOCK_SIZE = 16
+
+
+def _shared_prefix(first, second):
+    """
+    :return: the length of the longest common prefix of two sequences
+    """
+    length = min(len(first), len(second))
+    for position in range(length):
+        if first[position] != second[position]:
+            return position
+    return length
+
+
+def _successor(prefix):
+    """
+    :return: the smallest string greater than every string that starts with prefix
+    """
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class TermDictionary:
+    """
+    A sorted dictionary of the terms of an index, front coded: the terms are split in blocks of
+    TERM_BLOCK_SIZE, and each term is stored as the number of bytes it shares with the previous
+    term of its block followed by the remaining bytes, variable-byte encoded. The first term of
+    each block is also kept whole, so a term is found by a binary search over the first terms
+    and the decoding of a single block, and the terms that start with a prefix are a contiguous
+    range of the dictionary.
+    """
+
+    def __init__(self, blocks=None):
+        """
+        :param blocks: dict with the encoded blocks bound to their first terms, as returned by
+        as_dict, i.e. loaded by a Dao. If not provided, the dictionary starts empty and is filled
+        by append.
+        """
+        self.firsts = list()
+        self.blocks = list()
+        self.size = 0
+        self.last = None
+        self.cached = (None, None)
+        for first, block in sorted((blocks or dict()).items()):
+            self.firsts.append(first)
+            self.blocks.append(bytearray(block))
+        if self.blocks:
+            terms = self.decode(len(self.blocks) - 1)
+            self.size = (len(self.blocks) - 1) * TERM_BLOCK_SIZE + len(terms)
+            self.last = terms[-1]
+
+    @classmethod
+    def from_terms(cls, terms):
+        """
+        :param terms: iterable with the terms, in any order
+        :return: a TermDictionary with the terms
+        """
+        dictionary = cls()
+        for term in sorted(terms):
+            dictionary.append(term)
+        return dictionary
+
+    def append(self, term):
+        """
+        Add a term greater than every term of the dictionary, i.e. while the terms of an index
+        are merged in order.
+        :param term: the term to be added
+        """
+        if self.last is not None and term <= self.last:
+            raise ValueError("Terms must be appended in order: {!r} after {!r}"
+                             .format(term, self.last))
+        encoded = term.encode('utf-8')
+        shared = 0
+        if self.size % TERM_BLOCK_SIZE == 0:
+            self.firsts.append(term)
+            self.blocks.append(bytearray())
+        else:
+            shared = _shared_prefix(self.last.encode('utf-8'), encoded)
+        encode_varbyte((shared, len(encoded) - shared), self.blocks[-1])
+        self.blocks[-1].extend(encoded[shared:])
+        self.size += 1
+        self.last = term
+        self.cached = (None, None)
+
+    def as_dict(self):
+        """
+        :return: dict with the encoded blocks bound to their first terms, to be saved by a Dao
+        """
+        return {first: bytes(block) for first, block in zip(self.firsts, self.blocks)}
+
+    def decode(self, number):
+        """
+        :param number: the number of a block, from 0
+        :return: the list with the terms of the block
+        """
+        data = self.blocks[number]
+        terms = list()
+        previous = b''
+        offset = 0
+        while offset < len(data):
+            (shared, length), offset = decode_varbyte(data, 2, offset)
+            previous = previous[:shared] + bytes(data[offset:offset + length])
+            offset += length
+            terms.append(previous.decode('utf-8'))
+        return terms
+
+    def block(self, number):
+        """
+        :param number: the number of a block, from 0
+        :return: the list with the terms of the block, decoded once for consecutive lookups
+        """
+        cached_number, terms = self.cached
+        if cached_number != number:
+            terms = self.decode(number)
+            self.cached = (number, terms)
+        return terms
+
+    def term(self, position):
+        """
+        :param position: the position of a term in the sorted dictionary
+        :return: the term
+        """
+        return self.block(position // TERM_BLOCK_SIZE)[position % TERM_BLOCK_SIZE]
+
+    def position(self, term):
+        """
+        :param term: a term, held by the dictionary or not
+        :return: the position of the first term of the dictionary that is not lower than term
+        """
+        number = bisect.bisect_right(self.firsts, term) - 1
+        if number < 0:
+            return 0
+        return number * TERM_BLOCK_SIZE + bisect.bisect_left(self.block(number), term)
+
+    def scan(self, position=0):
+        """
+        :param position: the position of the first term to be yielded
+        :return: Yields the terms of the dictionary in order, from position
+        """
+        for number in range(position // TERM_BLOCK_SIZE, len(self.blocks)):
+            terms = self.decode(number)
+            yield from terms[position % TERM_BLOCK_SIZE if number == position // TERM_BLOCK_SIZE
+                             else 0:]
+
+    def prefix(self, prefix, limit=None):
+        """
+        :param prefix: the prefix of the terms
+        :param limit: maximum number of terms returned
+        :return: the sorted list of the terms that start with prefix
+        """
+        terms = self.scan(self.position(prefix))
+        return list(itertools.islice(itertools.takewhile(lambda term: term.startswith(prefix),
+                                                         terms), limit))
+
+    def wildcard(self, pattern, limit=None):
+        """
+        Match a pattern in which * stands for any sequence of characters and ? for a single one.
+        Only the range of the terms that start with the literal prefix of the pattern is scanned,
+        so patterns starting with a wildcard scan the whole dictionary.
+        :param pattern: the pattern, i.e. butterf* or b?tterfl*
+        :param limit: maximum number of terms returned
+        :return: the sorted list of the terms matched by the pattern
+        """
+        literal = re.split(r'[*?]', pattern, maxsplit=1)[0]
+        regex = re.compile(''.join('.*' if char == '*' else '.' if char == '?' else re.escape(char)
+                                   for char in pattern), re.DOTALL)
+        terms = itertools.takewhile(lambda term: term.startswith(literal),
+                                    self.scan(self.position(literal)))
+        return list(itertools.islice((term for term in terms if regex.fullmatch(term)), limit))
+
+    def fuzzy(self, term, distance, limit=None):
+        """
+        Find the terms within a Levenshtein distance of a term. The terms are walked in order as
+        the paths of a trie: the rows of the edit distance matrix of a prefix are shared by all
+        the terms that start with it, and once every cell of a row exceeds the distance, the
+        whole range of the terms that start with that prefix is skipped.
+        :param term: the term to be matched
+        :param distance: maximum number of insertions, deletions and substitutions
+        :param limit: maximum number of terms returned
+        :return: the list of the matched terms, the closest ones first and then in order
+        """
+        matches = list()
+        rows = [list(range(len(term) + 1))]
+        previous = ''
+        position = 0
+        while position < self.size:
+            candidate = self.term(position)
+            del rows[min(_shared_prefix(previous, candidate), len(rows) - 1) + 1:]
+            previous = candidate
+            pruned = None
+            for depth in range(len(rows), len(candidate) + 1):
+                char, above = candidate[depth - 1], rows[-1]
+                row = [above[0] + 1]
+                for column in range(1, len(term) + 1):
+                    row.append(min(row[column - 1] + 1, above[column] + 1,
+                                   above[column - 1] + (term[column - 1] != char)))
+                rows.append(row)
+                if min(row) > distance:
+                    pruned = candidate[:depth]
+                    break
+            if pruned is not None:
+                position = self.position(_successor(pruned))
+                continue
+            if rows[-1][-1] <= distance:
+                matches.append((rows[-1][-1], candidate))
+            position += 1
+        return [candidate for _, candidate in sorted(matches)[:limit]]
+
+    def __contains__(self, term):
+        position = self.position(term)
+        return position < self.size and self.term(position) == term
+
+    def __iter__(self):
+        return self.scan()
+
+    def __len__(self):
+        return self.size
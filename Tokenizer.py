@@ -6,10 +6,21 @@
 """
 Module that contains classes responsible for tokenize strings
 """
+import mmap
+import os
+import re
 from abc import ABCMeta, abstractmethod
 
 from nltk import RegexpTokenizer, corpus
 
+from Normalizer import SnowballStemmerNormalizer
+
+WORDS = re.compile(r'\w+')
+# Runs of ASCII word characters and of the bytes of multi-byte UTF-8 characters, which are split
+# again as text, since \w of a bytes pattern matches only ASCII
+BYTE_WORDS = re.compile(rb'[\w\x80-\xff]+')
+MISSING = object()
+
 
 class Tokenizer(metaclass=ABCMeta):
     """
@@ -56,3 +67,104 @@ class EnglishRegexpTokenizer(Tokenizer):
         :return: A list os tokens
         """
         return self.filter(self.regexp_tokenizer.tokenize(content))
+
+
+class SinglePassAnalyzer(Tokenizer):
+    """
+    A Tokenizer that finds the words with a precompiled pattern, folds their case and drops the
+    stopwords, and whose analyze method also stems them, all in a single pass over the text
+    without intermediate lists. Each word is looked up once in a memo that binds it to its stem,
+    or to None if it is a stopword, so the stopword check and the stem cache cost a single dict
+    lookup. Texts may also be given as UTF-8 bytes, i.e. files mapped in memory.
+    """
+
+    def __init__(self, normalizer=None, stopwords=None, memo_size=1 << 20):
+        """
+        :param normalizer: the Normalizer that stems the words missing from the memo. If not
+        provided, uses a SnowballStemmerNormalizer.
+        :param stopwords: the words to be dropped, in lower case. If not provided, uses NLTK
+        corpus.stopwords.words('english').
+        :param memo_size: maximum number of words kept in the memo. When it is full, the words
+        missing from it go through the normalizer every time.
+        """
+        self.normalizer = normalizer
+        if not self.normalizer:
+            self.normalizer = SnowballStemmerNormalizer()
+        self.stopwords = set(corpus.stopwords.words('english') if stopwords is None else stopwords)
+        self.memo_size = memo_size
+        self.memo = dict.fromkeys(self.stopwords)
+
+    def words(self, content):
+        """
+        :param content: a str, or a bytes like object with UTF-8 text, i.e. bytes or a mmap
+        :return: Yields the words of the content, in lower case
+        """
+        if isinstance(content, str):
+            for match in WORDS.finditer(content):
+                yield match.group().lower()
+            return
+        for match in BYTE_WORDS.finditer(content):
+            word = match.group()
+            if word.isascii():
+                yield word.decode('ascii').lower()
+            else:
+                for part in WORDS.finditer(word.decode('utf-8', 'replace')):
+                    yield part.group().lower()
+
+    def filter(self, tokens):
+        """
+        Remove words in self.stopwords
+        :return: a list of words without words in self.stopwords list
+        """
+        return [token for token in tokens if token not in self.stopwords]
+
+    def tokenize(self, content):
+        """
+        Tokenize words after pass then through the filter
+        :return: A list os tokens, in lower case
+        """
+        return self.filter(self.words(content))
+
+    def normalize(self, word):
+        """
+        Stem a single word going through the memo, i.e. a token given by tokenize to an index
+        engine. Stopwords are stemmed too, but they are never kept in the memo.
+        :param word: a word in lower case
+        :return: the stem of the word
+        """
+        stem = self.memo.get(word)
+        if stem is None:
+            stem = self.normalizer.normalize(word)
+            if word not in self.stopwords and len(self.memo) < self.memo_size:
+                self.memo[word] = stem
+        return stem
+
+    def analyze(self, content):
+        """
+        Turn a text into the stems of its words, without stopwords.
+        :param content: a str, or a bytes like object with UTF-8 text, i.e. bytes or a mmap
+        :return: Yields the stem of each word
+        """
+        memo = self.memo
+        normalize = self.normalizer.normalize
+        for word in self.words(content):
+            stem = memo.get(word, MISSING)
+            if stem is MISSING:
+                stem = None if word in self.stopwords else normalize(word)
+                if len(memo) < self.memo_size:
+                    memo[word] = stem
+            if stem is not None:
+                yield stem
+
+    def analyze_file(self, filename):
+        """
+        Turn a UTF-8 text file into the stems of its words, mapping it in memory instead of
+        reading it into a string.
+        :param filename: the full path name of the file
+        :return: Yields the stem of each word
+        """
+        with open(filename, 'rb') as file:
+            if not os.fstat(file.fileno()).st_size:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield from self.analyze(mapped)
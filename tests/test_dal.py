@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the Daos that persist the indexes
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+
+from Dal import COMMIT_RECORD, TEMP_SUFFIX, WAL_LOG, BinaryFileDal, CSVFileDal, WriteAheadLog
+from IndexEngine import IndexEngine, load_manifest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class DeleteAllTest(unittest.TestCase):
+    """
+    delete_all removes the files of the Dao's own folder, never the ones of the working directory
+    """
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.folder = tempfile.mkdtemp()
+        os.chdir(self.folder)
+        self.path = os.path.join(self.folder, 'index')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+    def test_relative_name_is_resolved_against_the_path(self):
+        for dal in (CSVFileDal(self.path), BinaryFileDal(self.path)):
+            dal.save({'a': {1}}, 'terms.csv')
+            with open('terms.csv', 'w') as file:
+                file.write('not an index\n')
+            dal.delete_all('terms.csv')
+            self.assertFalse(os.path.exists(os.path.join(self.path, 'terms.csv')))
+            self.assertTrue(os.path.exists('terms.csv'))
+
+    def test_delete_inside_a_transaction(self):
+        dal = CSVFileDal(self.path)
+        dal.save({'a': {1}}, 'terms.csv')
+        with open('terms.csv', 'w') as file:
+            file.write('not an index\n')
+        with dal.transaction():
+            dal.delete_all('terms.csv')
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'terms.csv')))
+        self.assertTrue(os.path.exists('terms.csv'))
+
+
+def crash(script):
+    """
+    Run a script in a new process, which is expected to die in the middle of a commit
+    """
+    process = subprocess.run([sys.executable, '-c', textwrap.dedent(script)], cwd=ROOT,
+                             env=dict(os.environ, PYTHONPATH=ROOT))
+    assert process.returncode == 3, process.returncode
+
+
+class RecoverTest(unittest.TestCase):
+    """
+    recover finishes the commits whose record was persisted and drops the temporary files of
+    the writers that died before
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_commit_with_record_is_rolled_forward(self):
+        for dal in (CSVFileDal, BinaryFileDal):
+            with self.subTest(dal=dal.__name__):
+                path = os.path.join(self.path, dal.__name__)
+                dal(path).save({'a': {'x.txt'}}, 'forward_index.csv')
+                dal(path).save({'a': {'old'}}, 'other.csv')
+                crash("""
+                    import os
+                    from Dal import CSVFileDal, {0}
+                    def die(self, staged):
+                        os._exit(3)
+                    CSVFileDal._CSVFileDal__apply = die
+                    dal = {0}({1!r})
+                    with dal.transaction():
+                        dal.save({{'a': {{'y.txt'}}, 'b': {{'z.txt'}}}}, 'forward_index.csv')
+                        dal.delete_all('other.csv')
+                    """.format(dal.__name__, path))
+                self.assertTrue(os.path.exists(os.path.join(path, COMMIT_RECORD)))
+                self.assertEqual(dict(dal(path).load('forward_index.csv')), {'a': {'x.txt'}})
+                dal(path).recover()
+                self.assertEqual(dict(dal(path).load('forward_index.csv')),
+                                 {'a': {'y.txt'}, 'b': {'z.txt'}})
+                self.assertFalse(os.path.exists(os.path.join(path, 'other.csv')))
+                self.assertEqual([name for name in os.listdir(path)
+                                  if name.endswith(TEMP_SUFFIX) or name == COMMIT_RECORD], [])
+
+    def test_temp_files_of_a_dead_writer_are_dropped(self):
+        CSVFileDal(self.path).save({'a': {'x.txt'}}, 'forward_index.csv')
+        crash("""
+            import os
+            from Dal import CSVFileDal
+            dal = CSVFileDal({!r})
+            with dal.transaction():
+                dal.save({{'a': {{'y.txt'}}}}, 'forward_index.csv')
+                os._exit(3)
+            """.format(self.path))
+        temps = [name for name in os.listdir(self.path) if name.endswith(TEMP_SUFFIX)]
+        self.assertEqual(len(temps), 1)
+        self.assertFalse(os.path.exists(os.path.join(self.path, COMMIT_RECORD)))
+        dal = CSVFileDal(self.path)
+        with dal.transaction():
+            dal.save({'b': {'z.txt'}}, 'doc_lengths.csv')
+            running = [name for name in os.listdir(self.path)
+                       if name.endswith(TEMP_SUFFIX) and name not in temps]
+            dal.recover()
+            remaining = [name for name in os.listdir(self.path) if name.endswith(TEMP_SUFFIX)]
+        self.assertEqual(remaining, running)
+        self.assertEqual(dict(dal.load('forward_index.csv')), {'a': {'x.txt'}})
+        self.assertEqual(dict(dal.load('doc_lengths.csv')), {'b': {'z.txt'}})
+
+
+class WriteAheadLogTest(unittest.TestCase):
+    """
+    The write-ahead log gives back the batches not committed yet, up to the first torn one
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_torn_last_record_is_ignored(self):
+        wal = WriteAheadLog(self.path)
+        wal.append(1, {'k1': ('a.txt', ['blue'])})
+        wal.append(2, {'k2': ('b.txt', ['sky'])})
+        with open(os.path.join(self.path, WAL_LOG), 'a') as file:
+            file.write('3,"{\'k3\': (\'c.txt\', [\'gr')
+        self.assertEqual(list(wal.replay()), [(1, {'k1': ('a.txt', ['blue'])}),
+                                              (2, {'k2': ('b.txt', ['sky'])})])
+
+    def test_only_batches_after_the_manifest_are_replayed(self):
+        indexer = IndexEngine(dal=CSVFileDal(self.path), wal=True)
+        indexer.add_documents({'k1': ('a.txt', ['blue'])})
+        self.assertEqual(load_manifest(indexer.dal)['wal_sequence'], 1)
+        indexer.wal.append(1, {'k9': ('stale.txt', ['stale'])})
+        indexer.wal.append(2, {'k2': ('b.txt', ['sky'])})
+        self.assertEqual([sequence for sequence, _ in indexer.wal.replay(1)], [2])
+        recovered = IndexEngine(dal=CSVFileDal(self.path), wal=True)
+        recovered.initialize()
+        self.assertEqual(dict(recovered.forward_index), {'k1': {'a.txt'}, 'k2': {'b.txt'}})
+        self.assertEqual(recovered.wal_sequence, 2)
+        self.assertEqual(list(recovered.wal.replay()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
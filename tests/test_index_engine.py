@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the index engines
+"""
+import shutil
+import tempfile
+import unittest
+
+from Dal import BinaryFileDal, CSVFileDal, SqliteDal
+from IndexEngine import IncrementalIndexEngine, IndexEngine
+from SearchEngine import SearchEngine
+
+DOCUMENTS = {'k1': ('a.txt', ['blue', 'sky']), 'k2': ('b.txt', ['green', 'grass'])}
+
+
+class ResetTest(unittest.TestCase):
+    """
+    After a reset, search engines find nothing, even the ones kept resident across the reset
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def check_reset(self, engine, dal):
+        indexer = engine(dal=dal(self.path))
+        indexer.add_documents(dict(DOCUMENTS))
+        resident = SearchEngine(dal=dal(self.path), resident=True)
+        self.assertEqual([name for name, _ in resident.search('sky')], ['a.txt'])
+        indexer.reset()
+        self.assertFalse(resident.search('sky'))
+        self.assertFalse(SearchEngine(dal=dal(self.path)).search('sky'))
+
+    def test_reset_then_search(self):
+        for dal in (CSVFileDal, BinaryFileDal, SqliteDal):
+            for engine in (IndexEngine, IncrementalIndexEngine):
+                with self.subTest(dal=dal.__name__, engine=engine.__name__):
+                    self.check_reset(engine, dal)
+                    shutil.rmtree(self.path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the pipelines that feed the index engines
+"""
+import contextlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from Dal import CSVFileDal
+from IndexEngine import CompactIndexEngine, IncrementalIndexEngine, IndexEngine, load_index
+from Pipeline import ParallelIngestPipeline
+
+RESOURCES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         'resources')
+
+
+class CrashingDal(CSVFileDal):
+    """
+    A CSVFileDal whose next transaction fails before anything is committed, as if the process
+    crashed while indexing
+    """
+
+    crash = False
+
+    @contextlib.contextmanager
+    def transaction(self):
+        if self.crash:
+            self.crash = False
+            raise RuntimeError('crash')
+        with super().transaction():
+            yield
+
+
+class WriteAheadLogTest(unittest.TestCase):
+    """
+    The documents ingested by a ParallelIngestPipeline are logged, so they can be replayed
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def check_replay(self, engine, workers):
+        expected = IndexEngine(dal=CSVFileDal(os.path.join(self.path, 'expected')))
+        ParallelIngestPipeline(expected, workers=1).run(RESOURCES)
+        dal = CrashingDal(os.path.join(self.path, engine.__name__ + str(workers)))
+        indexer = engine(dal=dal, wal=True)
+        dal.crash = True
+        with self.assertRaises(RuntimeError):
+            ParallelIngestPipeline(indexer, workers=workers).run(RESOURCES)
+        with self.assertRaises(FileNotFoundError):
+            load_index(dal)
+        recovered = engine(dal=dal, wal=True)
+        recovered.initialize()
+        forward, inverted, _ = load_index(dal)
+        self.assertEqual(dict(forward), dict(expected.forward_index))
+        self.assertEqual(set(inverted.keys()), set(expected.inverted_index.keys()))
+
+    def test_crashed_batch_is_replayed(self):
+        for engine in (IndexEngine, CompactIndexEngine, IncrementalIndexEngine):
+            for workers in (1, 2):
+                with self.subTest(engine=engine.__name__, workers=workers):
+                    self.check_replay(engine, workers)
+
+    def test_log_is_truncated_after_commit(self):
+        indexer = IndexEngine(dal=CSVFileDal(self.path), wal=True)
+        ParallelIngestPipeline(indexer, workers=1).run(RESOURCES)
+        self.assertEqual(list(indexer.wal.replay()), [])
+        self.assertEqual(indexer.wal_sequence, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the compressed posting lists and of their binary format
+"""
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from Dal import FORMAT_VERSION, HEADER, BinaryFileDal, MappedCompressedPostings
+from Postings import BLOCK_SIZE, BlockPostings, decode_varbyte, encode_blocks, encode_varbyte
+from SearchEngine import PostingCursor
+
+
+def posting_list(count, seed=0):
+    """
+    :return: a tuple with sorted doc ids, in which a doc id may be repeated, and term frequencies
+    """
+    generator = random.Random(seed)
+    docs, doc = [], 0
+    for _ in range(count):
+        doc += generator.choice((0, 1, 1, 2, 3, 130, 20000))
+        docs.append(doc)
+    return docs, [generator.randint(1, 300) for _ in range(count)]
+
+
+class VarbyteTest(unittest.TestCase):
+    """
+    Integers survive a round trip through the variable-byte code
+    """
+
+    def test_round_trip(self):
+        values = [0, 1, 127, 128, 255, 16383, 16384, 2 ** 32, 2 ** 63 - 1, 5, 0]
+        data = encode_varbyte(values)
+        self.assertEqual(decode_varbyte(data, len(values)), (values, len(data)))
+
+    def test_decode_from_offset(self):
+        data = encode_varbyte([300], bytearray(b'\xff\x01'))
+        self.assertEqual(decode_varbyte(data, 1, 2), ([300], len(data)))
+
+
+class BlockPostingsTest(unittest.TestCase):
+    """
+    Posting lists encoded by encode_blocks are read back entry by entry and searched through
+    their skip table
+    """
+
+    def setUp(self):
+        self.docs, self.tfs = posting_list(3 * BLOCK_SIZE + 17)
+        self.lengths = [doc % 7 + 300 for doc in range(self.docs[-1] + 1)]
+        self.postings = BlockPostings(memoryview(encode_blocks(self.docs, self.tfs)),
+                                      len(self.docs), self.lengths)
+
+    def test_round_trip(self):
+        for count in (1, BLOCK_SIZE - 1, BLOCK_SIZE, BLOCK_SIZE + 1, len(self.docs)):
+            with self.subTest(count=count):
+                docs, tfs = self.docs[:count], self.tfs[:count]
+                postings = BlockPostings(encode_blocks(docs, tfs), count, self.lengths)
+                self.assertEqual(list(postings), [(doc, tf, tf / self.lengths[doc])
+                                                  for doc, tf in zip(docs, tfs)])
+                self.assertEqual(list(postings.column(0)), docs)
+                self.assertEqual(list(postings.column(2)), tfs)
+
+    def test_bisect_across_blocks(self):
+        column = self.postings.column(0)
+        for target in [0, self.docs[-1], self.docs[-1] + 1] + self.docs[BLOCK_SIZE - 2:
+                                                                        BLOCK_SIZE + 2]:
+            for low in (0, BLOCK_SIZE - 1, BLOCK_SIZE, 2 * BLOCK_SIZE + 5):
+                expected = max(low, next((position for position, doc in enumerate(self.docs)
+                                          if doc >= target), len(self.docs)))
+                with self.subTest(target=target, low=low):
+                    self.assertEqual(column.bisect_left(target, low), expected)
+
+    def test_cursor_advances_across_blocks(self):
+        cursor = PostingCursor(self.postings.column(0), self.postings.column(1), 1.0)
+        for target in sorted(set(self.docs[::BLOCK_SIZE // 3]))[1:] + [self.docs[-1]]:
+            before = cursor.position
+            cursor.advance(target)
+            self.assertEqual(cursor.doc(), target)
+            self.assertEqual(cursor.position, self.docs.index(target, before))
+        cursor.advance(self.docs[-1] + 1)
+        self.assertIsNone(cursor.doc())
+
+    def test_reads_the_buffer_in_place(self):
+        buffer = bytearray(encode_blocks(self.docs, self.tfs))
+        view = memoryview(buffer)
+        postings = BlockPostings(view[0:len(buffer)], len(self.docs), self.lengths)
+        self.assertIsInstance(postings.data, memoryview)
+        self.assertEqual(postings.column(0)[len(self.docs) - 1], self.docs[-1])
+
+
+class CompressedIndexTest(unittest.TestCase):
+    """
+    Compressed indexes give back their entries, and indexes of older versions are rejected
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.dal = BinaryFileDal(self.path, compression='varbyte')
+        self.index = {'blue': {(1, 'k1', 0.5), (2, 'k2', 0.25)}, 'sky': {(3, 'k2', 0.375)}}
+        self.dal.save(self.index, 'inverted_index.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_round_trip(self):
+        with self.dal.load('inverted_index.csv') as index:
+            self.assertIsInstance(index, MappedCompressedPostings)
+            self.assertEqual({key: set(value) for key, value in index.items()}, self.index)
+
+    def test_version_1_is_rejected(self):
+        filename = os.path.join(self.path, self.dal.binary_name('inverted_index.csv'))
+        with open(filename, 'r+b') as file:
+            header = list(HEADER.unpack(file.read(HEADER.size)))
+            self.assertEqual(header[2], FORMAT_VERSION)
+            header[2] = 1
+            file.seek(0)
+            file.write(HEADER.pack(*header))
+        with self.assertRaisesRegex(ValueError, 'format version'):
+            self.dal.load('inverted_index.csv')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the parser of structured queries
+"""
+import shutil
+import tempfile
+import unittest
+
+from Dal import CSVFileDal
+from IndexEngine import IndexEngine
+from Query import And, Not, QueryParser
+from SearchEngine import SearchEngine
+
+
+def analyze(text):
+    """
+    Lower case the words, without stemming them, dropping 'the' as a stopword
+    """
+    return [word for word in text.lower().split() if word != 'the']
+
+
+class NegationTest(unittest.TestCase):
+    """
+    Negated operands of a disjunction exclude documents from their siblings
+    """
+
+    def setUp(self):
+        self.parser = QueryParser(analyze)
+
+    def parse(self, sentence):
+        return repr(self.parser.parse(sentence))
+
+    def test_implicit_disjunction_is_folded_into_a_conjunction(self):
+        query = self.parser.parse('blue NOT butterfly')
+        self.assertIsInstance(query, And)
+        self.assertEqual(repr(query), 'AND(blue, NOT(butterfly))')
+        self.assertEqual(self.parse('blue sky NOT butterfly NOT moth'),
+                         'AND(OR(blue, sky), NOT(butterfly), NOT(moth))')
+
+    def test_explicit_disjunction_is_folded_into_a_conjunction(self):
+        self.assertEqual(self.parse('blue OR NOT butterfly'), 'AND(blue, NOT(butterfly))')
+        self.assertEqual(self.parse('(blue OR sky) NOT butterfly'),
+                         'AND(OR(blue, sky), NOT(butterfly))')
+
+    def test_folding_stays_inside_groups(self):
+        self.assertEqual(self.parse('green (blue NOT butterfly)'),
+                         'OR(green, AND(blue, NOT(butterfly)))')
+
+    def test_conjunction_and_single_negation_are_kept(self):
+        self.assertEqual(self.parse('blue AND NOT butterfly'), 'AND(blue, NOT(butterfly))')
+        self.assertIsInstance(self.parser.parse('NOT butterfly'), Not)
+        self.assertEqual(self.parse('the NOT butterfly'), 'NOT(butterfly)')
+
+    def test_disjunction_of_negations_only_is_rejected(self):
+        for sentence in ('NOT blue NOT butterfly', 'NOT blue OR NOT butterfly',
+                         'green AND (NOT blue OR NOT butterfly)'):
+            with self.subTest(sentence=sentence):
+                with self.assertRaises(ValueError):
+                    self.parser.parse(sentence)
+
+
+class NegationSearchTest(unittest.TestCase):
+    """
+    Searching with a negated word returns only the documents of the other words without it
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        IndexEngine(dal=CSVFileDal(self.path)).add_documents({
+            'k1': ('a.txt', ['blue', 'butterfly']), 'k2': ('b.txt', ['blue', 'sky']),
+            'k3': ('c.txt', ['green', 'grass'])})
+        self.searcher = SearchEngine(dal=CSVFileDal(self.path))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_negated_word_excludes(self):
+        for sentence in ('blue NOT butterfly', 'blue OR NOT butterfly', 'blue AND NOT butterfly'):
+            with self.subTest(sentence=sentence):
+                self.assertEqual([name for name, _ in self.searcher.search(sentence)], ['b.txt'])
+
+    def test_negations_only_are_rejected(self):
+        with self.assertRaises(ValueError):
+            self.searcher.search('NOT blue NOT butterfly')
+
+
+if __name__ == '__main__':
+    unittest.main()